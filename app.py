@@ -19,12 +19,24 @@ __license__ = "GPLv3"
 
 from collections import defaultdict
 from typing import Tuple
-from flask import Flask, render_template, request, session
-from markupsafe import escape
-from lib.config import InvalidConfig, parse_config
+from flask import (
+    Flask, Response, g, jsonify, make_response, request, session,
+    stream_with_context, url_for
+)
+from flask import render_template as flask_render_template
+from flask.sessions import SecureCookieSessionInterface
+from markupsafe import Markup, escape
+from lib import bulk, columnar, compression, metrics, profiling, watch
+from lib.cache import TTLCache
+from lib.collector import StatsCollector
+from lib.config import InvalidConfig, config_store, parse_config
+from lib.timeseries import TIERS, TimeSeriesStore
+import hashlib
+import json
 import mdb
 import re
 import logging
+import time
 
 
 logging.basicConfig(
@@ -50,6 +62,281 @@ flask_config = config.flask.items()
 for key, value in flask_config:
     app.config[key] = value
 
+# production: no template mtime checks, every template compiled up front
+if config.glob.render_mode == "production":
+    app.config["TEMPLATES_AUTO_RELOAD"] = False
+
+    for name in app.jinja_env.list_templates(extensions=["html"]):
+        app.jinja_env.get_template(name)
+
+# catalogs, column lists and results, shared by the gunicorn workers of the
+# host with the sqlite or redis backend
+mdb.use_cache_backend(config.glob.cache)
+
+# (server, config version) -> (catalog, rendered nav menu)
+nav_cache = TTLCache(ttl=86400, maxsize=256)
+# config version -> misc queries json
+misc_json_cache = TTLCache(ttl=86400, maxsize=4)
+
+# trends of the stats_mysql_* counters, sampled in the background
+stats_store = None
+
+if config.glob.collector.enabled:
+    collector_config = config.glob.collector
+    stats_store = TimeSeriesStore(
+        collector_config.path,
+        tiers=((collector_config.interval, TIERS[0][1]),) + TIERS[1:]
+    )
+    collector = StatsCollector(
+        stats_store,
+        mdb.get_servers_by_tag,
+        lambda server: mdb.sample_stats(db, server),
+        interval=collector_config.interval
+    )
+
+    if not collector.start():
+        logging.info("Stats are collected by another process")
+
+
+metrics.registry.add_collector(lambda: mdb.metric_families(db))
+
+
+def render_template(template, **context) -> str:
+    with metrics.render_duration.time(template=template), profiling.phase("render"):
+        return flask_render_template(template, **context)
+
+
+class ProfiledSessionInterface(SecureCookieSessionInterface):
+    """Counts loading and saving the session cookie as the session phase of
+    the request profile"""
+
+    def open_session(self, app, request):
+        with profiling.phase("session"):
+            return super().open_session(app, request)
+
+    def save_session(self, app, session, response):
+        with profiling.phase("session"):
+            return super().save_session(app, session, response)
+
+
+app.session_interface = ProfiledSessionInterface()
+
+stack_sampler = profiling.StackSampler()
+slow_log = None
+
+
+def get_slow_log():
+    global slow_log
+
+    profiling_config = mdb.get_config(config_file).glob.profiling
+
+    if slow_log is None or slow_log.path != profiling_config.path:
+        slow_log = profiling.SlowRequestLog(profiling_config.path, profiling_config.log_size)
+
+    slow_log.size = profiling_config.log_size
+
+    return slow_log
+
+
+@app.before_request
+def start_profile() -> None:
+    """Profiles the request when profiling is enabled in the config or the
+    profiling header carries the configured token"""
+    profiling_config = mdb.get_config(config_file).glob.profiling
+    token = profiling_config.header_token
+    forced = bool(token) and request.headers.get("X-ProxyWeb-Profile") == token
+
+    # a table watch lasts as long as its page is open
+    if not (profiling_config.enabled or forced) or request.endpoint == "watch_table":
+        return
+
+    stack_sampler.interval = profiling_config.sample_interval
+    g.profile_forced = forced
+    stack_sampler.add(profiling.begin(profiling.RequestProfile(
+        request.endpoint or "unknown",
+        request.path,
+        request.method,
+        cprofile=forced or profiling_config.cprofile
+    )))
+
+
+@app.before_request
+def start_request_timer() -> None:
+    g.request_start = time.perf_counter()
+
+
+# registered before the metrics, so it runs after them: the metrics count
+# the rendered bytes
+@app.after_request
+def compress_response(response):
+    """Compresses html, json, csv... for the clients that accept it, streamed
+    responses chunk by chunk"""
+    compression_config = mdb.get_config(config_file).glob.compression
+
+    if (
+        not compression_config.enabled
+        or response.status_code < 200
+        or response.status_code in (204, 206, 304)
+        or response.direct_passthrough
+        or "Content-Encoding" in response.headers
+        or not compression.compressible(response.mimetype)
+        # events have to reach the browser as they are sent
+        or response.mimetype == "text/event-stream"
+    ):
+        return response
+
+    response.vary.add("Accept-Encoding")
+
+    if not response.is_streamed and (response.calculate_content_length() or 0) < compression_config.min_size:
+        return response
+
+    encoding = compression.negotiate(request.headers.get("Accept-Encoding", ""))
+
+    if encoding is None:
+        return response
+
+    if response.is_streamed:
+        response.response = compressed_body(response.response, encoding, compression_config.level)
+        response.headers.pop("Content-Length", None)
+    else:
+        response.set_data(compression.compress(response.get_data(), encoding, compression_config.level))
+
+    response.headers["Content-Encoding"] = encoding
+
+    return response
+
+
+def compressed_body(body, encoding, level):
+    try:
+        yield from compression.compress_stream(
+            (chunk.encode() if isinstance(chunk, str) else chunk for chunk in body),
+            encoding,
+            level
+        )
+    finally:
+        if hasattr(body, "close"):
+            body.close()
+
+
+static_assets = compression.StaticAssets(app.static_folder)
+
+
+@app.url_defaults
+def static_version(endpoint, values) -> None:
+    """Static URLs carry the hash of the file, so a release changes them"""
+    if endpoint == "static" and "filename" in values:
+        version = static_assets.version(values["filename"])
+
+        if version is not None:
+            values.setdefault("v", version)
+
+
+def serve_static(filename) -> Response:
+    """Static files from memory, compressed once per encoding. A URL with the
+    current hash of the file is cached for static_max_age, the others are
+    revalidated"""
+    asset = static_assets.get(filename)
+
+    if asset is None:
+        # the generic error handler would answer a 500 page
+        return Response("Not Found", status=404, mimetype="text/plain")
+
+    compression_config = mdb.get_config(config_file).glob.compression
+    encoding = None
+
+    if (
+        compression_config.enabled
+        and compression.compressible(asset.mimetype)
+        and len(asset.data) >= compression_config.min_size
+    ):
+        encoding = compression.negotiate(request.headers.get("Accept-Encoding", ""))
+
+    body, etag = asset.variant(encoding, compression_config.level)
+
+    response = Response(body, mimetype=asset.mimetype)
+    response.set_etag(etag)
+    response.last_modified = asset.mtime
+    response.vary.add("Accept-Encoding")
+
+    if encoding is not None:
+        response.headers["Content-Encoding"] = encoding
+
+    if request.args.get("v") == asset.version:
+        response.cache_control.public = True
+        response.cache_control.max_age = compression_config.static_max_age
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.no_cache = True
+
+    return response.make_conditional(request)
+
+
+app.view_functions["static"] = serve_static
+
+
+@app.after_request
+def record_request_metrics(response):
+    endpoint = request.endpoint or "unknown"
+    server = (request.view_args or {}).get("server", "")
+    start = g.get("request_start", time.perf_counter())
+
+    # keep the label set bounded, the server comes from the url
+    if server not in mdb.get_config(config_file).servers:
+        server = ""
+
+    # observed on close so streamed responses are measured completely
+    response.call_on_close(lambda: metrics.request_duration.observe(
+        time.perf_counter() - start,
+        endpoint=endpoint,
+        server=server
+    ))
+
+    if profiling.current() is not None:
+        response.call_on_close(finish_profile(response.status_code, g.get("profile_forced", False)))
+
+    if response.is_streamed:
+        response.response = count_bytes(response.response, endpoint)
+    else:
+        metrics.bytes_rendered.inc(response.calculate_content_length() or 0, endpoint=endpoint)
+
+    return response
+
+
+def finish_profile(status, forced):
+    def finish():
+        profile = profiling.end()
+
+        if profile is None:
+            return
+
+        stack_sampler.remove(profile)
+
+        # requests profiled on demand are always logged
+        if forced or profile.duration >= mdb.get_config(config_file).glob.profiling.threshold:
+            try:
+                get_slow_log().add(profile, status)
+            except Exception as e:
+                logging.error(f"Cannot write the slow request log: {e}")
+
+    return finish
+
+
+def count_bytes(body, endpoint):
+    try:
+        for chunk in body:
+            metrics.bytes_rendered.inc(len(chunk), endpoint=endpoint)
+
+            yield chunk
+    finally:
+        if hasattr(body, "close"):
+            body.close()
+
+
+@app.route("/metrics")
+def render_metrics():
+    """Prometheus/OpenMetrics text exposition"""
+    return Response(metrics.registry.render(), mimetype="text/plain; version=0.0.4")
+
 
 @app.route("/")
 def dashboard() -> str:
@@ -60,10 +347,11 @@ def dashboard() -> str:
     server = config.glob.default_server
     session["history"] = []
     session["server"] = server
-    session["dblist"] = mdb.get_all_dbs_and_tables(db, server)
-    session["servers"] = mdb.get_servers()
     session["read_only"] = mdb.get_read_only(server)
 
+    # the catalog lives server side, the session only references the server
+    mdb.get_catalog(db, server, refresh=True)
+
     return render_template("dashboard.html", server=server)
 
 
@@ -74,42 +362,301 @@ def render_show_table_content(
     database="main",
     table="global_variables"
 ) -> str:
-    # refresh the tablelist if changing to a new server
-
-    if server not in session["dblist"]:
-        session["dblist"].update(mdb.get_all_dbs_and_tables(db, server))
-
-    session["servers"] = mdb.get_servers()
+    session.setdefault("history", [])
     session["server"] = server
     session["table"] = table
     session["database"] = database
 
-    content = mdb.get_table_content(db, server, database, table)
+    # a runtime table with a ProxySQL checksum isn't even queried on a match
+    fingerprint = prefetched("checksum", lambda: mdb.get_checksum_fingerprint(db, server, database, table))
 
-    return render_template(
+    if fingerprint is not None:
+        etag = page_etag(server, fingerprint)
+
+        if request.if_none_match.contains_weak(etag):
+            return not_modified(etag)
+
+    content = prefetched("content", lambda: get_table_view(server, database, table))
+    page_fingerprint = fingerprint
+
+    if fingerprint is None and not isinstance(content["rows"], mdb.RowStream):
+        if content.get("ajax"):
+            # the page only has the columns, the rows come from /data/
+            page_fingerprint = mdb.fingerprint_rows(content["column_names"], [])
+        else:
+            fingerprint = page_fingerprint = mdb.fingerprint_rows(content["column_names"], content["rows"])
+
+    etag = page_etag(server, page_fingerprint) if page_fingerprint is not None else None
+
+    if etag is not None and request.if_none_match.contains_weak(etag):
+        return not_modified(etag)
+
+    response = make_response(render_content(
         "show_table_info.html",
         content=content,
         read_only=mdb.get_read_only(server),
-        misc=mdb.get_config(config_file).misc
+        fingerprint=fingerprint,
+        fingerprinted=mdb.fingerprinted(database),
+        fingerprint_url=url_for(
+            "render_table_fingerprint",
+            server=server,
+            database=database,
+            table=table
+        ),
+        watch_url=url_for(
+            "watch_table",
+            server=server,
+            database=database,
+            table=table
+        ),
+        importable=database == "main" and table in bulk.LOAD_COMMANDS
+    ))
+    response.cache_control.no_cache = True
+
+    if etag is not None:
+        response.set_etag(etag, weak=True)
+
+    return response
+
+
+def page_etag(server, fingerprint) -> str:
+    """The table fingerprint plus everything else the page is rendered from:
+    the config, the catalog in the nav menu and the session"""
+    try:
+        catalog = mdb.get_catalog(db, server)
+    except Exception:
+        catalog = {}
+
+    state = repr((
+        fingerprint,
+        config_version(),
+        sorted(catalog.items()),
+        session.get("history"),
+        session.get("read_only"),
+    ))
+
+    return hashlib.sha1(state.encode()).hexdigest()
+
+
+def not_modified(etag) -> Response:
+    response = Response(status=304)
+    response.set_etag(etag, weak=True)
+    response.cache_control.no_cache = True
+
+    return response
+
+
+@app.route("/<server>/<database>/<table>/fingerprint/")
+def render_table_fingerprint(server, database, table) -> Response:
+    """Lets an open table page poll whether the table changed without
+    fetching the page"""
+    response = jsonify(fingerprint=prefetched(
+        "fingerprint",
+        lambda: mdb.get_table_fingerprint(db, server, database, table)
+    ))
+    response.cache_control.no_store = True
+
+    return response
+
+
+@app.route("/<server>/<database>/<table>/watch/")
+def watch_table(server, database, table) -> Response:
+    """Server-Sent Events with the whole table first, then only the rows that
+    changed; the table is polled once for every viewer of it"""
+    watch_config = mdb.get_config(config_file).glob.watch
+    subscription = watch.Subscription()
+
+    # every open stream holds a thread of the worker, the page polls the
+    # fingerprint instead once they'd take too many of them
+    try:
+        key = mdb.watch_table(db, server, database, table, subscription, watch_config.wsgi_viewers)
+    except watch.TooManyViewers as e:
+        response = Response(str(e), status=503, mimetype="text/plain")
+        response.headers["Retry-After"] = str(int(watch_config.heartbeat))
+
+        return response
+
+    heartbeat = watch_config.heartbeat
+
+    def events():
+        yield "retry: 5000\n\n"
+
+        while True:
+            # a comment keeps proxies from closing an idle stream and
+            # notices viewers that went away
+            yield subscription.get(timeout=heartbeat) or ": keepalive\n\n"
+
+    response = Response(events(), mimetype="text/event-stream")
+    response.cache_control.no_cache = True
+    response.headers["X-Accel-Buffering"] = "no"
+    response.call_on_close(lambda: mdb.unwatch_table(key, subscription))
+
+    return response
+
+
+def render_content(template, content, **context):
+    """Streams the page while the rows are fetched when they come from a
+    RowStream, renders it in one go otherwise"""
+    if not isinstance(content["rows"], mdb.RowStream):
+        return render_template(template, content=content, **context)
+
+    context["content"] = content
+    app.update_template_context(context)
+
+    stream = app.jinja_env.get_template(template).stream(context)
+    # flush rendered html in a few larger writes rather than per row
+    stream.enable_buffering(50)
+
+    response = Response(
+        stream_with_context(profiling.timed_iter(stream, "render")),
+        mimetype="text/html"
     )
+    # hand the connection back even if the client went away mid-stream
+    response.call_on_close(content["rows"].close)
+
+    return response
+
+
+def streaming_enabled(route) -> bool:
+    return route in mdb.get_config(config_file).glob.streaming.routes
+
+
+def get_table_view(server, database, table) -> dict:
+    """Only the columns when DataTables pages the table server side, all the
+    rows streamed or fetched at once otherwise"""
+    glob = mdb.get_config(config_file).glob
+
+    if not glob.server_side_tables and streaming_enabled("table"):
+        return mdb.stream_table_content(
+            db,
+            server,
+            database,
+            table,
+            glob.streaming.chunk_size,
+            glob.streaming.max_rows
+        )
+
+    if not glob.server_side_tables:
+        return mdb.get_table_content(db, server, database, table)
+
+    return {
+        "column_names": mdb.get_table_columns(db, server, database, table),
+        "rows": [],
+        "ajax": url_for(
+            "render_table_data",
+            server=server,
+            database=database,
+            table=table
+        ),
+    }
+
+
+def table_page_args(args) -> dict:
+    """The mdb.get_table_page arguments of a DataTables request"""
+    order = []
+    while "order[{}][column]".format(len(order)) in args:
+        index = len(order)
+        order.append((
+            args.get("order[{}][column]".format(index), 0, type=int),
+            args.get("order[{}][dir]".format(index), "asc"),
+        ))
+
+    column_search = {}
+    index = 0
+    while "columns[{}][data]".format(index) in args:
+        value = args.get("columns[{}][search][value]".format(index), "")
+        if value:
+            column_search[index] = value
+        index += 1
+
+    return {
+        "start": args.get("start", 0, type=int),
+        "length": args.get("length", -1, type=int),
+        "order": order,
+        "search": args.get("search[value]", ""),
+        "column_search": column_search,
+    }
+
+
+def prefetched(name, load):
+    """What the ASGI app already read from the server on its event loop for
+    this request, see asgi.py, or load() when served by WSGI. An error it
+    ran into is raised here, so the error page is the same"""
+    values = request.environ.get("proxyweb.prefetched") or {}
+
+    if "error" in values:
+        raise values["error"]
+
+    return values[name] if name in values else load()
+
+
+@app.route("/<server>/<database>/<table>/data/")
+def render_table_data(server, database, table):
+    """DataTables server-side processing endpoint"""
+    args = request.args
+
+    page = prefetched("page", lambda: mdb.get_table_page(
+        db,
+        server,
+        database,
+        table,
+        **table_page_args(args)
+    ))
+
+    body = {
+        "draw": args.get("draw", 0, type=int),
+        "recordsTotal": page["records_total"],
+        "recordsFiltered": page["records_filtered"],
+    }
+
+    # the table view asks for the columns, the rows stay the default
+    if args.get("format") == "columnar":
+        rows = page["rows"]
+
+        if not isinstance(rows, columnar.ColumnarResult):
+            rows = columnar.from_rows(page["column_names"], rows)
+
+        body["columnar"] = rows.to_wire()
+    else:
+        body["data"] = list(page["rows"])
+
+    return jsonify(body)
 
 
 @app.route("/<server>/<database>/<table>/sql/", methods=["GET", "POST"])
 def render_change(server, database, table) -> str:
     error = ""
     message = ""
+    stdout = ""
     stderr = ""
     session["sql"] = request.form["sql"]
 
     logging.debug(session["history"])
     select = re.match(r"^SELECT.*FROM.*$", session["sql"], re.M | re.I)
 
-    if select:
+    if select and request.form.get("fanout"):
+        content = mdb.fan_out_query(
+            db,
+            mdb.get_servers_by_tag(request.form.get("tag")),
+            session["sql"]
+        )
+        content["order"] = "true"
+    elif select and streaming_enabled("adhoc_query"):
+        streaming = mdb.get_config(config_file).glob.streaming
+        content = mdb.stream_query(
+            db,
+            server,
+            session["sql"],
+            streaming.chunk_size,
+            streaming.max_rows
+        )
+        content["order"] = "true"
+    elif select:
         content = mdb.execute_adhoc_query(db, server, session["sql"])
         content["order"] = "true"
     else:
-        _, stderr = mdb.execute_change(db, server, session["sql"])
-        content = mdb.get_table_content(db, server, database, table)
+        stdout, stderr = mdb.execute_change(db, server, session["sql"])
+        content = get_table_view(server, database, table)
 
     if "ERROR" in stderr:
         error = stderr
@@ -119,18 +666,111 @@ def render_change(server, database, table) -> str:
     if session["sql"].replace("\r\n", "") not in session["history"] and not error:
         session["history"].append(session["sql"].replace("\r\n", ""))
 
-    return render_template(
+    return render_content(
         "show_table_info.html",
         content=content,
         error=error,
         message=message,
-        misc=config.misc,
+        output=stdout,
+    )
+
+
+@app.route("/<server>/<database>/<table>/export/")
+def export_table(server, database, table) -> Response:
+    """The whole table as CSV, JSON or YAML, written while the rows are read
+    from the server"""
+    fmt = request.args.get("format", "csv")
+
+    if fmt not in bulk.FORMATS:
+        raise ValueError(f"Unknown export format: {fmt}")
+
+    chunk_size = mdb.get_config(config_file).glob.streaming.chunk_size
+    content = mdb.stream_table_content(db, server, database, table, chunk_size)
+
+    response = Response(
+        bulk.export_rows(fmt, content["column_names"], content["rows"], chunk_size),
+        mimetype=bulk.FORMATS[fmt]
+    )
+    response.headers["Content-Disposition"] = f'attachment; filename="{server}-{database}-{table}.{fmt}"'
+    response.call_on_close(content["rows"].close)
+
+    return response
+
+
+@app.route("/<server>/<database>/<table>/import/", methods=["GET", "POST"])
+def import_table(server, database, table) -> str:
+    """Bulk import of a config table from a CSV, JSON or YAML file"""
+    session["server"] = server
+    session["database"] = database
+    session["table"] = table
+
+    if database != "main" or table not in bulk.LOAD_COMMANDS:
+        raise ValueError(f"{database}.{table} is not an importable config table")
+
+    column_names = mdb.get_table_columns(db, server, database, table)
+    result = None
+    error = ""
+
+    if request.method == "POST":
+        upload = request.files.get("file")
+
+        try:
+            if upload is not None and upload.filename:
+                data = upload.read().decode()
+                fmt = request.form.get("format") or bulk.detect_format(upload.filename)
+            else:
+                data = request.form.get("data", "")
+                fmt = request.form.get("format") or "csv"
+
+            result = mdb.import_table(
+                db,
+                server,
+                table,
+                bulk.parse_rows(data, fmt, column_names),
+                request.form.get("mode", "insert"),
+                bool(request.form.get("load_to_runtime")),
+                mdb.get_config(config_file).glob.bulk.batch_size
+            )
+        except (bulk.InvalidImport, UnicodeDecodeError) as e:
+            error = str(e)
+
+    return render_template(
+        "show_import.html",
+        server=server,
+        database=database,
+        table=table,
+        column_names=column_names,
+        formats=bulk.FORMATS,
+        load_commands=bulk.LOAD_COMMANDS[table],
+        form=request.form if error else {},
+        result=result,
+        error=error
     )
 
 
 @app.route("/<server>/adhoc/")
 def adhoc_report(server) -> str:
-    adhoc_results = mdb.execute_adhoc_report(db, server)
+    window = request.args.get("window", type=int)
+    indexed = mdb.get_config(config_file).glob.digest_index.enabled
+
+    if indexed:
+        adhoc_results = mdb.get_digest_report(db, server, window)
+    else:
+        adhoc_results = mdb.execute_adhoc_report(db, server)
+
+    return render_template(
+        "show_adhoc_report.html",
+        adhoc_results=adhoc_results,
+        indexed=indexed,
+        window=window
+    )
+
+
+@app.route("/fanout/adhoc/")
+def adhoc_report_all() -> str:
+    """The adhoc report of every server, or of the ones tagged with ?tag="""
+    servers = mdb.get_servers_by_tag(request.args.get("tag"))
+    adhoc_results = mdb.execute_adhoc_report_all(db, servers)
 
     return render_template(
         "show_adhoc_report.html",
@@ -138,6 +778,138 @@ def adhoc_report(server) -> str:
     )
 
 
+@app.route("/<server>/diff/")
+def config_diff(server) -> str:
+    """Differences between the memory, runtime and disk config tables"""
+    return render_template(
+        "show_config_diff.html",
+        diff=mdb.get_config_diff(db, [server])
+    )
+
+
+@app.route("/fanout/diff/")
+def config_diff_all() -> str:
+    """Config differences of every server, or of the ones tagged with ?tag="""
+    servers = mdb.get_servers_by_tag(request.args.get("tag"))
+
+    return render_template(
+        "show_config_diff.html",
+        diff=mdb.get_config_diff(db, servers)
+    )
+
+
+@app.route("/<server>/trends/")
+def render_trends(server) -> str:
+    """Charts from the stats collector, ProxySQL isn't queried"""
+    hours = request.args.get("hours", 6, type=int)
+
+    return render_template(
+        "show_trends.html",
+        charts=get_trends(server, hours) if stats_store else None,
+        hours=hours
+    )
+
+
+def get_trends(server, hours) -> list:
+    resolution, series = stats_store.series(
+        server,
+        [
+            "global.Questions",
+            "global.Slow_queries",
+            "commands.count",
+            "commands.time_us",
+            "pool.ConnUsed",
+        ],
+        time.time() - hours * 3600
+    )
+
+    def rate(metric):
+        return {
+            "ts": series[metric]["ts"],
+            "values": [total / resolution for total in series[metric]["total"]],
+        }
+
+    commands = dict(zip(series["commands.count"]["ts"], series["commands.count"]["total"]))
+    latency_ts = [ts for ts in series["commands.time_us"]["ts"] if commands.get(ts)]
+    time_us = dict(zip(series["commands.time_us"]["ts"], series["commands.time_us"]["total"]))
+
+    return [
+        dict(rate("global.Questions"), title="Queries per second"),
+        {
+            "title": "Average query latency (ms)",
+            "ts": latency_ts,
+            "values": [time_us[ts] / commands[ts] / 1000 for ts in latency_ts],
+        },
+        dict(rate("global.Slow_queries"), title="Slow queries per second"),
+        {
+            "title": "Backend connections used",
+            "ts": series["pool.ConnUsed"]["ts"],
+            "values": [
+                total / count for total, count in zip(
+                    series["pool.ConnUsed"]["total"],
+                    series["pool.ConnUsed"]["count"]
+                )
+            ],
+        },
+    ]
+
+
+@app.route("/misc.json")
+def render_misc_queries() -> Response:
+    """The queries of the sql editor menu. Pages link it with the config
+    version in the url, so it's cached until the config changes."""
+    version = config_version()
+    body = misc_json_cache.get_or_set(
+        version,
+        lambda: json.dumps(mdb.get_config(config_file).misc.categories)
+    )
+
+    response = Response(body, mimetype="application/json")
+    response.set_etag(version)
+
+    if request.args.get("v") == version:
+        response.cache_control.public = True
+        response.cache_control.max_age = 31536000
+    else:
+        response.cache_control.no_cache = True
+
+    return response.make_conditional(request)
+
+
+def config_version() -> str:
+    mdb.get_config(config_file)
+
+    return config_store.version(config_file)
+
+
+@app.route("/profiling/")
+def render_slow_requests() -> str:
+    """The slowest endpoints and the latest entries of the slow request log"""
+    profiling_config = mdb.get_config(config_file).glob.profiling
+
+    if not (profiling_config.enabled or profiling_config.header_token):
+        return render_template("show_slow_requests.html", endpoints=None)
+
+    log = get_slow_log()
+
+    return render_template(
+        "show_slow_requests.html",
+        endpoints=log.endpoints(),
+        requests=log.recent(),
+        threshold=profiling_config.threshold
+    )
+
+
+@app.route("/profiling/<int:entry_id>/")
+def render_slow_request(entry_id) -> str:
+    entry = get_slow_log().get(entry_id)
+
+    if entry is None:
+        raise ValueError(f"No slow request with id {entry_id}")
+
+    return render_template("show_slow_request.html", entry=entry)
+
+
 @app.route("/settings", methods=["GET", "POST"])
 def render_settings() -> str:
     if request.method == "GET":
@@ -149,6 +921,7 @@ def render_settings() -> str:
         return render_template(
             "settings.html",
             config_file_content=config_file_content,
+            result_cache=mdb.result_cache.stats()
         )
 
     if request.method == "POST":
@@ -166,6 +939,13 @@ def render_settings() -> str:
             with open(config_file, "w") as f:
                 f.write(request.form["settings"])
 
+            # the other workers see the new mtime, and the caches are dropped
+            # for them too when they are shared
+            config_store.invalidate(config_file)
+            mdb.catalog_cache.invalidate()
+            mdb.columns_cache.invalidate()
+            mdb.result_cache.invalidate()
+
             return render_template(
                 "settings.html",
                 message="success",
@@ -180,10 +960,53 @@ def render_settings() -> str:
     raise Exception("Wrong method")
 
 
+@app.context_processor
+def inject_navigation() -> dict:
+    """Provides the nav menu with the cached catalog of the current server"""
+    server = session.get("server")
+    dblist = {}
+
+    if server is not None:
+        try:
+            dblist = mdb.get_catalog(db, server)
+        except Exception as e:
+            # don't fail the error page when the server is unreachable
+            logging.error(f"Cannot get the table list of {server}: {e}")
+
+    return {
+        "nav_menu": render_nav_menu(server, dblist),
+        "servers": mdb.get_servers(),
+        "config_version": config_version(),
+    }
+
+
+def render_nav_menu(server, dblist) -> Markup:
+    """The database/table menu, rendered once per server and config version
+    in production mode until the catalog of the server is refreshed"""
+    template = app.jinja_env.get_template("partials/nav_menu.html")
+
+    if mdb.get_config(config_file).glob.render_mode != "production":
+        return Markup(template.render(dblist=dblist, server=server))
+
+    key = (server, config_version())
+    cached = nav_cache.get(key)
+
+    # the local catalog cache hands out the same dict until it's refreshed,
+    # a shared one a copy of it
+    if cached is not None and (cached[0] is dblist or cached[0] == dblist):
+        return cached[1]
+
+    menu = Markup(template.render(dblist=dblist, server=server))
+    nav_cache.set(key, (dblist, menu))
+
+    return menu
+
+
 @app.errorhandler(Exception)
 def handle_exception(e) -> Tuple[str, int]:
     # Log the error and stacktrace.
     logging.exception(e)
+    metrics.errors.inc(endpoint=request.endpoint or "unknown")
 
     return render_template("error.html", error=e), 500
 
@@ -0,0 +1,731 @@
+#!/usr/local/bin/python3
+
+"""ASGI entry point: uvicorn --workers 2 asgi:app
+
+The report pages, which wait on several queries or several servers, run on
+the event loop with aiomysql, so slow ProxySQL nodes only hold coroutines,
+not threads. The query timeout is concurrency.timeout and a request whose
+client goes away is cancelled together with its queries. Table watches are
+streamed from the event loop too, an open page doesn't hold a thread.
+
+The read paths of the table pages (the page itself with server side tables,
+its /data/ and its /fingerprint/) read from the servers on the event loop as
+well and hand what they read to the Flask view, which only renders it in the
+thread pool. Every other route is served by the Flask app in the pool.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Sequence, Tuple
+from urllib.parse import parse_qs
+import asyncio
+import io
+import logging
+import re
+import sys
+import time
+
+from werkzeug.urls import url_decode
+
+from app import app as flask_app, db, render_template, table_page_args
+from lib import catalog, metrics, watch
+from lib.aio import AsyncPools, QueryError
+from lib.digest import DigestIndex, report_query
+import mdb
+
+
+pools = AsyncPools()
+
+wsgi_executor = ThreadPoolExecutor(
+    max_workers=mdb.get_config().glob.concurrency.workers,
+    thread_name_prefix="proxyweb-wsgi"
+)
+
+
+async def query(server: str, sql: str) -> Dict[str, Any]:
+    config = mdb.get_config()
+    timeout = config.glob.concurrency.timeout
+    result = {
+        "column_names": [],
+        "rows": [],
+        "elapsed": None,
+        "error": None,
+    }
+
+    try:
+        result["column_names"], result["rows"], result["elapsed"] = await pools.query(
+            server,
+            config.servers[server].dsn,
+            config.glob.pool,
+            sql,
+            timeout
+        )
+    except asyncio.TimeoutError:
+        result["error"] = "Timed out after {} seconds".format(timeout)
+    except Exception as e:
+        logging.error(f"Query failed on {server}: {e}")
+        result["error"] = str(e)
+
+    return result
+
+
+async def fan_out(servers: List[str], sql: str) -> Dict[str, Any]:
+    """the async counterpart of mdb.fan_out_query"""
+    outcomes = await asyncio.gather(*(query(server, sql) for server in servers))
+
+    return mdb.merge_results(
+        [
+            (server, outcome["column_names"], outcome["rows"])
+            for server, outcome in zip(servers, outcomes)
+            if outcome["error"] is None
+        ],
+        {
+            server: outcome["error"]
+            for server, outcome in zip(servers, outcomes)
+            if outcome["error"] is not None
+        }
+    )
+
+
+async def read(
+    server: str,
+    statements: List[Tuple[str, Optional[Sequence[Any]]]]
+) -> List[Tuple[List[str], List[Tuple]]]:
+    """runs statements on one connection of the server, see AsyncPools.execute"""
+    config = mdb.get_config()
+
+    if server not in config.servers:
+        raise ValueError(f"Unknown server: {server}")
+
+    return await pools.execute(
+        server,
+        config.servers[server].dsn,
+        config.glob.pool,
+        statements,
+        config.glob.concurrency.timeout
+    )
+
+
+# key -> the running read concurrent requests of this worker share
+inflight: Dict[Hashable, asyncio.Future] = {}
+
+
+async def shared(key: Hashable, factory: Callable[[], Awaitable[Any]]) -> Any:
+    """the event loop counterpart of mdb.inflight: concurrent identical reads
+    wait for the first one, a request going away doesn't cancel it for the
+    others"""
+    future = inflight.get(key)
+
+    if future is None:
+        future = inflight[key] = asyncio.ensure_future(factory())
+
+        def done(finished: asyncio.Future) -> None:
+            inflight.pop(key, None)
+
+            if not finished.cancelled():
+                finished.exception()
+
+        future.add_done_callback(done)
+
+    return await asyncio.shield(future)
+
+
+async def table_columns(server: str, database: str, table: str) -> List[str]:
+    """mdb.get_table_columns on the event loop, through the same cache"""
+    mdb.check_identifier(database, table)
+    key = (server, database, table)
+    column_names = mdb.columns_cache.get(key)
+
+    if column_names is not None:
+        return column_names
+
+    async def fetch() -> List[str]:
+        (names, _), = await read(server, [("SELECT * FROM {}.{} LIMIT 0".format(database, table), None)])
+        mdb.columns_cache.set(key, names, mdb.get_config().glob.catalog_ttl)
+
+        return names
+
+    return await shared(("columns",) + key, fetch)
+
+
+async def prime_catalog(server: str) -> None:
+    """reads the catalog of the server into mdb.catalog_cache unless it is
+    there, the nav menu of the page is rendered from it. A ProxySQL that
+    can't list its tables in one statement is left to the Flask app"""
+    if mdb.catalog_cache.get(server) is not None:
+        return
+
+    async def fetch() -> None:
+        (names, rows), = await read(server, [("SHOW DATABASES", None)])
+        databases = [row[names.index("name")] for row in rows]
+        tables: Dict[str, List[str]] = {}
+
+        if databases:
+            (_, rows), = await read(server, [(catalog.catalog_query(databases), None)])
+
+            for database, table in rows:
+                tables.setdefault(database, []).append(table)
+
+        hidden = catalog.hidden_tables(mdb.get_config(), server)
+        mdb.catalog_cache.set(server, catalog.visible(databases, tables, hidden), mdb.get_config().glob.catalog_ttl)
+
+    try:
+        await shared(("catalog", server), fetch)
+    except QueryError as e:
+        logging.debug(f"Cannot read the catalog of {server} on the event loop: {e}")
+
+
+async def checksum_fingerprint(server: str, database: str, table: str) -> Optional[str]:
+    """mdb.get_checksum_fingerprint on the event loop"""
+    names = mdb.checksum_names(database, table)
+
+    if names is None:
+        return None
+
+    async def fetch() -> Optional[str]:
+        try:
+            (_, rows), = await read(server, [(mdb.checksum_query(names), None)])
+        except QueryError as e:
+            logging.debug(f"No runtime checksums on {server}: {e}")
+
+            return None
+
+        return mdb.checksum_fingerprint(names, rows)
+
+    return await shared(("checksum", server, names, mdb.result_cache.generation), fetch)
+
+
+async def table_fingerprint(server: str, database: str, table: str) -> Optional[str]:
+    """mdb.get_table_fingerprint on the event loop"""
+    mdb.check_identifier(database, table)
+
+    if not mdb.fingerprinted(database):
+        return None
+
+    async def fetch() -> str:
+        fingerprint = await checksum_fingerprint(server, database, table)
+
+        if fingerprint is not None:
+            return fingerprint
+
+        (names, rows), = await read(server, [("SELECT * FROM {}.{} ORDER BY 1".format(database, table), None)])
+
+        return mdb.fingerprint_rows(names, rows)
+
+    return await shared(("fingerprint", server, database, table, mdb.result_cache.generation), fetch)
+
+
+async def table_page(server: str, database: str, table: str, args) -> Dict[str, Any]:
+    """mdb.get_table_page on the event loop, through the same result cache"""
+    column_names = await table_columns(server, database, table)
+    count, string = mdb.table_page_queries(column_names, database, table, **table_page_args(args))
+    cached = mdb.cached_result(server, string, None)
+
+    if cached is not None:
+        return dict(cached)
+
+    generation = mdb.result_cache.generation
+
+    async def fetch() -> Dict[str, Any]:
+        (_, counts), (names, rows) = await read(server, [(count, None), (string, None)])
+        result = mdb.table_page_result(column_names, counts[0], mdb.keep_rows(names, rows))
+        mdb.store_result(server, string, None, result, generation)
+
+        return result
+
+    return dict(await shared(mdb.read_key(server, string, None, generation), fetch))
+
+
+async def prefetch_table_view(scope, server: str, database: str = "main", table: str = "global_variables") -> dict:
+    # only the columns: the rows come from /data/
+    checksum, _, _ = await asyncio.gather(
+        checksum_fingerprint(server, database, table),
+        table_columns(server, database, table),
+        prime_catalog(server)
+    )
+
+    return {"checksum": checksum}
+
+
+async def prefetch_table_data(scope, server: str, database: str, table: str) -> dict:
+    return {"page": await table_page(server, database, table, url_decode(scope["query_string"]))}
+
+
+async def prefetch_table_fingerprint(scope, server: str, database: str, table: str) -> dict:
+    return {"fingerprint": await table_fingerprint(server, database, table)}
+
+
+def report_queries() -> list:
+    config = mdb.get_config()
+
+    if "adhoc_report" not in config.misc.categories:
+        return []
+
+    return config.misc.categories["adhoc_report"].queries
+
+
+async def adhoc_report(scope, server: str) -> str:
+    check_server(server)
+
+    if mdb.get_config().glob.digest_index.enabled:
+        return await digest_report(scope, server)
+
+    queries = report_queries()
+    outcomes = await asyncio.gather(*(query(server, item.sql) for item in queries))
+
+    adhoc_results = [
+        dict(outcome, title=item.title, sql=item.sql, info=item.info)
+        for item, outcome in zip(queries, outcomes)
+    ]
+
+    return await render(scope, "show_adhoc_report.html", adhoc_results=adhoc_results)
+
+
+# server -> the lock a refresh of its digest index holds on the event loop
+digest_locks: Dict[str, asyncio.Lock] = {}
+
+
+async def refresh_digest_index(server: str) -> DigestIndex:
+    """mdb.refresh_digest_index on the event loop: the digests are pulled
+    with aiomysql, only merging them into the index takes a thread"""
+    index = mdb.get_digest_index(server)
+
+    async with digest_locks.setdefault(server, asyncio.Lock()):
+        now = time.time()
+        refresh = mdb.digest_refresh_query(index, now)
+
+        if refresh is not None:
+            string, params, full = refresh
+            (_, rows), = await read(server, [(string, params)])
+
+            def apply() -> None:
+                with index.lock:
+                    index.apply(rows, now, full)
+
+            await asyncio.get_running_loop().run_in_executor(wsgi_executor, apply)
+
+    return index
+
+
+async def digest_report(scope, server: str) -> str:
+    """mdb.get_digest_report on the event loop, ranking the digests takes a
+    thread"""
+    window = url_decode(scope["query_string"]).get("window", type=int)
+    queries = report_queries()
+    sections = [report_query(item.sql) for item in queries]
+    loop = asyncio.get_running_loop()
+
+    outcomes = asyncio.gather(*(query(server, item.sql) for item, section in zip(queries, sections) if section is None))
+
+    start = time.perf_counter()
+
+    try:
+        index = await refresh_digest_index(server)
+        indexed = await loop.run_in_executor(wsgi_executor, mdb.index_sections, index, sections, window)
+    except asyncio.TimeoutError:
+        timeout = mdb.get_config().glob.concurrency.timeout
+        indexed = mdb.index_failed(sections, "Timed out after {} seconds".format(timeout))
+    except Exception as e:
+        logging.error(f"Refreshing the digest index of {server} failed: {e}")
+        indexed = mdb.index_failed(sections, str(e))
+
+    elapsed = (time.perf_counter() - start) * 1000
+    queried = iter(await outcomes)
+
+    adhoc_results = [
+        dict(next(queried), title=item.title, sql=item.sql, info=item.info) if section is None
+        else mdb.indexed_result(item, *indexed[position], window, elapsed)
+        for position, (item, section) in enumerate(zip(queries, sections))
+    ]
+
+    return await render(scope, "show_adhoc_report.html", adhoc_results=adhoc_results, indexed=True, window=window)
+
+
+async def adhoc_report_all(scope) -> str:
+    tag = parse_qs(scope["query_string"].decode("latin1")).get("tag", [None])[0]
+    servers = mdb.get_servers_by_tag(tag)
+    queries = report_queries()
+    merged = await asyncio.gather(*(fan_out(servers, item.sql) for item in queries))
+
+    adhoc_results = [
+        dict(result, title=item.title, sql=item.sql, info=item.info, elapsed=None, error=None)
+        for item, result in zip(queries, merged)
+    ]
+
+    return await render(scope, "show_adhoc_report.html", adhoc_results=adhoc_results)
+
+
+def check_server(server: str) -> None:
+    if server not in mdb.get_config().servers:
+        raise ValueError(f"Unknown server: {server}")
+
+
+def configured_server(server: str = "", **params) -> bool:
+    return server in mdb.get_config().servers
+
+
+def server_side_tables(server: str = "", **params) -> bool:
+    # without them the page holds every row, it is streamed by Flask
+    return configured_server(server) and mdb.get_config().glob.server_side_tables
+
+
+# (pattern, handler, whether the route is served async with the current config)
+ROUTES = (
+    (re.compile(r"^/fanout/adhoc/$"), adhoc_report_all, lambda **params: True),
+    (re.compile(r"^/(?P<server>[^/]+)/adhoc/$"), adhoc_report, configured_server),
+)
+
+# (pattern, coroutine reading what the Flask view needs, whether it applies),
+# the view renders the page in the thread pool
+PREFETCH_ROUTES = (
+    (
+        re.compile(r"^/(?P<server>[^/]+)/(?:(?P<database>[^/]+)/(?P<table>[^/]+)/)?$"),
+        prefetch_table_view,
+        server_side_tables,
+    ),
+    (
+        re.compile(r"^/(?P<server>[^/]+)/(?P<database>[^/]+)/(?P<table>[^/]+)/data/$"),
+        prefetch_table_data,
+        configured_server,
+    ),
+    (
+        re.compile(r"^/(?P<server>[^/]+)/(?P<database>[^/]+)/(?P<table>[^/]+)/fingerprint/$"),
+        prefetch_table_fingerprint,
+        configured_server,
+    ),
+)
+
+
+WATCH_ROUTE = re.compile(r"^/(?P<server>[^/]+)/(?P<database>[^/]+)/(?P<table>[^/]+)/watch/$")
+
+
+def match(scope, routes):
+    if scope["method"] != "GET":
+        return None, {}
+
+    for pattern, handler, enabled in routes:
+        found = pattern.match(scope["path"])
+
+        if found is not None:
+            params = {name: value for name, value in found.groupdict().items() if value is not None}
+
+            if enabled(**params):
+                return handler, params
+
+    return None, {}
+
+
+async def render(scope, template: str, **context) -> str:
+    """renders a template of the Flask app in a worker thread: the nav menu
+    context processor may need to query the server"""
+    loop = asyncio.get_running_loop()
+
+    return await loop.run_in_executor(wsgi_executor, render_in_context, scope, template, context)
+
+
+def render_in_context(scope, template: str, context: Dict[str, Any]) -> str:
+    # the cookie header is enough for the session the templates read
+    with flask_app.test_request_context(
+        scope["path"],
+        query_string=scope["query_string"],
+        headers=[(name.decode("latin1"), value.decode("latin1")) for name, value in scope["headers"]]
+    ):
+        return render_template(template, **context)
+
+
+async def app(scope, receive, send) -> None:
+    if scope["type"] == "lifespan":
+        await lifespan(receive, send)
+
+        return
+
+    if scope["type"] != "http":
+        return
+
+    found = WATCH_ROUTE.match(scope["path"]) if scope["method"] == "GET" else None
+
+    if found is not None:
+        await watch_table(scope, receive, send, **found.groupdict())
+
+        return
+
+    body = await read_body(receive)
+
+    if body is None:
+        return
+
+    prefetch, params = match(scope, PREFETCH_ROUTES)
+
+    if prefetch is not None:
+        await prefetched_wsgi(scope, body, receive, send, prefetch, params)
+
+        return
+
+    handler, params = match(scope, ROUTES)
+
+    if handler is None:
+        await call_wsgi(scope, body, send)
+
+        return
+
+    start = time.perf_counter()
+    endpoint = handler.__name__
+    task = asyncio.ensure_future(handler(scope, **params))
+    disconnect = asyncio.ensure_future(wait_for_disconnect(receive))
+
+    await asyncio.wait({task, disconnect}, return_when=asyncio.FIRST_COMPLETED)
+
+    if not task.done():
+        # the client went away, stop its queries
+        task.cancel()
+
+        return
+
+    disconnect.cancel()
+
+    try:
+        status, body = 200, task.result()
+    except Exception as e:
+        logging.exception(e)
+        metrics.errors.inc(endpoint=endpoint)
+        status, body = 500, await render(scope, "error.html", error=e)
+
+    body = body.encode()
+
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", b"text/html; charset=utf-8"),
+            (b"content-length", str(len(body)).encode()),
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+    server = params.get("server", "")
+
+    metrics.request_duration.observe(
+        time.perf_counter() - start,
+        endpoint=endpoint,
+        server=server if server in mdb.get_config().servers else ""
+    )
+    metrics.bytes_rendered.inc(len(body), endpoint=endpoint)
+
+
+async def watch_table(scope, receive, send, server: str, database: str, table: str) -> None:
+    """the Server-Sent Events of /<server>/<database>/<table>/watch/, the
+    events are put by the poller thread of the table and sent from here"""
+    loop = asyncio.get_running_loop()
+    ready = asyncio.Event()
+
+    def wakeup() -> None:
+        try:
+            loop.call_soon_threadsafe(ready.set)
+        except RuntimeError:
+            # the loop is gone, the viewer is unsubscribed on the way out
+            pass
+
+    subscription = watch.Subscription(wakeup=wakeup)
+
+    try:
+        key = mdb.watch_table(db, server, database, table, subscription)
+    except Exception as e:
+        logging.exception(e)
+        metrics.errors.inc(endpoint="watch_table")
+        body = (await render(scope, "error.html", error=e)).encode()
+
+        await send({
+            "type": "http.response.start",
+            "status": 500,
+            "headers": [(b"content-type", b"text/html; charset=utf-8")],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+        return
+
+    heartbeat = mdb.get_config().glob.watch.heartbeat
+    disconnect = asyncio.ensure_future(wait_for_disconnect(receive))
+
+    async def write(message: str) -> None:
+        await send({"type": "http.response.body", "body": message.encode(), "more_body": True})
+
+    try:
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [
+                (b"content-type", b"text/event-stream"),
+                (b"cache-control", b"no-cache"),
+                (b"x-accel-buffering", b"no"),
+            ],
+        })
+        await write("retry: 5000\n\n")
+
+        while not disconnect.done():
+            ready.clear()
+
+            message = subscription.get(0)
+
+            while message is not None:
+                await write(message)
+                message = subscription.get(0)
+
+            waiter = asyncio.ensure_future(ready.wait())
+            done, _ = await asyncio.wait(
+                {waiter, disconnect},
+                timeout=heartbeat,
+                return_when=asyncio.FIRST_COMPLETED
+            )
+            waiter.cancel()
+
+            if not done:
+                await write(": keepalive\n\n")
+    finally:
+        disconnect.cancel()
+        mdb.unwatch_table(key, subscription)
+
+
+async def wait_for_disconnect(receive) -> None:
+    while (await receive())["type"] != "http.disconnect":
+        pass
+
+
+async def lifespan(receive, send) -> None:
+    while True:
+        message = await receive()
+
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await pools.close_all()
+            wsgi_executor.shutdown(wait=False)
+            await send({"type": "lifespan.shutdown.complete"})
+
+            return
+
+
+async def read_body(receive) -> Optional[bytes]:
+    """the request body, None if the client went away"""
+    body = bytearray()
+
+    while True:
+        message = await receive()
+
+        if message["type"] == "http.disconnect":
+            return None
+
+        body += message.get("body", b"")
+
+        if not message.get("more_body"):
+            return bytes(body)
+
+
+async def prefetched_wsgi(scope, body: bytes, receive, send, prefetch, params: Dict[str, str]) -> None:
+    """reads what the Flask view needs on the event loop, then lets the view
+    render it in the thread pool. What goes wrong is raised in the view, so
+    the error page is the Flask one"""
+    task = asyncio.ensure_future(prefetch(scope, **params))
+    disconnect = asyncio.ensure_future(wait_for_disconnect(receive))
+
+    await asyncio.wait({task, disconnect}, return_when=asyncio.FIRST_COMPLETED)
+
+    if not task.done():
+        task.cancel()
+
+        return
+
+    disconnect.cancel()
+
+    try:
+        values = task.result()
+    except Exception as e:
+        values = {"error": e}
+
+    await call_wsgi(scope, body, send, values)
+
+
+async def call_wsgi(scope, body: bytes, send, prefetched: Optional[Dict[str, Any]] = None) -> None:
+    """serves the request with the Flask app in a worker thread, the
+    response is sent while the app iterates it so streamed pages stream"""
+    environ = build_environ(scope, body)
+
+    if prefetched is not None:
+        environ["proxyweb.prefetched"] = prefetched
+
+    loop = asyncio.get_running_loop()
+
+    await loop.run_in_executor(wsgi_executor, run_wsgi, environ, loop, send)
+
+
+def run_wsgi(environ: Dict[str, Any], loop: asyncio.AbstractEventLoop, send) -> None:
+    response: Dict[str, Any] = {}
+
+    def forward(message) -> None:
+        asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+    def send_start() -> None:
+        if "sent" not in response:
+            response["sent"] = True
+            forward({
+                "type": "http.response.start",
+                "status": response["status"],
+                "headers": response["headers"],
+            })
+
+    def start_response(status: str, headers, exc_info=None):
+        response["status"] = int(status.split(" ", 1)[0])
+        response["headers"] = [
+            (name.lower().encode("latin1"), value.encode("latin1")) for name, value in headers
+        ]
+
+        return write
+
+    def write(data: bytes) -> None:
+        send_start()
+        forward({"type": "http.response.body", "body": data, "more_body": True})
+
+    result = flask_app(environ, start_response)
+
+    try:
+        for chunk in result:
+            if chunk:
+                write(chunk)
+
+        send_start()
+        forward({"type": "http.response.body", "body": b"", "more_body": False})
+    finally:
+        if hasattr(result, "close"):
+            result.close()
+
+
+def build_environ(scope, body: bytes) -> Dict[str, Any]:
+    server: Optional[tuple] = scope.get("server") or ("localhost", 80)
+    client: Optional[tuple] = scope.get("client") or ("", 0)
+
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf8").decode("latin1"),
+        "PATH_INFO": scope["path"].encode("utf8").decode("latin1"),
+        "QUERY_STRING": scope["query_string"].decode("latin1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": "HTTP/" + scope.get("http_version", "1.1"),
+        "REMOTE_ADDR": client[0],
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+
+    for name, value in scope["headers"]:
+        name = name.decode("latin1").upper().replace("-", "_")
+        value = value.decode("latin1")
+
+        if name not in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+            name = "HTTP_" + name
+
+        environ[name] = environ[name] + "," + value if name in environ else value
+
+    return environ
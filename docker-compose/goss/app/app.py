@@ -17,34 +17,217 @@ __author__ = "Miklos Mukka Szel"
 __contact__ = "miklos.szel@edmodo.com"
 __license__ = "GPLv3"
 
-import os
+import fcntl
 import json
-from flask import Flask, render_template
+import logging
+import os
+import subprocess
+import threading
+import time
+from flask import Flask, redirect, render_template
+
+GOSS_COMMAND = [
+    "goss", "--vars", "/goss/vars.yaml",
+    "-g", "/goss/goss.yaml",
+    "validate",
+    "-f", "json",
+]
+
+# the state is shared by the gunicorn workers through these files
+STATE_DIR = os.environ.get("GOSS_STATE_DIR", "/tmp/goss-status")
+# seconds between the scheduled validations
+INTERVAL = int(os.environ.get("GOSS_INTERVAL", 30))
+# runs kept per check for the duration and flapping stats
+HISTORY = int(os.environ.get("GOSS_HISTORY", 100))
+TIMEOUT = int(os.environ.get("GOSS_TIMEOUT", 120))
 
 app = Flask(__name__)
 
 
+class Validator:
+    """Runs goss in the background and on demand, one run at a time across
+    the workers. Viewers asking for a run while one is in progress wait for
+    it and share its result instead of starting another."""
+
+    def __init__(self, state_dir, interval, history):
+        self.interval = interval
+        self.history = history
+        self.result_file = os.path.join(state_dir, "result.json")
+        self.history_file = os.path.join(state_dir, "history.json")
+        self.lock_file = os.path.join(state_dir, "run.lock")
+        self.cached = None
+        self.cached_mtime = None
+        self.lock = threading.Lock()
+        # time of the last failed scheduled run and the failures in a row
+        self.failed = None
+        self.failures = 0
+
+        os.makedirs(state_dir, exist_ok=True)
+
+    def start(self):
+        thread = threading.Thread(target=self.schedule, daemon=True)
+        thread.start()
+
+    def schedule(self):
+        while True:
+            if self.due():
+                try:
+                    self.refresh()
+                except Exception as e:
+                    self.failed = time.time()
+                    self.failures += 1
+
+                    if self.failures == 1:
+                        logging.exception(e)
+                    else:
+                        logging.warning(f"goss failed {self.failures} times in a row: {e}")
+                else:
+                    self.failed = None
+                    self.failures = 0
+
+            time.sleep(1)
+
+    def due(self):
+        """Whether the scheduler runs goss now: after a failure it waits
+        2, 4, 8... seconds, at most the interval, instead of retrying every
+        second"""
+        if self.failed is not None:
+            return time.time() - self.failed >= min(2 ** self.failures, self.interval)
+
+        result = self.result()
+
+        return result is None or time.time() - result["finished"] >= self.interval
+
+    def result(self):
+        """The last result of any worker, re-read only when the file changed"""
+        try:
+            mtime = os.stat(self.result_file).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+        if mtime != self.cached_mtime:
+            with open(self.result_file) as f:
+                self.cached = json.load(f)
+
+            self.cached_mtime = mtime
+
+        return self.cached
+
+    def refresh(self, requested=None):
+        """Validates unless a run finished since `requested`"""
+        requested = time.time() if requested is None else requested
+
+        with self.lock, open(self.lock_file, "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+
+            result = self.result()
+
+            if result is not None and result["finished"] >= requested:
+                return result
+
+            self.validate()
+
+            return self.result()
+
+    def validate(self):
+        started = time.time()
+        output = subprocess.run(
+            GOSS_COMMAND,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            timeout=TIMEOUT,
+        )
+
+        # goss exits with 1 when a check fails, the output is still valid
+        try:
+            content = json.loads(output.stdout)
+        except ValueError:
+            raise ValueError(output.stderr.decode(errors="replace") or "goss returned no output")
+
+        finished = time.time()
+        results = sorted(content["results"], key=lambda k: k["resource-id"])
+
+        history = self.update_history(results, finished)
+
+        for row in results:
+            row["stats"] = self.stats(history.get(self.check_key(row), []))
+
+        self.write(self.result_file, {
+            "started": started,
+            "finished": finished,
+            "duration": finished - started,
+            "results": results,
+        })
+
+    @staticmethod
+    def check_key(row):
+        return "{} {} {}".format(row["resource-type"], row["resource-id"], row["property"])
+
+    def update_history(self, results, finished):
+        """[finished, duration ms, successful] of the last runs per check"""
+        try:
+            with open(self.history_file) as f:
+                history = json.load(f)
+        except (FileNotFoundError, ValueError):
+            history = {}
+
+        for row in results:
+            runs = history.setdefault(self.check_key(row), [])
+            # goss reports nanoseconds
+            runs.append([finished, row["duration"] / 1e6, row["successful"]])
+            del runs[:-self.history]
+
+        self.write(self.history_file, history)
+
+        return history
+
+    @staticmethod
+    def stats(runs):
+        durations = [duration for _, duration, _ in runs]
+
+        return {
+            "runs": len(runs),
+            "avg": sum(durations) / len(durations) if durations else 0,
+            "max": max(durations, default=0),
+            # status changes between consecutive runs
+            "flaps": sum(1 for a, b in zip(runs, runs[1:]) if a[2] != b[2]),
+        }
+
+    @staticmethod
+    def write(path, content):
+        # readers in the other workers never see a partial file
+        with open(path + ".tmp", "w") as f:
+            json.dump(content, f)
+
+        os.replace(path + ".tmp", path)
+
+
+validator = Validator(STATE_DIR, INTERVAL, HISTORY)
+validator.start()
+
+
 @app.route("/")
 def status():
-    try:
-        content_json = os.popen(
-            " ".join([
-                "goss --vars /goss/vars.yaml",
-                "-g /goss/goss.yaml",
-                "validate",
-                "-f json",
-                "-o pretty"
-            ])
-        )
-        content = json.load(content_json)
-        content_ordered = sorted(
-            content["results"],
-            key=lambda k: k["resource-id"]
-        )
+    result = validator.result()
+
+    if result is None:
+        # the first run of the scheduler hasn't finished yet
+        result = validator.refresh()
+
+    return render_template(
+        "status.html",
+        content=result["results"],
+        finished=time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(result["finished"])),
+        duration=result["duration"],
+        interval=INTERVAL,
+    )
+
+
+@app.route("/refresh")
+def refresh():
+    validator.refresh()
 
-        return render_template("status.html", content=content_ordered)
-    except Exception as e:
-        raise ValueError(e)
+    return redirect("/")
 
 
 @app.errorhandler(Exception)
@@ -0,0 +1,115 @@
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+import asyncio
+import logging
+import time
+
+import aiomysql
+
+# what a failing query raises, the errors of PyMySQL
+QueryError = aiomysql.MySQLError
+
+
+class AsyncPools:
+    """
+    aiomysql connection pools of the servers for the ASGI app, shared by
+    every request on the event loop. A pool is recreated when the DSN or the
+    pool settings of its server change.
+    """
+
+    def __init__(self):
+        # server -> (dsn and settings, pool)
+        self._pools: Dict[str, Tuple[Tuple, aiomysql.Pool]] = {}
+        self._lock: Optional[asyncio.Lock] = None
+
+    async def get(self, server: str, dsn, settings) -> aiomysql.Pool:
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+
+        key = (tuple(sorted(dsn.items())), tuple(sorted(settings.items())))
+
+        async with self._lock:
+            entry = self._pools.get(server)
+
+            if entry is not None and entry[0] == key:
+                return entry[1]
+
+            if entry is not None:
+                entry[1].close()
+
+            pool = await aiomysql.create_pool(
+                host=dsn.host,
+                port=dsn.port,
+                user=dsn.user,
+                password=dsn.passwd,
+                db=dsn.db,
+                minsize=0,
+                maxsize=settings.size,
+                pool_recycle=settings.max_lifetime,
+                connect_timeout=3,
+            )
+            self._pools[server] = (key, pool)
+
+            return pool
+
+    async def query(
+        self,
+        server: str,
+        dsn,
+        settings,
+        sql: str,
+        timeout: float,
+        params: Optional[Sequence[Any]] = None
+    ) -> Tuple[List[str], List[Tuple], float]:
+        """
+        Runs a query on a pooled connection, returns with the column names,
+        the rows and the execution time in ms.
+        """
+        start = time.perf_counter()
+        (column_names, rows), = await self.execute(server, dsn, settings, [(sql, params)], timeout)
+
+        return column_names, rows, (time.perf_counter() - start) * 1000
+
+    async def execute(
+        self,
+        server: str,
+        dsn,
+        settings,
+        statements: List[Tuple[str, Optional[Sequence[Any]]]],
+        timeout: float
+    ) -> List[Tuple[List[str], List[Tuple]]]:
+        """
+        Runs statements one after another on a pooled connection, returns
+        with the column names and the rows of each. A statement that times
+        out or whose request is cancelled closes its connection, as the
+        protocol state of it is unknown.
+        """
+        pool = await self.get(server, dsn, settings)
+        conn = await asyncio.wait_for(pool.acquire(), settings.timeout)
+        results = []
+
+        try:
+            async with conn.cursor() as cur:
+                for sql, params in statements:
+                    await asyncio.wait_for(cur.execute(sql, params or None), timeout)
+                    rows = await cur.fetchall()
+                    results.append(([i[0] for i in cur.description or ()], list(rows)))
+
+            return results
+        except BaseException:
+            conn.close()
+
+            raise
+        finally:
+            pool.release(conn)
+
+    async def close_all(self) -> None:
+        pools = [pool for _, pool in self._pools.values()]
+        self._pools.clear()
+
+        for pool in pools:
+            pool.close()
+
+            try:
+                await pool.wait_closed()
+            except Exception as e:
+                logging.warning(f"Cannot close a connection pool: {e}")
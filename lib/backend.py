@@ -0,0 +1,515 @@
+from collections import OrderedDict
+from decimal import Decimal
+from typing import Any, Dict, Hashable, Iterable, Set, Tuple
+import base64
+import datetime
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+from lib.columnar import ColumnarResult
+
+
+# the values of the connector JSON has no type for: a result read from a
+# shared backend has the same types as the one read from the server, tuples
+# come back as lists
+_WIRE_TYPES = (
+    ("bytes", (bytes, bytearray), lambda value: base64.b64encode(value).decode(), base64.b64decode),
+    ("decimal", Decimal, str, Decimal),
+    ("datetime", datetime.datetime, datetime.datetime.isoformat, datetime.datetime.fromisoformat),
+    ("date", datetime.date, datetime.date.isoformat, datetime.date.fromisoformat),
+    (
+        "timedelta",
+        datetime.timedelta,
+        datetime.timedelta.total_seconds,
+        lambda value: datetime.timedelta(seconds=value),
+    ),
+)
+_WIRE_DECODERS = {name: decode for name, _, _, decode in _WIRE_TYPES}
+
+
+def _encode(value: Any) -> Any:
+    if isinstance(value, ColumnarResult):
+        return value.to_wire()
+
+    for name, types, encode, _ in _WIRE_TYPES:
+        if isinstance(value, types):
+            return {"format": name, "value": encode(value)}
+
+    return str(value)
+
+
+def _decode(value: Dict[str, Any]) -> Any:
+    wire_format = value.get("format")
+
+    if wire_format == "columnar":
+        return ColumnarResult.from_wire(value)
+
+    if wire_format in _WIRE_DECODERS and len(value) == 2 and "value" in value:
+        return _WIRE_DECODERS[wire_format](value["value"])
+
+    return value
+
+
+def dumps(value: Any) -> str:
+    return json.dumps(value, default=_encode)
+
+
+def loads(data) -> Any:
+    return json.loads(data, object_hook=_decode)
+
+
+class Backend:
+    """
+    Key/value store of the caches with a TTL and tags per entry, a set of
+    entries can be dropped by any of their tags. Shared backends keep the
+    values as JSON: the caches hold catalogs, column lists and rows, the
+    columnar rows in their wire format.
+    """
+
+    shared = False
+
+    def get(self, key: str, default: Any = None) -> Any:
+        raise NotImplementedError
+
+    def set(self, key: str, value: Any, ttl: float, tags: Iterable[str] = (), size: int = 0) -> None:
+        raise NotImplementedError
+
+    def delete(self, key: str) -> None:
+        raise NotImplementedError
+
+    def invalidate(self, tags: Iterable[str]) -> int:
+        """
+        Drop every entry with any of the tags, returns with their number.
+        """
+        raise NotImplementedError
+
+    def clear(self, prefix: str = "") -> int:
+        """
+        Drop every entry whose key starts with the prefix, returns with their
+        number.
+        """
+        raise NotImplementedError
+
+    def incr(self, key: str) -> int:
+        """
+        Increment a counter, counters don't expire and aren't cleared.
+        """
+        raise NotImplementedError
+
+    def counter(self, key: str) -> int:
+        raise NotImplementedError
+
+    def stats(self) -> Dict[str, int]:
+        return {}
+
+
+class LocalBackend(Backend):
+    """
+    The in-process backend, the least recently used entries are dropped once
+    max_entries or max_bytes (if set) is reached. Values are kept as they
+    are, not copied.
+    """
+
+    def __init__(self, max_entries: int = 1024, max_bytes: int = 0):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+
+        self._lock = threading.Lock()
+        # key -> (expires at, size, tags, value)
+        self._entries: "OrderedDict[str, Tuple[float, int, Tuple[str, ...], Any]]" = OrderedDict()
+        # tag -> keys
+        self._tags: Dict[str, Set[str]] = {}
+        self._counters: Dict[str, int] = {}
+        self._bytes = 0
+        self._evictions = 0
+
+    def get(self, key: str, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is None:
+                return default
+
+            if entry[0] < time.monotonic():
+                self._drop(key)
+
+                return default
+
+            self._entries.move_to_end(key)
+
+            return entry[3]
+
+    def set(self, key: str, value: Any, ttl: float, tags: Iterable[str] = (), size: int = 0) -> None:
+        tags = tuple(tags)
+
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+
+            self._entries[key] = (time.monotonic() + ttl, size, tags, value)
+            self._bytes += size
+
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+
+            while len(self._entries) > self.max_entries or (self.max_bytes and self._bytes > self.max_bytes):
+                self._drop(next(iter(self._entries)))
+                self._evictions += 1
+
+    def _drop(self, key: str) -> None:
+        _, size, tags, _ = self._entries.pop(key)
+        self._bytes -= size
+
+        for tag in tags:
+            keys = self._tags.get(tag)
+
+            if keys is not None:
+                keys.discard(key)
+
+                if not keys:
+                    del self._tags[tag]
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+
+    def invalidate(self, tags: Iterable[str]) -> int:
+        with self._lock:
+            keys = set()
+
+            for tag in tags:
+                keys |= self._tags.get(tag, set())
+
+            for key in keys:
+                self._drop(key)
+
+            return len(keys)
+
+    def clear(self, prefix: str = "") -> int:
+        with self._lock:
+            keys = [key for key in self._entries if key.startswith(prefix)]
+
+            for key in keys:
+                self._drop(key)
+
+            return len(keys)
+
+    def incr(self, key: str) -> int:
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+
+            return self._counters[key]
+
+    def counter(self, key: str) -> int:
+        return self._counters.get(key, 0)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self._bytes, "evictions": self._evictions}
+
+
+class SQLiteBackend(Backend):
+    """
+    Backend in a local SQLite file shared by every worker of the host. Once
+    max_entries or max_bytes is exceeded the expired and then the least
+    recently used entries are dropped until a tenth is free again, the last
+    use is only written once every `touch` seconds. Triggers keep the number and size of the entries
+    in the totals row, so a set doesn't scan the entries to check them.
+    """
+
+    shared = True
+
+    EVICT_TO = 0.9
+
+    def __init__(self, path: str, max_entries: int = 10000, max_bytes: int = 64 * 1024 * 1024, touch: float = 10):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.touch = touch
+        self._local = threading.local()
+        self._evictions = 0
+
+        with self._connection() as conn:
+            # one transaction, the workers of the host start at the same time
+            conn.executescript("""
+                BEGIN IMMEDIATE;
+                CREATE TABLE IF NOT EXISTS entries (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    expires REAL NOT NULL,
+                    used REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS entries_used ON entries (used);
+                CREATE TABLE IF NOT EXISTS tags (
+                    tag TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    PRIMARY KEY (tag, key)
+                ) WITHOUT ROWID;
+                CREATE INDEX IF NOT EXISTS tags_key ON tags (key);
+                CREATE TRIGGER IF NOT EXISTS entries_delete AFTER DELETE ON entries BEGIN
+                    DELETE FROM tags WHERE key = old.key;
+                END;
+                CREATE TABLE IF NOT EXISTS counters (
+                    key TEXT PRIMARY KEY,
+                    value INTEGER NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS totals (
+                    id INTEGER PRIMARY KEY CHECK (id = 0),
+                    entries INTEGER NOT NULL,
+                    size INTEGER NOT NULL
+                );
+                INSERT OR IGNORE INTO totals (id, entries, size)
+                    SELECT 0, COUNT(*), COALESCE(SUM(size), 0) FROM entries;
+                CREATE TRIGGER IF NOT EXISTS entries_insert_totals AFTER INSERT ON entries BEGIN
+                    UPDATE totals SET entries = entries + 1, size = size + new.size WHERE id = 0;
+                END;
+                CREATE TRIGGER IF NOT EXISTS entries_delete_totals AFTER DELETE ON entries BEGIN
+                    UPDATE totals SET entries = entries - 1, size = size - old.size WHERE id = 0;
+                END;
+                COMMIT;
+            """)
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+
+        return conn
+
+    def get(self, key: str, default: Any = None) -> Any:
+        conn = self._connection()
+        row = conn.execute("SELECT value, expires, used FROM entries WHERE key = ?", (key,)).fetchone()
+        now = time.time()
+
+        if row is None or row[1] < now:
+            return default
+
+        if row[2] < now - self.touch:
+            with conn:
+                conn.execute("UPDATE entries SET used = ? WHERE key = ?", (now, key))
+
+        return loads(row[0])
+
+    def set(self, key: str, value: Any, ttl: float, tags: Iterable[str] = (), size: int = 0) -> None:
+        data = dumps(value)
+        now = time.time()
+
+        with self._connection() as conn:
+            conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            conn.execute(
+                "INSERT INTO entries (key, value, size, expires, used) VALUES (?, ?, ?, ?, ?)",
+                (key, data, len(data), now + ttl, now)
+            )
+            conn.executemany("INSERT OR IGNORE INTO tags (tag, key) VALUES (?, ?)", [(tag, key) for tag in tags])
+
+            self._evict(conn, now)
+
+    def _totals(self, conn: sqlite3.Connection) -> Tuple[int, int]:
+        return conn.execute("SELECT entries, size FROM totals WHERE id = 0").fetchone()
+
+    def _evict(self, conn: sqlite3.Connection, now: float) -> None:
+        count, total = self._totals(conn)
+
+        if count <= self.max_entries and total <= self.max_bytes:
+            return
+
+        # down to EVICT_TO of the limits, so the scan for the expired entries
+        # get() skips runs once in many sets rather than on every one
+        max_entries = int(self.max_entries * self.EVICT_TO)
+        max_bytes = int(self.max_bytes * self.EVICT_TO)
+
+        conn.execute("DELETE FROM entries WHERE expires < ?", (now,))
+        count, total = self._totals(conn)
+
+        if count <= max_entries and total <= max_bytes:
+            return
+
+        victims = []
+
+        for key, size in conn.execute("SELECT key, size FROM entries ORDER BY used"):
+            if count <= max_entries and total <= max_bytes:
+                break
+
+            victims.append((key,))
+            count -= 1
+            total -= size
+
+        conn.executemany("DELETE FROM entries WHERE key = ?", victims)
+        self._evictions += len(victims)
+
+    def delete(self, key: str) -> None:
+        with self._connection() as conn:
+            conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+
+    def invalidate(self, tags: Iterable[str]) -> int:
+        tags = list(tags)
+
+        if not tags:
+            return 0
+
+        with self._connection() as conn:
+            return conn.execute(
+                "DELETE FROM entries WHERE key IN (SELECT key FROM tags WHERE tag IN ({}))".format(
+                    ", ".join("?" * len(tags))
+                ),
+                tags
+            ).rowcount
+
+    def clear(self, prefix: str = "") -> int:
+        with self._connection() as conn:
+            return conn.execute("DELETE FROM entries WHERE substr(key, 1, ?) = ?", (len(prefix), prefix)).rowcount
+
+    def incr(self, key: str) -> int:
+        with self._connection() as conn:
+            conn.execute(
+                "INSERT INTO counters (key, value) VALUES (?, 1) "
+                "ON CONFLICT (key) DO UPDATE SET value = value + 1",
+                (key,)
+            )
+
+            return conn.execute("SELECT value FROM counters WHERE key = ?", (key,)).fetchone()[0]
+
+    def counter(self, key: str) -> int:
+        row = self._connection().execute("SELECT value FROM counters WHERE key = ?", (key,)).fetchone()
+
+        return row[0] if row is not None else 0
+
+    def stats(self) -> Dict[str, int]:
+        count, total = self._totals(self._connection())
+
+        return {"entries": count, "bytes": total, "evictions": self._evictions}
+
+
+class RedisBackend(Backend):
+    """
+    Backend on a Redis compatible server, for several hosts or containers.
+    Needs the redis package; expired entries are dropped by the server and
+    so are the least recently used ones with maxmemory-policy allkeys-lru.
+    """
+
+    shared = True
+
+    # the tag sets outlive the entries in them, members that are gone
+    # already don't hurt
+    TAG_TTL = 86400
+
+    def __init__(self, url: str, prefix: str = "proxyweb:", client=None):
+        """
+        client is a redis.Redis compatible client to use instead of
+        connecting to url, e.g. a fakeredis.FakeRedis.
+        """
+        self.prefix = prefix
+
+        if client is not None:
+            self._client = client
+
+            return
+
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("The redis cache backend needs the redis package: pip install redis")
+
+        self._client = redis.Redis.from_url(url)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        data = self._client.get(self.prefix + key)
+
+        return loads(data) if data is not None else default
+
+    def set(self, key: str, value: Any, ttl: float, tags: Iterable[str] = (), size: int = 0) -> None:
+        pipe = self._client.pipeline()
+        pipe.set(self.prefix + key, dumps(value), px=max(int(ttl * 1000), 1))
+
+        for tag in tags:
+            pipe.sadd(self.prefix + "tag:" + tag, key)
+            pipe.expire(self.prefix + "tag:" + tag, self.TAG_TTL)
+
+        pipe.execute()
+
+    def delete(self, key: str) -> None:
+        self._client.delete(self.prefix + key)
+
+    def invalidate(self, tags: Iterable[str]) -> int:
+        tag_keys = [self.prefix + "tag:" + tag for tag in tags]
+
+        if not tag_keys:
+            return 0
+
+        # read and drop the tag sets in one MULTI, an entry set meanwhile
+        # either is in what's read here or in a new tag set
+        pipe = self._client.pipeline(transaction=True)
+
+        for tag_key in tag_keys:
+            pipe.smembers(tag_key)
+
+        pipe.delete(*tag_keys)
+        members = pipe.execute()[:-1]
+        keys = {self.prefix + key.decode() for tag_members in members for key in tag_members}
+
+        return self._client.delete(*keys) if keys else 0
+
+    def clear(self, prefix: str = "") -> int:
+        keys = list(self._client.scan_iter(match=self.prefix + _glob_escape(prefix) + "*"))
+
+        # the counters and tag sets live next to the entries
+        keys = [
+            key for key in keys
+            if not key.decode().startswith((self.prefix + "counter:", self.prefix + "tag:"))
+        ]
+
+        for start in range(0, len(keys), 500):
+            self._client.delete(*keys[start:start + 500])
+
+        return len(keys)
+
+    def incr(self, key: str) -> int:
+        return self._client.incr(self.prefix + "counter:" + key)
+
+    def counter(self, key: str) -> int:
+        return int(self._client.get(self.prefix + "counter:" + key) or 0)
+
+    def stats(self) -> Dict[str, int]:
+        # of the whole server, give ProxyWeb a database of its own
+        return {
+            "entries": self._client.dbsize(),
+            "bytes": self._client.info("memory")["used_memory"],
+            "evictions": self._client.info("stats")["evicted_keys"],
+        }
+
+
+def _glob_escape(value: str) -> str:
+    return "".join("\\" + char if char in "*?[]\\" else char for char in value)
+
+
+def create_backend(config) -> Backend:
+    """
+    The backend the caches share, from the cache section of the config.
+    """
+    if config.backend == "sqlite":
+        return SQLiteBackend(config.path, config.max_entries, config.max_bytes)
+
+    if config.backend == "redis":
+        return RedisBackend(config.url)
+
+    return LocalBackend(config.max_entries, config.max_bytes)
+
+
+def cache_key(namespace: str, key: Hashable) -> str:
+    """
+    A backend key of a cache key, the same in every worker.
+    """
+    return "{}:{}".format(namespace, json.dumps(key, default=str) if not isinstance(key, str) else key)
+
+
+def log_error(operation: str, error: Exception) -> None:
+    logging.warning(f"Cache backend {operation} failed: {error}")
@@ -0,0 +1,206 @@
+from itertools import groupby
+from typing import Any, Dict, Iterable, Iterator, List, Tuple
+import csv
+import io
+import json
+import os
+
+import yaml
+
+from lib.sql import literal
+
+
+# format -> mimetype of the exports
+FORMATS: Dict[str, str] = {
+    "csv": "text/csv",
+    "json": "application/json",
+    "yaml": "application/x-yaml",
+}
+
+# importable config table -> the statements loading it to runtime
+LOAD_COMMANDS: Dict[str, Tuple[str, ...]] = {
+    "mysql_users": ("LOAD MYSQL USERS TO RUNTIME",),
+    "mysql_servers": ("LOAD MYSQL SERVERS TO RUNTIME",),
+    "mysql_replication_hostgroups": ("LOAD MYSQL SERVERS TO RUNTIME",),
+    "mysql_group_replication_hostgroups": ("LOAD MYSQL SERVERS TO RUNTIME",),
+    "mysql_galera_hostgroups": ("LOAD MYSQL SERVERS TO RUNTIME",),
+    "mysql_aws_aurora_hostgroups": ("LOAD MYSQL SERVERS TO RUNTIME",),
+    "mysql_query_rules": ("LOAD MYSQL QUERY RULES TO RUNTIME",),
+    "mysql_query_rules_fast_routing": ("LOAD MYSQL QUERY RULES TO RUNTIME",),
+    "global_variables": ("LOAD MYSQL VARIABLES TO RUNTIME", "LOAD ADMIN VARIABLES TO RUNTIME"),
+    "scheduler": ("LOAD SCHEDULER TO RUNTIME",),
+    "proxysql_servers": ("LOAD PROXYSQL SERVERS TO RUNTIME",),
+    "mysql_firewall_whitelist_users": ("LOAD MYSQL FIREWALL TO RUNTIME",),
+    "mysql_firewall_whitelist_rules": ("LOAD MYSQL FIREWALL TO RUNTIME",),
+    "mysql_firewall_whitelist_sqli_fingerprints": ("LOAD MYSQL FIREWALL TO RUNTIME",),
+}
+
+MODES = ("insert", "replace", "sync")
+
+# NULL in CSV, like LOAD DATA and mysqldump --tab do: an empty cell is an
+# empty string, which the NOT NULL text columns of the config tables need
+CSV_NULL = "\\N"
+
+
+class InvalidImport(Exception):
+    pass
+
+
+def detect_format(filename: str, default: str = "csv") -> str:
+    extension = os.path.splitext(filename or "")[1].lower().lstrip(".")
+
+    if extension == "yml":
+        return "yaml"
+
+    return extension if extension in FORMATS else default
+
+
+def parse_rows(data: str, fmt: str, columns: List[str]) -> List[Dict[str, Any]]:
+    """
+    The records of a CSV (with a header line), JSON or YAML (a list of
+    objects) document as dicts ordered like the columns of the table. Column
+    names are matched case insensitively, CSV cells of \\N are NULL.
+    """
+    try:
+        if fmt == "csv":
+            records: Any = [
+                {name: None if value == CSV_NULL else value for name, value in row.items()}
+                for row in csv.DictReader(io.StringIO(data))
+            ]
+        elif fmt == "json":
+            records = json.loads(data)
+        elif fmt == "yaml":
+            records = yaml.safe_load(data)
+        else:
+            raise InvalidImport(f"Unknown format: {fmt}")
+    except (ValueError, yaml.YAMLError, csv.Error) as e:
+        raise InvalidImport(f"Cannot parse the {fmt.upper()} data: {e}")
+
+    if not isinstance(records, list):
+        raise InvalidImport("Expected a list of rows")
+
+    by_name = {column.lower(): column for column in columns}
+    rows = []
+
+    for number, record in enumerate(records, start=1):
+        if not isinstance(record, dict):
+            raise InvalidImport(f"Row {number}: expected an object with column names as keys")
+
+        # csv.DictReader puts the cells without a header under None
+        unknown = [str(name) for name in record if name is None or str(name).lower() not in by_name]
+
+        if unknown:
+            raise InvalidImport(
+                "Row {}: unknown columns {}, the table has {}".format(
+                    number,
+                    ", ".join(unknown),
+                    ", ".join(columns)
+                )
+            )
+
+        values = {by_name[str(name).lower()]: value for name, value in record.items()}
+
+        for name, value in values.items():
+            if isinstance(value, (dict, list)):
+                raise InvalidImport(f"Row {number}: {name} is not a scalar value")
+
+        rows.append({
+            column: int(values[column]) if isinstance(values[column], bool) else values[column]
+            for column in columns
+            if column in values
+        })
+
+    if not rows:
+        raise InvalidImport("No rows to import")
+
+    return rows
+
+
+def insert_statements(
+    table: str,
+    rows: List[Dict[str, Any]],
+    mode: str = "insert",
+    batch_size: int = 500
+) -> Iterator[Tuple[str, int, int]]:
+    """
+    Multi-row INSERT (or REPLACE) statements of at most batch_size rows, the
+    number of the first row and the number of rows in them. Consecutive rows
+    with the same columns share a statement. The values are SQLite literals
+    in the statement, not parameters the connector would escape for MySQL.
+    """
+    verb = "REPLACE" if mode == "replace" else "INSERT"
+    first = 1
+
+    for names, group in groupby(rows, key=lambda row: tuple(row)):
+        group = list(group)
+        column_list = ", ".join("`{}`".format(name.replace("`", "``")) for name in names)
+
+        for start in range(0, len(group), batch_size):
+            batch = group[start:start + batch_size]
+
+            yield (
+                "{} INTO main.{} ({}) VALUES {}".format(
+                    verb,
+                    table,
+                    column_list,
+                    ", ".join(
+                        "({})".format(", ".join(literal(row[name]) for name in names))
+                        for row in batch
+                    )
+                ),
+                first,
+                len(batch),
+            )
+
+            first += len(batch)
+
+
+def _plain(value: Any) -> Any:
+    if isinstance(value, (bytes, bytearray)):
+        return value.decode(errors="replace")
+
+    return value
+
+
+def export_rows(fmt: str, columns: List[str], rows: Iterable[Tuple], chunk_size: int = 500) -> Iterator[str]:
+    """
+    Yields the rows as CSV, JSON or YAML while they are read, every
+    chunk_size rows. NULL is \\N in CSV.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer) if fmt == "csv" else None
+    count = 0
+
+    def flush() -> str:
+        data = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+        return data
+
+    if writer is not None:
+        writer.writerow(columns)
+    elif fmt == "json":
+        buffer.write("[")
+
+    for row in rows:
+        row = [_plain(value) for value in row]
+
+        if writer is not None:
+            writer.writerow([CSV_NULL if value is None else value for value in row])
+        elif fmt == "json":
+            buffer.write(("," if count else "") + "\n" + json.dumps(dict(zip(columns, row)), default=str))
+        else:
+            buffer.write(yaml.safe_dump([dict(zip(columns, row))], default_flow_style=False, sort_keys=False))
+
+        count += 1
+
+        if count % chunk_size == 0:
+            yield flush()
+
+    if fmt == "json":
+        buffer.write("\n]\n")
+    elif fmt == "yaml" and not count:
+        buffer.write("[]\n")
+
+    yield flush()
@@ -0,0 +1,375 @@
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Optional, Tuple
+import hashlib
+import json
+import os
+import threading
+
+from lib.backend import Backend, LocalBackend, cache_key, log_error
+
+
+_missing = object()
+
+
+class SingleFlight:
+    """
+    Runs a function at most once per key at a time: callers asking for a
+    key that is already being computed by another thread wait for it and
+    get the same result, or the same exception.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, Future] = {}
+        self._counters = {"executions": 0, "shared": 0}
+
+    def do(self, key: Hashable, function: Callable[[], Any]) -> Any:
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+
+            if leader:
+                call = self._calls[key] = Future()
+                self._counters["executions"] += 1
+            else:
+                self._counters["shared"] += 1
+
+        if not leader:
+            return call.result()
+
+        try:
+            call.set_result(function())
+        except BaseException as e:
+            call.set_exception(e)
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+        return call.result()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._counters, inflight=len(self._calls))
+
+
+class TTLCache:
+    """
+    Thread safe cache where every entry expires after a TTL. The entries are
+    kept in process, the least recently used ones are dropped once maxsize
+    is reached, unless the cache is moved to a shared backend.
+    """
+
+    def __init__(self, ttl: float = 300, maxsize: int = 1024, namespace: str = "cache"):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.namespace = namespace
+        self.backend: Backend = LocalBackend(maxsize)
+
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "misses": 0}
+        self._inflight = SingleFlight()
+
+    def use_backend(self, backend: Backend) -> None:
+        self.backend = backend
+
+    def _key(self, key: Hashable) -> str:
+        return cache_key(self.namespace, key)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        try:
+            value = self.backend.get(self._key(key), _missing)
+        except Exception as e:
+            log_error("read", e)
+            value = _missing
+
+        with self._lock:
+            self._counters["misses" if value is _missing else "hits"] += 1
+
+        return default if value is _missing else value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        try:
+            self.backend.set(self._key(key), value, self.ttl if ttl is None else ttl)
+        except Exception as e:
+            log_error("write", e)
+
+    def get_or_set(
+        self,
+        key: Hashable,
+        factory: Callable[[], Any],
+        ttl: Optional[float] = None
+    ) -> Any:
+        value = self.get(key, _missing)
+
+        if value is _missing:
+            # concurrent misses of a key wait for the first one
+            value = self._inflight.do(key, lambda: self._fill(key, factory, ttl))
+
+        return value
+
+    def _fill(self, key: Hashable, factory: Callable[[], Any], ttl: Optional[float]) -> Any:
+        value = factory()
+        self.set(key, value, ttl)
+
+        return value
+
+    def invalidate(self, key: Optional[Hashable] = None) -> None:
+        """
+        Drop a single entry, or every entry if no key is given.
+        """
+        try:
+            if key is None:
+                self.backend.clear(self.namespace + ":")
+            else:
+                self.backend.delete(self._key(key))
+        except Exception as e:
+            log_error("invalidation", e)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            counters = dict(self._counters)
+
+        # a shared backend is reported once, by the result cache
+        if not self.backend.shared:
+            counters.update(self.backend.stats())
+
+        return counters
+
+
+class WriteGenerations:
+    """
+    The writes of every worker process of the host, so the others can drop
+    the results they made stale: a file per server with a line of the
+    written tables (null for every table) per write. Appends of a line are
+    atomic between processes, and a stat() of the size is cheap enough for
+    every cache read. The file of "*" has the writes to every server.
+    """
+
+    ALL = "*"
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def _path(self, server: str) -> str:
+        return os.path.join(self.directory, hashlib.sha1(server.encode()).hexdigest())
+
+    def size(self, server: str) -> int:
+        try:
+            return os.stat(self._path(server)).st_size
+        except FileNotFoundError:
+            return 0
+
+    def add(self, server: Optional[str] = None, tables: Optional[Iterable[str]] = None) -> None:
+        line = json.dumps(sorted(tables) if tables is not None else None) + "\n"
+        os.makedirs(self.directory, exist_ok=True)
+
+        with open(self._path(server or self.ALL), "ab") as file:
+            file.write(line.encode())
+
+    def read(self, server: str, offset: int) -> Tuple[int, List[Optional[List[str]]]]:
+        """
+        The writes after offset and the offset after them, a line that is
+        still being appended is left for the next read.
+        """
+        try:
+            with open(self._path(server), "rb") as file:
+                file.seek(offset)
+                data = file.read()
+        except FileNotFoundError:
+            return offset, []
+
+        complete = data[:data.rfind(b"\n") + 1]
+
+        return offset + len(complete), [self._tables(line) for line in complete.splitlines()]
+
+    @staticmethod
+    def _tables(line: bytes) -> Optional[List[str]]:
+        # a line that can't be read stands for a write to every table
+        try:
+            tables = json.loads(line)
+        except ValueError:
+            return None
+
+        return tables if isinstance(tables, list) else None
+
+
+class ResultCache:
+    """
+    Query results of the servers, the least recently used ones are dropped
+    once either the number of entries or their estimated size in bytes
+    reaches its limit. Every entry is tagged with the words of its query, so
+    a write to a table drops the results that may have read it.
+    """
+
+    def __init__(self, max_entries: int = 256, max_bytes: int = 32 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.backend: Backend = LocalBackend(max_entries, max_bytes)
+        self.generations: Optional[WriteGenerations] = None
+
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "misses": 0, "invalidations": 0}
+        # server -> how far the writes of the server and of every server
+        # were followed in the generations files
+        self._seen: Dict[str, Tuple[int, int]] = {}
+
+    def use_backend(self, backend: Backend) -> None:
+        self.backend = backend
+
+    def use_generations(self, generations: WriteGenerations) -> None:
+        """
+        Let the in-process results of every worker follow the writes of the
+        others table by table, a shared backend is invalidated for all of
+        them anyway.
+        """
+        self.generations = generations
+
+    def resize(self, max_entries: int, max_bytes: int) -> None:
+        """
+        Change the limits, those of a shared backend are its own.
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+
+        if isinstance(self.backend, LocalBackend):
+            self.backend.max_entries = max_entries
+            self.backend.max_bytes = max_bytes
+
+    @property
+    def generation(self) -> int:
+        """
+        Bumped by every invalidation, a result read before it isn't stored.
+        """
+        try:
+            return self.backend.counter("result-generation")
+        except Exception as e:
+            log_error("read", e)
+
+            return -1
+
+    @staticmethod
+    def _key(server: str, query: Hashable) -> str:
+        return "result:" + hashlib.sha1(cache_key(server, query).encode()).hexdigest()
+
+    def get(self, server: str, query: Hashable, default: Any = None) -> Any:
+        self._follow(server)
+
+        try:
+            value = self.backend.get(self._key(server, query), _missing)
+        except Exception as e:
+            log_error("read", e)
+            value = _missing
+
+        with self._lock:
+            self._counters["misses" if value is _missing else "hits"] += 1
+
+        return default if value is _missing else value
+
+    def _follow(self, server: str) -> None:
+        # drop the results of the tables of a server other workers wrote to
+        if self.generations is None:
+            return
+
+        generations = self.generations
+
+        try:
+            current = (generations.size(server), generations.size(WriteGenerations.ALL))
+
+            with self._lock:
+                seen = self._seen.get(server)
+
+                if seen == current:
+                    return
+
+                if seen is None:
+                    # nothing of the server is cached from before
+                    self._seen[server] = current
+                    writes: List[Optional[List[str]]] = [None]
+                else:
+                    offset, server_writes = generations.read(server, seen[0])
+                    all_offset, all_writes = generations.read(WriteGenerations.ALL, seen[1])
+                    self._seen[server] = (offset, all_offset)
+                    writes = server_writes + [None for _ in all_writes]
+        except OSError as e:
+            log_error("read", e)
+            writes = [None]
+
+        if any(tables is None for tables in writes):
+            self._drop(server, None)
+        elif writes:
+            self._drop(server, {table for tables in writes for table in tables})
+
+    def _drop(self, server: Optional[str], tables: Optional[Iterable[str]]) -> int:
+        try:
+            if server is None:
+                return self.backend.clear("result:")
+
+            if tables is None:
+                return self.backend.invalidate(("result:" + server,))
+
+            return self.backend.invalidate("result:{}:{}".format(server, table) for table in tables)
+        except Exception as e:
+            log_error("invalidation", e)
+
+            return 0
+
+    def set(
+        self,
+        server: str,
+        query: Hashable,
+        value: Any,
+        ttl: float,
+        size: int,
+        words: frozenset,
+        generation: Optional[int] = None
+    ) -> None:
+        # a single result that doesn't fit would flush everything else
+        if ttl <= 0 or size > self.max_bytes // 4:
+            return
+
+        if generation is not None and generation != self.generation:
+            return
+
+        tags = ["result:" + server] + ["result:{}:{}".format(server, word) for word in words]
+
+        try:
+            self.backend.set(self._key(server, query), value, ttl, tags, size)
+        except Exception as e:
+            log_error("write", e)
+
+    def invalidate(self, server: Optional[str] = None, tables: Optional[Iterable[str]] = None) -> None:
+        """
+        Drop the results of a server that may have read one of the tables,
+        every result of the server if no tables are given, or everything.
+        Runs after a write went through, so a failing backend is only logged:
+        its entries expire after their TTL.
+        """
+        try:
+            self.backend.incr("result-generation")
+        except Exception as e:
+            log_error("write", e)
+
+        if tables is not None:
+            tables = list(tables)
+
+        if self.generations is not None:
+            try:
+                self.generations.add(server, tables)
+            except OSError as e:
+                log_error("write", e)
+
+        dropped = self._drop(server, tables)
+
+        with self._lock:
+            self._counters["invalidations"] += dropped
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            counters = dict(self._counters)
+
+        try:
+            counters.update(self.backend.stats())
+        except Exception as e:
+            log_error("read", e)
+
+        return counters
@@ -0,0 +1,90 @@
+from typing import Dict, FrozenSet, List
+import logging
+import mysql.connector
+
+from models import Config
+
+
+def hidden_tables(cfg: Config, server: str) -> FrozenSet[str]:
+    """
+    The tables hidden by the global and the per server hide_tables settings.
+    """
+    hidden = set(cfg.glob.hide_tables or [])
+
+    if server in cfg.servers and cfg.servers[server].hide_tables:
+        hidden.update(cfg.servers[server].hide_tables)
+
+    return frozenset(hidden)
+
+
+def catalog_query(databases: List[str]) -> str:
+    """
+    A single statement listing the tables of every attached schema, this is
+    what ProxySQL rewrites SHOW TABLES FROM <db> to, one schema at a time.
+    """
+    return " UNION ALL ".join(
+        f"SELECT '{database}' AS db, name FROM {database}.sqlite_master "
+        f"WHERE type='table' AND name NOT LIKE 'sqlite_%'"
+        for database in databases
+    ) + " ORDER BY 1, 2"
+
+
+def _discover_batched(cur, databases: List[str]) -> Dict[str, List[str]]:
+    cur.execute(catalog_query(databases))
+
+    tables: Dict[str, List[str]] = {database: [] for database in databases}
+
+    for row in cur.fetchall():
+        tables[row["db"]].append(row["name"])
+
+    return tables
+
+
+def _discover_per_database(conn, cur, databases: List[str]) -> Dict[str, List[str]]:
+    tables: Dict[str, List[str]] = {}
+    statements = ";".join(f"SHOW TABLES FROM {database}" for database in databases)
+
+    try:
+        # send every SHOW TABLES in one go and read the result sets in order
+        for database, result in zip(databases, cur.execute(statements, multi=True)):
+            tables[database] = [row["tables"] for row in result.fetchall()]
+
+        return tables
+    except mysql.connector.Error as e:
+        logging.debug(f"Multi statement SHOW TABLES failed, running them one by one: {e}")
+
+        if conn.unread_result:
+            conn.consume_results()
+
+    for database in databases:
+        cur.execute(f"SHOW TABLES FROM {database}")
+        tables[database] = [row["tables"] for row in cur.fetchall()]
+
+    return tables
+
+
+def discover(conn, cur, hidden: FrozenSet[str]) -> Dict[str, List[str]]:
+    """
+    Return every database with its visible tables using a dictionary cursor.
+    """
+    cur.execute("SHOW DATABASES")
+    databases = [database["name"] for database in cur.fetchall()]
+
+    if not databases:
+        return {}
+
+    try:
+        tables = _discover_batched(cur, databases)
+    except mysql.connector.Error as e:
+        logging.debug(f"Batched table discovery failed, falling back to SHOW TABLES: {e}")
+
+        tables = _discover_per_database(conn, cur, databases)
+
+    return visible(databases, tables, hidden)
+
+
+def visible(databases: List[str], tables: Dict[str, List[str]], hidden: FrozenSet[str]) -> Dict[str, List[str]]:
+    return {
+        database: [table for table in tables.get(database, []) if table not in hidden]
+        for database in databases
+    }
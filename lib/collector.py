@@ -0,0 +1,119 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+import fcntl
+import logging
+import threading
+import time
+
+from lib.timeseries import TimeSeriesStore
+
+
+# metric -> ("counter" or "gauge", value), counters are cumulative
+Sample = Dict[str, Tuple[str, float]]
+
+
+class StatsCollector:
+    """
+    Polls every server on an interval and stores the per interval deltas of
+    the cumulative counters and the current value of the gauges.
+
+    Only one process per host samples, the others (e.g. gunicorn workers)
+    only read the store.
+    """
+
+    def __init__(
+        self,
+        store: TimeSeriesStore,
+        servers: Callable[[], List[str]],
+        sample: Callable[[str], Sample],
+        interval: int = 10,
+        workers: int = 4,
+    ):
+        self.store = store
+        self.interval = interval
+        self._servers = servers
+        self._sample = sample
+        self._workers = workers
+        # (server, metric) -> last cumulative value
+        self._previous: Dict[Tuple[str, str], float] = {}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._lock_file = None
+
+    def start(self) -> bool:
+        """
+        Start sampling in a daemon thread unless another process already does.
+        """
+        self._lock_file = open(self.store.path + ".lock", "w")
+
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            self._lock_file.close()
+            self._lock_file = None
+
+            return False
+
+        self._thread = threading.Thread(target=self._run, name="proxyweb-collector", daemon=True)
+        self._thread.start()
+
+        return True
+
+    def stop(self) -> None:
+        self._stop.set()
+
+        if self._thread is not None:
+            self._thread.join()
+
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+
+    def _run(self) -> None:
+        with ThreadPoolExecutor(max_workers=self._workers, thread_name_prefix="proxyweb-sampler") as executor:
+            while not self._stop.is_set():
+                started = time.time()
+
+                try:
+                    self.collect(executor, started)
+                    self.store.prune(started)
+                except Exception as e:
+                    logging.exception(f"Collecting stats failed: {e}")
+
+                self._stop.wait(max(self.interval - (time.time() - started), 0))
+
+    def collect(self, executor: ThreadPoolExecutor, now: float) -> None:
+        servers = self._servers()
+        futures = {server: executor.submit(self._sample, server) for server in servers}
+
+        for server, future in futures.items():
+            try:
+                sample = future.result(timeout=self.interval)
+            except Exception as e:
+                logging.warning(f"Cannot sample the stats of {server}: {e}")
+
+                continue
+
+            values = self.deltas(server, sample)
+
+            if values:
+                self.store.add(server, now, values)
+
+    def deltas(self, server: str, sample: Sample) -> Dict[str, float]:
+        values = {}
+
+        for metric, (kind, value) in sample.items():
+            if kind == "gauge":
+                values[metric] = value
+
+                continue
+
+            previous = self._previous.get((server, metric))
+            self._previous[(server, metric)] = value
+
+            # the first sample and counter resets (ProxySQL restart, stats
+            # reset) have no usable delta
+            if previous is not None and value >= previous:
+                values[metric] = value - previous
+
+        return values
@@ -0,0 +1,427 @@
+from array import array
+from collections.abc import Sequence
+from itertools import islice
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+import sys
+
+
+# integers with more digits can't be sent as numbers, the browser's doubles
+# would round them
+MAX_INT_DIGITS = 15
+MAX_INT = 10 ** MAX_INT_DIGITS - 1
+# longer strings are rarely repeated, they aren't interned
+INTERN_LENGTH = 64
+
+
+class _Mismatch(Exception):
+    pass
+
+
+def _plain(value: Any) -> Any:
+    """
+    A JSON value of a cell.
+    """
+    if isinstance(value, (bytes, bytearray)):
+        return value.decode(errors="replace")
+
+    if value is None or isinstance(value, (str, int, float)):
+        return value
+
+    return str(value)
+
+
+class Column:
+    """
+    The values of one column. Integers and floats are kept in a typed array
+    with a mask of the NULLs, integers ProxySQL sends as their decimal
+    strings too. Everything else is dictionary encoded: every distinct value
+    is stored once and the rows hold its index.
+    """
+
+    def __init__(self):
+        self.kind: Optional[str] = None
+        # the integers came as strings and are handed out as strings
+        self.text = False
+        self.values: array = array("q")
+        self.nulls: Optional[bytearray] = None
+        self.dictionary: List[Any] = []
+        self.length = 0
+        # value -> index in the dictionary, only while rows are added
+        self._codes: Optional[Dict[Any, int]] = {}
+
+    def extend(self, values: Tuple) -> None:
+        if self.kind is None:
+            self._detect(values)
+
+        if self.kind != "dict":
+            try:
+                self._extend_numbers(values)
+
+                return
+            except _Mismatch:
+                self._to_dictionary()
+
+        self._extend_dictionary(values)
+
+    def _detect(self, values: Tuple) -> None:
+        value = next((value for value in values if value is not None), None)
+
+        if type(value) is int:
+            self.kind = "int"
+        elif type(value) is float:
+            self.kind = "float"
+            self.values = array("d")
+        elif type(value) is str and _is_int(value):
+            self.kind = "int"
+            self.text = True
+        else:
+            self.kind = "dict"
+            self.values = array("H")
+
+    def _extend_numbers(self, values: Tuple) -> None:
+        if None not in values:
+            self.values.extend(self._numbers(values))
+            self.length += len(values)
+
+            if self.nulls is not None:
+                self.nulls += bytearray(len(values))
+
+            return
+
+        numbers = []
+        nulls = None
+
+        for index, value in enumerate(values):
+            if value is None:
+                if nulls is None:
+                    nulls = []
+
+                nulls.append(index)
+                numbers.append(0)
+            elif self.kind == "float":
+                if type(value) is not float:
+                    raise _Mismatch
+
+                numbers.append(value)
+            elif self.text:
+                if type(value) is not str or not _is_int(value):
+                    raise _Mismatch
+
+                numbers.append(int(value))
+            else:
+                if type(value) is not int or not -MAX_INT <= value <= MAX_INT:
+                    raise _Mismatch
+
+                numbers.append(value)
+
+        if nulls is not None and self.nulls is None:
+            self.nulls = bytearray(self.length)
+
+        if self.nulls is not None:
+            mask = bytearray(len(values))
+
+            for index in nulls or ():
+                mask[index] = 1
+
+            self.nulls += mask
+
+        self.values.extend(numbers)
+        self.length += len(values)
+
+    def _numbers(self, values: Tuple) -> List[Any]:
+        """
+        The numbers of a batch without NULLs, the whole batch is checked at
+        once.
+        """
+        types = set(map(type, values))
+
+        if self.kind == "float":
+            if types != {float}:
+                raise _Mismatch
+
+            return list(values)
+
+        if types != {str if self.text else int}:
+            raise _Mismatch
+
+        if self.text:
+            try:
+                numbers = list(map(int, values))
+            except ValueError:
+                raise _Mismatch
+
+            # only the canonical form, "007" and " 7" must stay as they are
+            if list(map(str, numbers)) != list(values):
+                raise _Mismatch
+        else:
+            numbers = list(values)
+
+        if min(numbers) < -MAX_INT or max(numbers) > MAX_INT:
+            raise _Mismatch
+
+        return numbers
+
+    def _to_dictionary(self) -> None:
+        values = tuple(self.slice(0, self.length))
+
+        self.kind = "dict"
+        self.text = False
+        self.values = array("H")
+        self.nulls = None
+        self.length = 0
+
+        self._extend_dictionary(values)
+
+    def _extend_dictionary(self, values: Tuple) -> None:
+        codes = self._codes
+        dictionary = self.dictionary
+
+        if set(map(type, values)) == {str}:
+            known = len(codes)
+            setdefault = codes.setdefault
+            # a new value gets the next code, the dict keeps them in order
+            batch = [setdefault(value, len(codes)) for value in values]
+            dictionary.extend(islice(codes, known, None))
+            self._append_codes(batch)
+            self.length += len(values)
+
+            return
+
+        batch = []
+
+        for value in values:
+            if isinstance(value, bytearray):
+                value = bytes(value)
+
+            # 1, 1.0 and True are equal keys
+            key = value if type(value) is str else (type(value), value)
+            code = codes.get(key)
+
+            if code is None:
+                code = codes[key] = len(dictionary)
+                dictionary.append(value)
+
+            batch.append(code)
+
+        self._append_codes(batch)
+        self.length += len(values)
+
+    def _append_codes(self, batch: List[int]) -> None:
+        if len(self.dictionary) > 0xFFFF and self.values.typecode == "H":
+            self.values = array("I", self.values)
+
+        self.values.extend(batch)
+
+    def finish(self) -> None:
+        """
+        Drops the index of the dictionary once every row was added. Values
+        that repeat, like hostnames and schemas, are interned so the other
+        results share them too.
+        """
+        self._codes = None
+
+        if self.kind == "dict" and len(self.dictionary) * 2 <= self.length:
+            self.dictionary = [
+                sys.intern(value) if type(value) is str and len(value) <= INTERN_LENGTH else value
+                for value in self.dictionary
+            ]
+
+    def slice(self, start: int, stop: int) -> List[Any]:
+        values = self.values[start:stop]
+
+        if self.kind == "dict":
+            dictionary = self.dictionary
+
+            return [dictionary[code] for code in values]
+
+        cells = list(map(str, values)) if self.text else values.tolist()
+
+        if self.nulls is not None:
+            for index, null in enumerate(self.nulls[start:stop]):
+                if null:
+                    cells[index] = None
+
+        return cells
+
+    def __getitem__(self, index: int) -> Any:
+        return self.slice(index, index + 1)[0]
+
+    def nbytes(self) -> int:
+        size = len(self.values) * self.values.itemsize + len(self.nulls or b"")
+
+        if self.kind == "dict":
+            size += 8 * len(self.dictionary) + sum(sys.getsizeof(value) for value in self.dictionary)
+
+        return size
+
+    def to_wire(self) -> Dict[str, Any]:
+        if self.kind == "dict":
+            return {
+                "type": "dict",
+                "dictionary": [_plain(value) for value in self.dictionary],
+                "codes": self.values.tolist(),
+            }
+
+        column: Dict[str, Any] = {
+            "type": self.kind,
+            "text": self.text,
+            "values": self.values.tolist(),
+        }
+
+        if self.nulls is not None:
+            column["nulls"] = [index for index, null in enumerate(self.nulls) if null]
+
+        return column
+
+    @classmethod
+    def from_wire(cls, data: Dict[str, Any], length: int) -> "Column":
+        column = cls()
+        column.kind = data["type"]
+        column.length = length
+
+        if column.kind == "dict":
+            column.dictionary = data["dictionary"]
+            column.values = array("I" if len(column.dictionary) > 0xFFFF else "H", data["codes"])
+            column.finish()
+
+            return column
+
+        column.text = data["text"]
+        column.values = array("d" if column.kind == "float" else "q", data["values"])
+
+        if "nulls" in data:
+            column.nulls = bytearray(length)
+
+            for index in data["nulls"]:
+                column.nulls[index] = 1
+
+        column.finish()
+
+        return column
+
+
+def _is_int(value: str) -> bool:
+    digits = value[1:] if value.startswith("-") else value
+
+    # only the canonical form, "007" must stay "007"
+    return (
+        0 < len(digits) <= MAX_INT_DIGITS
+        and digits.isascii()
+        and digits.isdigit()
+        and (digits[0] != "0" or digits == "0")
+        and value != "-0"
+    )
+
+
+class ColumnarResult(Sequence):
+    """
+    The rows of a result kept column by column, a fraction of the memory of
+    a list of tuples for the stats tables: the counters are integers and the
+    hostnames, schemas and users repeat. Reads like a list of tuples.
+    """
+
+    columnar = True
+
+    # rows rebuilt at a time while iterating
+    BATCH = 1000
+
+    def __init__(self, column_names: List[str]):
+        self.column_names = list(column_names)
+        self.columns = [Column() for _ in self.column_names]
+        self.length = 0
+
+    def extend(self, rows: Iterable[Tuple]) -> None:
+        rows = list(rows)
+
+        if not rows:
+            return
+
+        for column, values in zip(self.columns, zip(*rows)):
+            column.extend(values)
+
+        self.length += len(rows)
+
+    def finish(self) -> "ColumnarResult":
+        for column in self.columns:
+            column.finish()
+
+        return self
+
+    def __len__(self) -> int:
+        return self.length
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self.length)
+
+            if step != 1:
+                return [self[i] for i in range(start, stop, step)]
+
+            return list(zip(*(column.slice(start, stop) for column in self.columns)))
+
+        if index < 0:
+            index += self.length
+
+        if not 0 <= index < self.length:
+            raise IndexError("row index out of range")
+
+        return tuple(column[index] for column in self.columns)
+
+    def __iter__(self) -> Iterator[Tuple]:
+        for start in range(0, self.length, self.BATCH):
+            yield from self[start:start + self.BATCH]
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, (ColumnarResult, list, tuple)):
+            return len(self) == len(other) and all(a == tuple(b) for a, b in zip(self, other))
+
+        return NotImplemented
+
+    def nbytes(self) -> int:
+        """
+        The memory the rows take, roughly.
+        """
+        return 64 + sum(column.nbytes() for column in self.columns)
+
+    def to_wire(self) -> Dict[str, Any]:
+        """
+        The columnar JSON the table view decodes, also how a shared cache
+        backend stores the rows.
+        """
+        return {
+            "format": "columnar",
+            "length": self.length,
+            "column_names": self.column_names,
+            "columns": [column.to_wire() for column in self.columns],
+        }
+
+    @classmethod
+    def from_wire(cls, data: Dict[str, Any]) -> "ColumnarResult":
+        result = cls(data["column_names"])
+        result.length = data["length"]
+        result.columns = [Column.from_wire(column, result.length) for column in data["columns"]]
+
+        return result
+
+
+def from_rows(column_names: List[str], rows: Iterable[Tuple]) -> ColumnarResult:
+    result = ColumnarResult(column_names)
+    result.extend(rows)
+
+    return result.finish()
+
+
+def from_cursor(cur, batch_size: int = 1000) -> ColumnarResult:
+    """
+    The rows of an executed query, fetched batch_size rows at a time so the
+    tuples of only one batch are alive at once.
+    """
+    result = ColumnarResult([column[0] for column in cur.description])
+
+    while True:
+        rows = cur.fetchmany(batch_size)
+
+        if not rows:
+            return result.finish()
+
+        result.extend(rows)
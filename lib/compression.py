@@ -0,0 +1,176 @@
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+import hashlib
+import mimetypes
+import os
+import threading
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+# mimetypes worth compressing, images and fonts mostly are already
+COMPRESSIBLE = (
+    "text/",
+    "application/json",
+    "application/javascript",
+    "application/x-javascript",
+    "application/xml",
+    "application/x-yaml",
+    "image/svg+xml",
+    "image/x-icon",
+    "image/vnd.microsoft.icon",
+)
+
+
+def encodings() -> Tuple[str, ...]:
+    """
+    The encodings this process can produce, the preferred first.
+    """
+    return ("br", "gzip") if brotli is not None else ("gzip",)
+
+
+def negotiate(accept_encoding: str) -> Optional[str]:
+    """
+    The best encoding the client accepts, None for identity.
+    """
+    accepted: Dict[str, float] = {}
+
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        quality = 1.0
+
+        if params.strip().startswith("q="):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                quality = 0.0
+
+        accepted[name.strip().lower()] = quality
+
+    for encoding in encodings():
+        if accepted.get(encoding, accepted.get("*", 0)) > 0:
+            return encoding
+
+    return None
+
+
+def compressible(mimetype: Optional[str]) -> bool:
+    return mimetype is not None and mimetype.startswith(COMPRESSIBLE)
+
+
+def compress(data: bytes, encoding: str, level: int = 6) -> bytes:
+    if encoding == "br":
+        # brotli's quality goes to 11, gzip's level to 9
+        return brotli.compress(data, quality=min(level + 2, 11))
+
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    return compressor.compress(data) + compressor.flush()
+
+
+def compress_stream(chunks: Iterable[bytes], encoding: str, level: int = 6) -> Iterator[bytes]:
+    """
+    Compresses a streamed response chunk by chunk. Every chunk is flushed,
+    so the browser renders the page while the rest is still being read.
+    """
+    if encoding == "br":
+        compressor = brotli.Compressor(quality=min(level + 2, 11))
+
+        for chunk in chunks:
+            data = compressor.process(chunk) + compressor.flush()
+
+            if data:
+                yield data
+
+        yield compressor.finish()
+
+        return
+
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    for chunk in chunks:
+        data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+        if data:
+            yield data
+
+    yield compressor.flush()
+
+
+class Asset:
+    """
+    A static file in memory with its compressed variants, made once.
+    """
+
+    def __init__(self, path: str, stat: os.stat_result):
+        with open(path, "rb") as f:
+            self.data = f.read()
+
+        self.stat_key = (stat.st_mtime_ns, stat.st_size)
+        self.mtime = stat.st_mtime
+        self.mimetype = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        self.version = hashlib.sha1(self.data).hexdigest()[:12]
+        # (encoding, level) -> compressed data
+        self._variants: Dict[Tuple[str, int], bytes] = {}
+        self._lock = threading.Lock()
+
+    def variant(self, encoding: Optional[str], level: int = 6) -> Tuple[bytes, str]:
+        """
+        The body and the ETag of the file in an encoding and compression
+        level, both are part of the ETag so caches keep the variants apart.
+        """
+        if encoding is None:
+            return self.data, self.version
+
+        key = (encoding, level)
+
+        with self._lock:
+            if key not in self._variants:
+                self._variants[key] = compress(self.data, encoding, level)
+
+        return self._variants[key], "{}-{}{}".format(self.version, encoding, level)
+
+
+class StaticAssets:
+    """
+    The static files of the app with a content hash for the long-cache
+    URLs, reloaded when a file changes.
+    """
+
+    def __init__(self, folder: str):
+        self.folder = folder
+        self._lock = threading.Lock()
+        self._assets: Dict[str, Asset] = {}
+
+    def get(self, filename: str) -> Optional[Asset]:
+        """
+        The asset of a file below the folder, None if there's no such file.
+        """
+        path = os.path.realpath(os.path.join(self.folder, filename))
+
+        if not path.startswith(os.path.realpath(self.folder) + os.sep):
+            return None
+
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+
+        if not os.path.isfile(path):
+            return None
+
+        with self._lock:
+            asset = self._assets.get(path)
+
+            if asset is None or asset.stat_key != (stat.st_mtime_ns, stat.st_size):
+                asset = self._assets[path] = Asset(path, stat)
+
+            return asset
+
+    def version(self, filename: str) -> Optional[str]:
+        asset = self.get(filename)
+
+        return asset.version if asset is not None else None
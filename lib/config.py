@@ -1,7 +1,12 @@
+from typing import Dict, Optional, Tuple
 from voluptuous.schema_builder import ALLOW_EXTRA, Extra, Required
 from voluptuous.validators import Any, Coerce
+import hashlib
+import os
+import threading
 import yaml
 
+from lib import metrics
 from models import Config
 from voluptuous import Schema
 
@@ -10,6 +15,84 @@ global_config_schema = Schema({
     "hide_tables": [str],
     Required("default_server"): str,
     Required("read_only"): bool,
+    "catalog_ttl": Coerce(int),
+    "server_side_tables": bool,
+    "write_executor": Any("native", "cli"),
+    "render_mode": Any("development", "production"),
+    "pool": {
+        "size": Coerce(int),
+        "max_idle": Coerce(int),
+        "max_lifetime": Coerce(int),
+        "timeout": Coerce(int),
+    },
+    "streaming": {
+        "routes": [Any("table", "adhoc_query")],
+        "chunk_size": Coerce(int),
+        "max_rows": Coerce(int),
+    },
+    "concurrency": {
+        "workers": Coerce(int),
+        "timeout": Coerce(int),
+    },
+    "collector": {
+        "enabled": bool,
+        "interval": Coerce(int),
+        "path": str,
+    },
+    "digest_index": {
+        "enabled": bool,
+        "refresh": Coerce(int),
+        "full_refresh": Coerce(int),
+    },
+    "metrics": {
+        "proxysql_global": [str],
+    },
+    "profiling": {
+        "enabled": bool,
+        "threshold": Coerce(float),
+        "sample_interval": Coerce(float),
+        "cprofile": bool,
+        "header_token": str,
+        "log_size": Coerce(int),
+        "path": str,
+    },
+    "watch": {
+        "interval": Coerce(float),
+        "heartbeat": Coerce(float),
+        "max_rows": Coerce(int),
+        "wsgi_viewers": Coerce(int),
+    },
+    "bulk": {
+        "batch_size": Coerce(int),
+    },
+    "result_cache": {
+        "enabled": bool,
+        "max_entries": Coerce(int),
+        "max_bytes": Coerce(int),
+        "ttl": {
+            "config": Coerce(float),
+            "runtime": Coerce(float),
+            "stats": Coerce(float),
+        },
+    },
+    "cache": {
+        "backend": Any("local", "sqlite", "redis"),
+        "path": str,
+        "url": str,
+        "generations": str,
+        "max_entries": Coerce(int),
+        "max_bytes": Coerce(int),
+    },
+    "columnar": {
+        "enabled": bool,
+        "batch_size": Coerce(int),
+    },
+    "compression": {
+        "enabled": bool,
+        "min_size": Coerce(int),
+        "level": Coerce(int),
+        "static_max_age": Coerce(int),
+    },
 })
 
 server_config_schema = Schema({
@@ -22,7 +105,10 @@ server_config_schema = Schema({
             Required("db"): str,
             "read_only": bool,
             "hide_tables": [str],
-        }
+        },
+        "read_only": bool,
+        "hide_tables": [str],
+        "tags": [str],
     },
 })
 
@@ -81,3 +167,76 @@ def parse_config_file(file: str) -> Config:
     """
     with open(file, "r") as yml:
         return parse_config(yml.read())
+
+
+class ConfigStore:
+    """
+    Process-wide cache of parsed config files.
+
+    A file is only parsed again when its mtime, inode or size changes and the
+    content hash differs from the one that was parsed last.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # path -> (stat key, content hash, parsed config)
+        self._entries: Dict[str, Tuple[Tuple[int, int, int], str, Config]] = {}
+        self._counters = {"hits": 0, "misses": 0, "reloads": 0}
+
+    def get(self, file: str) -> Config:
+        path = os.path.abspath(file)
+        st = os.stat(path)
+        key = (st.st_mtime_ns, st.st_ino, st.st_size)
+
+        with self._lock:
+            entry = self._entries.get(path)
+
+            if entry is not None and entry[0] == key:
+                self._counters["hits"] += 1
+
+                return entry[2]
+
+            with open(path, "rb") as yml:
+                raw = yml.read()
+
+            digest = hashlib.sha1(raw).hexdigest()
+
+            # touched but not changed, keep the parsed tree
+            if entry is not None and entry[1] == digest:
+                self._entries[path] = (key, digest, entry[2])
+                self._counters["hits"] += 1
+
+                return entry[2]
+
+            with metrics.config_parse_duration.time():
+                cfg = parse_config(raw.decode())
+
+            self._counters["reloads" if entry is not None else "misses"] += 1
+            self._entries[path] = (key, digest, cfg)
+
+            return cfg
+
+    def invalidate(self, file: Optional[str] = None) -> None:
+        """
+        Drop the cached config of a file, or of every file if none is given.
+        """
+        with self._lock:
+            if file is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(os.path.abspath(file), None)
+
+    def version(self, file: str) -> Optional[str]:
+        """
+        Return the content hash of the currently cached config of a file.
+        """
+        entry = self._entries.get(os.path.abspath(file))
+
+        return entry[1] if entry is not None else None
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._counters, files=len(self._entries))
+
+
+config_store = ConfigStore()
@@ -0,0 +1,125 @@
+from typing import Any, Dict, List, Optional, Tuple
+import hashlib
+
+
+# config table -> the columns identifying a row
+CONFIG_TABLES: Dict[str, Tuple[str, ...]] = {
+    "mysql_users": ("username", "frontend", "backend"),
+    "mysql_servers": ("hostgroup_id", "hostname", "port"),
+    "mysql_query_rules": ("rule_id",),
+    "global_variables": ("variable_name",),
+    "scheduler": ("id",),
+}
+
+# layer -> (database, table name prefix)
+LAYERS: Dict[str, Tuple[str, str]] = {
+    "memory": ("main", ""),
+    "runtime": ("main", "runtime_"),
+    "disk": ("disk", ""),
+}
+
+
+class TableSnapshot:
+    """
+    The rows of a table keyed by its key columns, with a hash per row and a
+    digest of the whole table so identical tables are skipped with a single
+    comparison.
+    """
+
+    def __init__(self, name: str, columns: List[str], rows: List[Tuple], key: Tuple[str, ...]):
+        self.name = name
+        self.columns = columns
+        self.key = tuple(column for column in key if column in columns)
+
+        key_positions = [columns.index(column) for column in self.key]
+        table_hash = hashlib.sha1("\x1e".join(columns).encode())
+
+        # key -> (row hash, row)
+        self.rows: Dict[Tuple, Tuple[str, Tuple]] = {}
+
+        for row in rows:
+            row_hash = hashlib.sha1(
+                "\x1f".join("\x00" if value is None else str(value) for value in row).encode()
+            ).hexdigest()
+            table_hash.update(row_hash.encode())
+
+            key_value = tuple(row[position] for position in key_positions) if key_positions else (row_hash,)
+            self.rows[key_value] = (row_hash, tuple(row))
+
+        self.digest = table_hash.hexdigest()
+
+
+def diff(left: TableSnapshot, right: TableSnapshot) -> Optional[Dict[str, Any]]:
+    """
+    Row level differences of two snapshots of a table, None if they are
+    identical. Rows are matched by key in linear time.
+    """
+    if left.digest == right.digest:
+        return None
+
+    same_columns = left.columns == right.columns
+    columns = left.columns if same_columns else [c for c in left.columns if c in right.columns]
+    left_positions = [left.columns.index(c) for c in columns]
+    right_positions = [right.columns.index(c) for c in columns]
+
+    def project(row: Tuple, positions: List[int]) -> Tuple:
+        return row if same_columns else tuple(row[p] for p in positions)
+
+    added = []
+    removed = []
+    changed = []
+
+    for key, (row_hash, row) in left.rows.items():
+        other = right.rows.get(key)
+
+        if other is None:
+            removed.append(project(row, left_positions))
+
+            continue
+
+        if row_hash == other[0]:
+            continue
+
+        left_row = project(row, left_positions)
+        right_row = project(other[1], right_positions)
+
+        if left_row != right_row:
+            changed.append((
+                left_row,
+                right_row,
+                [c for c, a, b in zip(columns, left_row, right_row) if a != b],
+            ))
+
+    for key, (_, row) in right.rows.items():
+        if key not in left.rows:
+            added.append(project(row, right_positions))
+
+    if not (added or removed or changed):
+        return None
+
+    return {
+        "column_names": columns,
+        "added": added,
+        "removed": removed,
+        "changed": changed,
+    }
+
+
+def snapshot_queries(tables: List[str], layers: List[str]) -> List[Tuple[str, str, str]]:
+    """
+    (layer, table, query) of every table of every layer, ordered by key.
+    """
+    queries = []
+
+    for table in tables:
+        for layer in layers:
+            database, prefix = LAYERS[layer]
+            order = ", ".join(CONFIG_TABLES[table])
+
+            queries.append((
+                layer,
+                table,
+                f"SELECT * FROM {database}.{prefix}{table} ORDER BY {order}",
+            ))
+
+    return queries
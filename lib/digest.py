@@ -0,0 +1,269 @@
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple
+import heapq
+import re
+import threading
+import time
+
+
+DIGEST_COLUMNS = (
+    "hostgroup",
+    "schemaname",
+    "username",
+    "client_address",
+    "digest",
+    "digest_text",
+    "count_star",
+    "last_seen",
+    "sum_time",
+)
+
+# the prefixes the like patterns of the shipped report match, case-insensitive
+# and without skipping anything like the LIKE of SQLite
+WRITE_PREFIXES = ("INSERT", "UPDATE", "DELETE")
+
+_WRITES = "where digest_text like 'insert%' or digest_text like 'delete%' or digest_text like 'update%'"
+
+# the queries of the shipped adhoc report the index answers, normalized by
+# report_query, with the section they are and the digest kinds they rank
+REPORT_QUERIES = (
+    (
+        "select sum_time, digest, username, schemaname, substr(digest_text, 0, 80), count_star "
+        "from stats_mysql_query_digest where digest_text like 'select%' order by sum_time desc",
+        "sum_time",
+        ("select",),
+    ),
+    (
+        "select count_star, digest, username, schemaname, substr(digest_text, 0, 80), sum_time "
+        "from stats_mysql_query_digest where digest_text like 'select%' order by count_star desc",
+        "count_star",
+        ("select",),
+    ),
+    (
+        "select count_star, digest, username, schemaname, substr(digest_text, 0, 80), sum_time "
+        "from stats_mysql_query_digest " + _WRITES + " order by count_star desc",
+        "count_star",
+        ("write",),
+    ),
+    (
+        "select sum(sum_time) as time_spent, schemaname from stats_mysql_query_digest "
+        "group by schemaname order by time_spent desc",
+        "schema_time",
+        ("select", "write", "other"),
+    ),
+    (
+        "select sum(count_star) as sum_count_star, schemaname, sum(sum_time) as time_spent "
+        "from stats_mysql_query_digest " + _WRITES + " group by schemaname order by time_spent desc",
+        "schema_count",
+        ("write",),
+    ),
+)
+
+
+def report_query(sql: str) -> Optional[Tuple[str, Tuple[str, ...], Optional[int]]]:
+    """
+    The (section, digest kinds, limit) of a report query the index can
+    answer, None for the queries that have to run on ProxySQL.
+    """
+    normalized = " ".join(sql.lower().split()).rstrip("; ")
+    limit = None
+    match = re.search(r" limit (\d+)$", normalized)
+
+    if match is not None:
+        normalized = normalized[:match.start()]
+        limit = int(match.group(1))
+
+    for query, section, kinds in REPORT_QUERIES:
+        if normalized == query:
+            return section, kinds, limit
+
+    return None
+
+
+def classify(digest_text: str) -> str:
+    statement = (digest_text or "").upper()
+
+    if statement.startswith("SELECT"):
+        return "select"
+
+    if statement.startswith(WRITE_PREFIXES):
+        return "write"
+
+    return "other"
+
+
+class DigestEntry:
+    __slots__ = (
+        "schemaname",
+        "username",
+        "digest",
+        "digest_text",
+        "kind",
+        "count_star",
+        "sum_time",
+        "added",
+        "history",
+    )
+
+    def __init__(self, schemaname, username, digest, digest_text, added: float):
+        self.schemaname = schemaname
+        self.username = username
+        self.digest = digest
+        self.digest_text = digest_text
+        # classified once, digest_text doesn't change for a digest
+        self.kind = classify(digest_text)
+        self.count_star = 0
+        self.sum_time = 0
+        self.added = added
+        # (refresh time, count_star, sum_time) of the refreshes it changed in
+        self.history: Deque[Tuple[float, int, int]] = deque()
+
+
+class DigestIndex:
+    """
+    A local copy of stats_mysql_query_digest that is refreshed with the rows
+    whose last_seen moved since the previous pull, plus a periodic full
+    resync to notice digest resets.
+    """
+
+    def __init__(self, history: float = 3600):
+        self.lock = threading.Lock()
+        self.history = history
+        self.entries: Dict[Tuple, DigestEntry] = {}
+        self.watermark = 0
+        self.started: Optional[float] = None
+        self.refreshed = 0.0
+        self.full_refreshed = 0.0
+        self._rankings: Dict[Tuple, list] = {}
+
+    def apply(self, rows: List[Tuple], now: Optional[float] = None, full: bool = False) -> None:
+        """
+        Merge digest rows (in DIGEST_COLUMNS order) into the index. A full
+        refresh drops the digests that are gone from ProxySQL.
+        """
+        now = time.time() if now is None else now
+        seen = set()
+
+        if self.started is None:
+            self.started = now
+
+        for row in rows:
+            hostgroup, schemaname, username, client_address, digest, digest_text, count_star, last_seen, sum_time = row
+            key = (hostgroup, schemaname, username, client_address, digest)
+            count_star = int(count_star)
+            sum_time = int(sum_time)
+            entry = self.entries.get(key)
+            seen.add(key)
+
+            # counters going backwards mean the digests were reset
+            if entry is None or count_star < entry.count_star:
+                entry = DigestEntry(schemaname, username, digest, digest_text, now)
+                self.entries[key] = entry
+
+            if count_star != entry.count_star or not entry.history:
+                entry.count_star = count_star
+                entry.sum_time = sum_time
+                entry.history.append((now, count_star, sum_time))
+                self._trim(entry, now)
+
+            self.watermark = max(self.watermark, int(last_seen))
+
+        if full:
+            for key in set(self.entries) - seen:
+                del self.entries[key]
+
+            self.full_refreshed = now
+
+        self.refreshed = now
+        self._rankings.clear()
+
+    def _trim(self, entry: DigestEntry, now: float) -> None:
+        # keep a single sample from before the history window as baseline
+        while len(entry.history) > 1 and entry.history[1][0] <= now - self.history:
+            entry.history.popleft()
+
+    def value(self, entry: DigestEntry, metric: str, since: Optional[float]) -> int:
+        """
+        count_star or sum_time of a digest, in total or since a point in time.
+        """
+        current = entry.count_star if metric == "count_star" else entry.sum_time
+
+        if since is None:
+            return current
+
+        position = 1 if metric == "count_star" else 2
+        base = None
+
+        for sample in entry.history:
+            if sample[0] > since:
+                break
+
+            base = sample[position]
+
+        if base is None:
+            # new since the index started: everything happened in the window
+            if self.started is not None and entry.added > self.started:
+                return current
+
+            base = entry.history[0][position]
+
+        return current - base
+
+    def top(
+        self,
+        kinds: Tuple[str, ...],
+        metric: str,
+        n: Optional[int],
+        since: Optional[float] = None
+    ) -> List[Tuple[int, DigestEntry]]:
+        key = ("digest", kinds, metric, n, since)
+
+        if key not in self._rankings:
+            ranked = (
+                (self.value(entry, metric, since), entry)
+                for entry in self.entries.values()
+                if entry.kind in kinds
+            )
+
+            # digests that didn't run in the window aren't ranked
+            ranked = (item for item in ranked if since is None or item[0] > 0)
+
+            if n is None:
+                ranking = sorted(ranked, key=lambda item: item[0], reverse=True)
+            else:
+                ranking = heapq.nlargest(n, ranked, key=lambda item: item[0])
+
+            self._rankings[key] = ranking
+
+        return self._rankings[key]
+
+    def top_schemas(
+        self,
+        kinds: Tuple[str, ...],
+        n: Optional[int] = None,
+        since: Optional[float] = None
+    ) -> List[Tuple[str, int, int]]:
+        """
+        (schemaname, count_star, sum_time) ordered by sum_time.
+        """
+        key = ("schema", kinds, n, since)
+
+        if key not in self._rankings:
+            totals: Dict[str, List[int]] = {}
+
+            for entry in self.entries.values():
+                if entry.kind in kinds:
+                    total = totals.setdefault(entry.schemaname, [0, 0])
+                    total[0] += self.value(entry, "count_star", since)
+                    total[1] += self.value(entry, "sum_time", since)
+
+            schemas = ((name, count, sum_time) for name, (count, sum_time) in totals.items())
+
+            if n is None:
+                ranking = sorted(schemas, key=lambda item: item[2], reverse=True)
+            else:
+                ranking = heapq.nlargest(n, schemas, key=lambda item: item[2])
+
+            self._rankings[key] = ranking
+
+        return self._rankings[key]
@@ -0,0 +1,219 @@
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+import threading
+import time
+
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+# (name, type, documentation, [(labels, value)]), the samples of a histogram
+# are (suffix, labels, value) with the _bucket, _sum and _count suffixes
+Family = Tuple[str, str, str, List[Tuple]]
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def families(self) -> Iterable[Family]:
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def families(self) -> Iterable[Family]:
+        with self._lock:
+            values = list(self._values.items())
+
+        yield self.name, self.kind, self.documentation, [
+            (dict(zip(self.labelnames, key)), value) for key, value in values
+        ]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets) + (float("inf"),)
+        # labels -> (bucket counts, sum, count)
+        self._values: Dict[Tuple[str, ...], List] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+
+        with self._lock:
+            entry = self._values.get(key)
+
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+
+            for position, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][position] += 1
+
+                    break
+
+            entry[1] += value
+            entry[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def families(self) -> Iterable[Family]:
+        with self._lock:
+            values = [(key, list(entry[0]), entry[1], entry[2]) for key, entry in self._values.items()]
+
+        samples = []
+
+        for key, counts, total, count in values:
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+
+            for bound, bucket in zip(self.buckets, counts):
+                cumulative += bucket
+                samples.append(("_bucket", dict(labels, le=_format_value(bound)), cumulative))
+
+            samples.append(("_sum", labels, total))
+            samples.append(("_count", labels, count))
+
+        yield self.name, self.kind, self.documentation, samples
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[Metric] = []
+        self._collectors: List[Callable[[], Iterable[Family]]] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self._metrics.append(metric)
+
+        return metric
+
+    def add_collector(self, collector: Callable[[], Iterable[Family]]) -> None:
+        """
+        Register a callable returning metric families computed at scrape time.
+        """
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        """
+        The Prometheus text exposition format of every metric.
+        """
+        lines = []
+        families: List[Family] = []
+
+        for metric in self._metrics:
+            families.extend(metric.families())
+
+        for collector in self._collectors:
+            families.extend(collector())
+
+        for name, kind, documentation, samples in families:
+            lines.append(f"# HELP {name} {documentation}")
+            lines.append(f"# TYPE {name} {kind}")
+
+            if kind != "histogram":
+                samples = [("", labels, value) for labels, value in samples]
+
+            for suffix, labels, value in samples:
+                lines.append(f"{name}{suffix}{_format_labels(labels)} {_format_value(value)}")
+
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+request_duration = registry.register(Histogram(
+    "proxyweb_request_duration_seconds",
+    "Time spent handling a request",
+    ("endpoint", "server"),
+))
+db_duration = registry.register(Histogram(
+    "proxyweb_db_duration_seconds",
+    "Time spent talking to ProxySQL by phase (connect, execute, fetch)",
+    ("phase", "server"),
+))
+render_duration = registry.register(Histogram(
+    "proxyweb_render_duration_seconds",
+    "Time spent rendering templates",
+    ("template",),
+))
+config_parse_duration = registry.register(Histogram(
+    "proxyweb_config_parse_duration_seconds",
+    "Time spent parsing and validating the config file",
+))
+errors = registry.register(Counter(
+    "proxyweb_errors_total",
+    "Requests that ended with an error",
+    ("endpoint",),
+))
+db_errors = registry.register(Counter(
+    "proxyweb_db_errors_total",
+    "Failed ProxySQL statements",
+    ("server",),
+))
+rows_returned = registry.register(Counter(
+    "proxyweb_rows_total",
+    "Rows fetched from ProxySQL",
+    ("server",),
+))
+bytes_rendered = registry.register(Counter(
+    "proxyweb_response_bytes_total",
+    "Bytes of the response bodies",
+    ("endpoint",),
+))
+watch_polls = registry.register(Counter(
+    "proxyweb_watch_polls_total",
+    "Polls of watched tables, skipped when their runtime checksum didn't change",
+    ("result",),
+))
@@ -0,0 +1,276 @@
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Optional, Tuple
+import logging
+import threading
+import time
+
+
+# idle connections older than this are pinged before they are handed out
+PING_AFTER = 1.0
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class PooledConnection:
+    """
+    Thin proxy around a driver connection, close() hands it back to the pool.
+    """
+
+    def __init__(self, pool: "ConnectionPool", conn, created: float):
+        object.__setattr__(self, "_pool", pool)
+        object.__setattr__(self, "_conn", conn)
+        object.__setattr__(self, "_created", created)
+        object.__setattr__(self, "_released", False)
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __setattr__(self, name, value):
+        setattr(self._conn, name, value)
+
+    def close(self) -> None:
+        if self._released:
+            return
+
+        object.__setattr__(self, "_released", True)
+        self._pool.release(self)
+
+    def discard(self) -> None:
+        """
+        Close the underlying connection instead of returning it to the pool.
+        """
+        if self._released:
+            return
+
+        object.__setattr__(self, "_released", True)
+        self._pool.release(self, discard=True)
+
+
+class ConnectionPool:
+    """
+    Bounded pool of connections to a single ProxySQL admin interface.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        connect: Callable[[], Any],
+        size: int = 4,
+        max_idle: float = 300,
+        max_lifetime: float = 3600,
+        timeout: float = 10,
+    ):
+        self.name = name
+        self._connect = connect
+        self.size = size
+        self.max_idle = max_idle
+        self.max_lifetime = max_lifetime
+        self.timeout = timeout
+
+        self._cond = threading.Condition()
+        # (connection, created, last used)
+        self._idle: Deque[Tuple[Any, float, float]] = deque()
+        self._in_use = 0
+        self._closed = False
+        self._counters = {
+            "checkouts": 0,
+            "creations": 0,
+            "waits": 0,
+            "timeouts": 0,
+            "evictions": 0,
+            "failed_checks": 0,
+        }
+
+    def _expired(self, created: float, last_used: float, now: float) -> bool:
+        return now - created > self.max_lifetime or now - last_used > self.max_idle
+
+    def _close(self, conn) -> None:
+        try:
+            conn.close()
+        except Exception as e:
+            logging.debug(f"Closing pooled connection to {self.name} failed: {e}")
+
+    def _healthy(self, conn, last_used: float, now: float) -> bool:
+        if now - last_used < PING_AFTER:
+            return True
+
+        try:
+            conn.ping(reconnect=False)
+
+            return True
+        except Exception:
+            return False
+
+    def acquire(self) -> PooledConnection:
+        deadline = time.monotonic() + self.timeout
+
+        while True:
+            candidate = self._checkout(deadline)
+
+            if candidate is None:
+                break
+
+            conn, created, last_used = candidate
+
+            # the check is a round trip, keep it outside of the lock
+            if self._healthy(conn, last_used, time.monotonic()):
+                return PooledConnection(self, conn, created)
+
+            self._close(conn)
+
+            with self._cond:
+                self._counters["failed_checks"] += 1
+                self._in_use -= 1
+                self._cond.notify()
+
+        try:
+            conn = self._connect()
+        except Exception:
+            with self._cond:
+                self._in_use -= 1
+                self._cond.notify()
+
+            raise
+
+        with self._cond:
+            self._counters["creations"] += 1
+
+        return PooledConnection(self, conn, time.monotonic())
+
+    def _checkout(self, deadline: float) -> Optional[Tuple[Any, float, float]]:
+        """
+        Reserve a slot and return an idle connection, or None when a new one
+        has to be opened for the slot.
+        """
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise PoolTimeout(f"Connection pool for {self.name} is closed")
+
+                now = time.monotonic()
+
+                while self._idle:
+                    conn, created, last_used = self._idle.pop()
+
+                    if self._expired(created, last_used, now):
+                        self._counters["evictions"] += 1
+                        self._close(conn)
+
+                        continue
+
+                    self._in_use += 1
+                    self._counters["checkouts"] += 1
+
+                    return conn, created, last_used
+
+                if self._in_use < self.size:
+                    self._in_use += 1
+                    self._counters["checkouts"] += 1
+
+                    return None
+
+                remaining = deadline - now
+
+                if remaining <= 0:
+                    self._counters["timeouts"] += 1
+
+                    raise PoolTimeout(f"Timed out waiting for a connection to {self.name}")
+
+                self._counters["waits"] += 1
+                self._cond.wait(remaining)
+
+    def release(self, pooled: PooledConnection, discard: bool = False) -> None:
+        conn = pooled._conn
+
+        if not discard:
+            try:
+                # the connection can't be reused with pending results
+                if conn.unread_result:
+                    conn.consume_results()
+            except Exception:
+                discard = True
+
+        now = time.monotonic()
+
+        with self._cond:
+            self._in_use -= 1
+
+            if discard or self._closed or self._expired(pooled._created, now, now):
+                self._counters["evictions"] += 1
+                self._close(conn)
+            else:
+                self._idle.append((conn, pooled._created, now))
+
+            self._cond.notify()
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+
+            while self._idle:
+                self._close(self._idle.pop()[0])
+
+            self._cond.notify_all()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return dict(
+                self._counters,
+                size=self.size,
+                in_use=self._in_use,
+                idle=len(self._idle),
+            )
+
+
+class PoolManager:
+    """
+    Holds one pool per server, a pool is replaced when the server's DSN or
+    the pool settings change in the config.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pools: Dict[str, Tuple[Tuple, ConnectionPool]] = {}
+
+    def get(
+        self,
+        name: str,
+        dsn: Dict[str, Any],
+        connect: Callable[[], Any],
+        settings: Optional[Dict[str, Any]] = None,
+    ) -> ConnectionPool:
+        settings = dict(settings or {})
+        key = (tuple(sorted(dsn.items())), tuple(sorted(settings.items())))
+
+        with self._lock:
+            entry = self._pools.get(name)
+
+            if entry is not None and entry[0] == key:
+                return entry[1]
+
+            if entry is not None:
+                logging.info(f"Config of {name} changed, replacing its connection pool")
+                entry[1].close()
+
+            pool = ConnectionPool(name, connect, **settings)
+            self._pools[name] = (key, pool)
+
+            return pool
+
+    def close_all(self) -> None:
+        with self._lock:
+            for _, pool in self._pools.values():
+                pool.close()
+
+            self._pools.clear()
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            pools = list(self._pools.items())
+
+        return {name: pool.stats() for name, (_, pool) in pools}
+
+
+pools = PoolManager()
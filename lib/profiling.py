@@ -0,0 +1,343 @@
+from collections import Counter
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+import cProfile
+import io
+import json
+import os
+import pstats
+import sqlite3
+import sys
+import threading
+import time
+
+
+_local = threading.local()
+
+
+class RequestProfile:
+    """
+    Per phase timings of a request. Phases are exclusive: the time of a phase
+    that runs inside another one (e.g. a query issued while rendering) is
+    only counted once, in the inner phase.
+    """
+
+    def __init__(self, endpoint: str, path: str, method: str, cprofile: bool = False):
+        self.endpoint = endpoint
+        self.path = path
+        self.method = method
+        self.thread_id = threading.get_ident()
+        self.start = time.perf_counter()
+        self.duration: Optional[float] = None
+        self.phases: Dict[str, float] = {}
+        # collapsed stacks -> number of samples
+        self.stacks: Counter = Counter()
+        self.profiler: Optional[cProfile.Profile] = None
+        self._children: List[float] = []
+
+        if cprofile:
+            try:
+                self.profiler = cProfile.Profile()
+                self.profiler.enable()
+            except ValueError:
+                # another profiler is already active in this process
+                self.profiler = None
+
+    def add(self, phase: str, seconds: float) -> None:
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+        if self._children:
+            self._children[-1] += seconds
+
+    def finish(self) -> float:
+        if self.duration is None:
+            self.duration = time.perf_counter() - self.start
+
+            if self.profiler is not None:
+                self.profiler.disable()
+
+        return self.duration
+
+    def breakdown(self) -> Dict[str, float]:
+        """
+        The phases and the time not spent in any of them, slowest first.
+        """
+        phases = dict(self.phases)
+        phases["other"] = max((self.duration or 0.0) - sum(self.phases.values()), 0.0)
+
+        return dict(sorted(phases.items(), key=lambda item: item[1], reverse=True))
+
+    def profile_text(self, limit: int = 40) -> str:
+        if self.profiler is None:
+            return ""
+
+        output = io.StringIO()
+        stats = pstats.Stats(self.profiler, stream=output)
+        stats.strip_dirs().sort_stats("cumulative").print_stats(limit)
+
+        return output.getvalue()
+
+
+def begin(profile: RequestProfile) -> RequestProfile:
+    _local.profile = profile
+
+    return profile
+
+
+def end() -> Optional[RequestProfile]:
+    profile = current()
+    _local.profile = None
+
+    if profile is not None:
+        profile.finish()
+
+    return profile
+
+
+def current() -> Optional[RequestProfile]:
+    return getattr(_local, "profile", None)
+
+
+def record(phase: str, seconds: float) -> None:
+    profile = current()
+
+    if profile is not None:
+        profile.add(phase, seconds)
+
+
+@contextmanager
+def phase(name: str):
+    profile = current()
+
+    if profile is None:
+        yield
+
+        return
+
+    profile._children.append(0.0)
+    start = time.perf_counter()
+
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        children = profile._children.pop()
+        profile.phases[name] = profile.phases.get(name, 0.0) + elapsed - children
+
+        if profile._children:
+            profile._children[-1] += elapsed
+
+
+def timed_iter(iterable, name: str):
+    """
+    Yields from the iterable, timing every step as the given phase.
+    """
+    iterator = iter(iterable)
+
+    try:
+        while True:
+            with phase(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+
+            yield item
+    finally:
+        if hasattr(iterable, "close"):
+            iterable.close()
+
+
+class StackSampler:
+    """
+    Samples the stack of the threads serving profiled requests from a
+    background thread, cheap enough to keep on for every profiled request.
+
+    Only the frames of the profiled threads are read, formatted right away
+    and let go: holding on to frame objects of other threads would let their
+    locals (e.g. generators of streamed responses) be finalized in the
+    sampler thread.
+    """
+
+    def __init__(self, interval: float = 0.01, depth: int = 40):
+        self.interval = interval
+        self.depth = depth
+        self._profiles: Dict[int, RequestProfile] = {}
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def add(self, profile: RequestProfile) -> None:
+        with self._lock:
+            self._profiles[profile.thread_id] = profile
+
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="proxyweb-stack-sampler", daemon=True)
+                self._thread.start()
+
+    def remove(self, profile: RequestProfile) -> None:
+        with self._lock:
+            if self._profiles.get(profile.thread_id) is profile:
+                del self._profiles[profile.thread_id]
+
+    def _run(self) -> None:
+        while True:
+            time.sleep(self.interval)
+
+            with self._lock:
+                profiles = list(self._profiles.values())
+
+            if not profiles:
+                continue
+
+            stacks = self._sample([profile.thread_id for profile in profiles])
+
+            for profile in profiles:
+                stack = stacks.get(profile.thread_id)
+
+                if stack:
+                    profile.stacks[stack] += 1
+
+    def _sample(self, thread_ids: List[int]) -> Dict[int, str]:
+        """
+        thread id -> collapsed stack, outermost frame first
+        """
+        frames = sys._current_frames()
+        frame = None
+        stacks = {}
+
+        try:
+            for thread_id in thread_ids:
+                frame = frames.get(thread_id)
+                lines = []
+
+                # most recent call first
+                while frame is not None and len(lines) < self.depth:
+                    code = frame.f_code
+                    lines.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+
+                stacks[thread_id] = ";".join(reversed(lines))
+        finally:
+            del frame, frames
+
+        return stacks
+
+
+class SlowRequestLog:
+    """
+    The slow requests in a local SQLite file, only the latest `size` entries
+    are kept.
+    """
+
+    def __init__(self, path: str, size: int = 500):
+        self.path = path
+        self.size = size
+        self._local = threading.local()
+
+        with self._connection() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS requests (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    ts REAL NOT NULL,
+                    method TEXT NOT NULL,
+                    endpoint TEXT NOT NULL,
+                    path TEXT NOT NULL,
+                    status INTEGER NOT NULL,
+                    duration REAL NOT NULL,
+                    dominant TEXT NOT NULL,
+                    phases TEXT NOT NULL,
+                    stacks TEXT NOT NULL,
+                    profile TEXT NOT NULL
+                )
+            """)
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+
+        return conn
+
+    def add(self, profile: RequestProfile, status: int, stacks: int = 20) -> None:
+        phases = profile.breakdown()
+
+        with self._connection() as conn:
+            conn.execute(
+                "INSERT INTO requests "
+                "(ts, method, endpoint, path, status, duration, dominant, phases, stacks, profile) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    time.time(),
+                    profile.method,
+                    profile.endpoint,
+                    profile.path,
+                    status,
+                    profile.duration,
+                    next(iter(phases)),
+                    json.dumps(phases),
+                    json.dumps(profile.stacks.most_common(stacks)),
+                    profile.profile_text(),
+                )
+            )
+            conn.execute(
+                "DELETE FROM requests WHERE id <= (SELECT MAX(id) FROM requests) - ?",
+                (self.size,)
+            )
+
+    def get(self, entry_id: int) -> Optional[dict]:
+        row = self._connection().execute("SELECT * FROM requests WHERE id = ?", (entry_id,)).fetchone()
+
+        if row is None:
+            return None
+
+        entry = dict(row)
+        entry["phases"] = json.loads(entry["phases"])
+        entry["stacks"] = json.loads(entry["stacks"])
+
+        return entry
+
+    def recent(self, limit: int = 50) -> List[dict]:
+        rows = self._connection().execute(
+            "SELECT id, ts, method, endpoint, path, status, duration, dominant "
+            "FROM requests ORDER BY id DESC LIMIT ?",
+            (limit,)
+        )
+
+        return [dict(row) for row in rows]
+
+    def endpoints(self) -> List[dict]:
+        """
+        Per endpoint count, max and average duration and the phase that
+        dominated most often, slowest first.
+        """
+        rows = self._connection().execute(
+            "SELECT endpoint, dominant, COUNT(*) AS count, MAX(duration) AS max, SUM(duration) AS total "
+            "FROM requests GROUP BY endpoint, dominant"
+        )
+        endpoints: Dict[str, dict] = {}
+
+        for row in rows:
+            endpoint = endpoints.setdefault(row["endpoint"], {
+                "endpoint": row["endpoint"],
+                "count": 0,
+                "max": 0.0,
+                "total": 0.0,
+                "dominant": row["dominant"],
+                "dominant_count": 0,
+            })
+            endpoint["count"] += row["count"]
+            endpoint["max"] = max(endpoint["max"], row["max"])
+            endpoint["total"] += row["total"]
+
+            if row["count"] > endpoint["dominant_count"]:
+                endpoint["dominant"] = row["dominant"]
+                endpoint["dominant_count"] = row["count"]
+
+        for endpoint in endpoints.values():
+            endpoint["avg"] = endpoint["total"] / endpoint["count"]
+
+        return sorted(endpoints.values(), key=lambda endpoint: endpoint["max"], reverse=True)
@@ -0,0 +1,169 @@
+from typing import Any, List, Optional, Set, Tuple
+import re
+
+
+_QUOTED_OR_SPACE = re.compile(r"('(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|`[^`]*`)|\s+")
+_TABLE_NAME = r"((?:`[^`]+`|\w+)(?:\.(?:`[^`]+`|\w+))?)"
+_WRITE_TABLE = re.compile(
+    r"^(?:(?:INSERT|REPLACE)(?:\s+OR\s+\w+)?\s+INTO|UPDATE|DELETE\s+FROM|TRUNCATE(?:\s+TABLE)?)\s+" + _TABLE_NAME,
+    re.I
+)
+
+
+def split_statements(sql: str) -> List[Tuple[int, str]]:
+    """
+    Split a script into statements on the semicolons outside of quotes and
+    comments. Returns (line number, statement) pairs, empty statements and
+    comments are dropped. Quotes are escaped by doubling them as in the
+    SQLite of the admin interface, a backslash is an ordinary character.
+    """
+    statements = []
+    current: List[str] = []
+    line = 1
+    start_line = None
+    quote = None
+    i = 0
+    length = len(sql)
+
+    def flush():
+        statement = "".join(current).strip()
+
+        if statement:
+            statements.append((start_line or line, statement))
+
+        current.clear()
+
+    while i < length:
+        char = sql[i]
+        pair = sql[i:i + 2]
+
+        if quote:
+            current.append(char)
+
+            if char == quote:
+                # doubled quotes are an escaped quote
+                if sql[i + 1:i + 2] == quote:
+                    current.append(quote)
+                    i += 2
+
+                    continue
+
+                quote = None
+        elif char in "'\"`":
+            if start_line is None:
+                start_line = line
+
+            quote = char
+            current.append(char)
+        elif (pair == "--" and sql[i + 2:i + 3] in ("", " ", "\t", "\n", "\r")) or char == "#":
+            end = sql.find("\n", i)
+            i = length if end == -1 else end
+
+            continue
+        elif pair == "/*":
+            end = sql.find("*/", i + 2)
+            end = length if end == -1 else end + 2
+            line += sql.count("\n", i, end)
+            i = end
+
+            # keep the tokens around the comment apart
+            current.append(" ")
+
+            continue
+        elif char == ";":
+            flush()
+            start_line = None
+            i += 1
+
+            continue
+        else:
+            if start_line is None and not char.isspace():
+                start_line = line
+
+            current.append(char)
+
+        line += char == "\n"
+        i += 1
+
+    flush()
+
+    return statements
+
+
+def normalize(sql: str) -> str:
+    """
+    The statement with the whitespace outside of quotes collapsed and
+    without the trailing semicolon, so the same query typed differently
+    has the same cache key.
+    """
+    normalized = _QUOTED_OR_SPACE.sub(lambda match: match.group(1) or " ", sql).strip()
+
+    return normalized.rstrip(";").rstrip()
+
+
+def literal(value: Any) -> str:
+    """
+    A value as a literal of the SQLite behind the ProxySQL admin interface:
+    strings in single quotes with the quotes doubled. The parameters of the
+    MySQL connectors escape with backslashes, which SQLite keeps as they are.
+    """
+    if value is None:
+        return "NULL"
+
+    if isinstance(value, bool):
+        return str(int(value))
+
+    if isinstance(value, (int, float)):
+        return repr(value)
+
+    if isinstance(value, (bytes, bytearray)):
+        value = value.decode()
+
+    return "'{}'".format(str(value).replace("'", "''"))
+
+
+def table_name(name: str) -> Tuple[str, str]:
+    """
+    (database, table) of a possibly qualified and quoted table name, the
+    database is empty if not given.
+    """
+    parts = [part.strip("`").lower() for part in name.split(".")]
+
+    return ("", parts[0]) if len(parts) == 1 else (parts[0], parts[1])
+
+
+def words(sql: str) -> Set[str]:
+    """
+    The lowercase identifiers and keywords of a statement, a superset of the
+    databases and tables it reads.
+    """
+    return set(re.findall(r"\w+", sql.lower()))
+
+
+def written_tables(sql: str) -> Optional[Set[str]]:
+    """
+    The names of the tables a script writes to, None if a statement may
+    change anything (LOAD, SAVE, PROXYSQL commands...).
+    """
+    tables: Set[str] = set()
+
+    for _, statement in split_statements(sql):
+        keyword = statement.split(None, 1)[0].upper()
+
+        if keyword in ("SELECT", "SHOW"):
+            continue
+
+        # SET on the admin interface changes global_variables
+        if keyword == "SET":
+            tables.add("global_variables")
+
+            continue
+
+        match = _WRITE_TABLE.match(statement)
+
+        if match is None:
+            return None
+
+        tables.add(table_name(match.group(1))[1])
+
+    return tables
@@ -0,0 +1,126 @@
+from typing import Dict, List, Optional, Tuple
+import sqlite3
+import threading
+import time
+
+
+# (resolution, retention) in seconds, the first tier gets every sample
+TIERS: Tuple[Tuple[int, int], ...] = (
+    (10, 6 * 3600),
+    (60, 2 * 86400),
+    (600, 30 * 86400),
+)
+
+
+class TimeSeriesStore:
+    """
+    Per interval values in a local SQLite file. Every value is added to a
+    bucket of each tier right away, so coarser tiers need no rollup job, and
+    every tier only keeps its retention window.
+
+    A bucket keeps the sum, count and max of its values: the rate of a
+    counter delta is sum / resolution, the average of a gauge sum / count.
+    """
+
+    def __init__(self, path: str, tiers: Tuple[Tuple[int, int], ...] = TIERS):
+        self.path = path
+        self.tiers = tiers
+        self._local = threading.local()
+
+        with self._connection() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS samples (
+                    tier INTEGER NOT NULL,
+                    server TEXT NOT NULL,
+                    metric TEXT NOT NULL,
+                    ts INTEGER NOT NULL,
+                    total REAL NOT NULL,
+                    count INTEGER NOT NULL,
+                    peak REAL NOT NULL,
+                    PRIMARY KEY (tier, server, metric, ts)
+                ) WITHOUT ROWID
+            """)
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+
+        return conn
+
+    def add(self, server: str, ts: float, values: Dict[str, float]) -> None:
+        rows = []
+
+        for tier, (resolution, _) in enumerate(self.tiers):
+            bucket = int(ts) - int(ts) % resolution
+
+            for metric, value in values.items():
+                rows.append((tier, server, metric, bucket, value, value))
+
+        with self._connection() as conn:
+            conn.executemany("""
+                INSERT INTO samples (tier, server, metric, ts, total, count, peak)
+                VALUES (?, ?, ?, ?, ?, 1, ?)
+                ON CONFLICT (tier, server, metric, ts) DO UPDATE SET
+                    total = total + excluded.total,
+                    count = count + 1,
+                    peak = MAX(peak, excluded.peak)
+            """, rows)
+
+    def prune(self, now: Optional[float] = None) -> None:
+        now = time.time() if now is None else now
+
+        with self._connection() as conn:
+            for tier, (_, retention) in enumerate(self.tiers):
+                conn.execute(
+                    "DELETE FROM samples WHERE tier = ? AND ts < ?",
+                    (tier, int(now - retention))
+                )
+
+    def tier_for(self, seconds: float) -> int:
+        """
+        The finest tier that still covers the given time range.
+        """
+        for tier, (_, retention) in enumerate(self.tiers):
+            if seconds <= retention:
+                return tier
+
+        return len(self.tiers) - 1
+
+    def series(
+        self,
+        server: str,
+        metrics: List[str],
+        since: float,
+        until: Optional[float] = None
+    ) -> Tuple[int, Dict[str, Dict[str, list]]]:
+        """
+        Returns with the resolution and metric -> columns "ts", "total",
+        "count" and "peak" of the buckets in the time range.
+        """
+        until = time.time() if until is None else until
+        tier = self.tier_for(until - since)
+        series = {metric: {"ts": [], "total": [], "count": [], "peak": []} for metric in metrics}
+
+        if not metrics:
+            return self.tiers[tier][0], series
+
+        cursor = self._connection().execute(
+            "SELECT metric, ts, total, count, peak FROM samples "
+            "WHERE tier = ? AND server = ? AND ts BETWEEN ? AND ? "
+            "AND metric IN ({}) ORDER BY metric, ts".format(",".join("?" * len(metrics))),
+            [tier, server, int(since), int(until)] + list(metrics)
+        )
+
+        for metric, ts, total, count, peak in cursor:
+            columns = series[metric]
+            columns["ts"].append(ts)
+            columns["total"].append(total)
+            columns["count"].append(count)
+            columns["peak"].append(peak)
+
+        return self.tiers[tier][0], series
@@ -0,0 +1,281 @@
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+import json
+import logging
+import queue
+import threading
+import time
+
+from lib import metrics
+from lib.diff import CONFIG_TABLES, TableSnapshot
+
+
+# stats table -> the columns identifying a row, the config tables and their
+# runtime_ counterparts are keyed like in the config diff
+STATS_TABLES: Dict[str, Tuple[str, ...]] = {
+    "stats_mysql_connection_pool": ("hostgroup", "srv_host", "srv_port"),
+    "stats_mysql_connection_pool_reset": ("hostgroup", "srv_host", "srv_port"),
+    "stats_mysql_commands_counters": ("Command",),
+    "stats_mysql_global": ("Variable_Name",),
+    "stats_memory_metrics": ("Variable_Name",),
+    "stats_mysql_processlist": ("SessionID",),
+    "stats_mysql_users": ("username",),
+    "stats_mysql_query_digest": ("hostgroup", "schemaname", "username", "client_address", "digest"),
+    "stats_proxysql_servers_metrics": ("hostname", "port"),
+}
+
+
+def table_key(table: str) -> Tuple[str, ...]:
+    """
+    The key columns of a table, rows of other tables are keyed by their
+    content: a changed row is sent as a removal and an addition.
+    """
+    if table in STATS_TABLES:
+        return STATS_TABLES[table]
+
+    if table.startswith("runtime_"):
+        table = table[len("runtime_"):]
+
+    return CONFIG_TABLES.get(table, ())
+
+
+def row_id(key: Tuple) -> str:
+    return json.dumps(list(key), default=str)
+
+
+def snapshot_event(snapshot: TableSnapshot) -> Dict[str, Any]:
+    return {
+        "event": "snapshot",
+        "column_names": snapshot.columns,
+        "rows": [[row_id(key), row] for key, (_, row) in snapshot.rows.items()],
+    }
+
+
+def sse(event: Dict[str, Any]) -> str:
+    """
+    A Server-Sent Events message, encoded once for every viewer.
+    """
+    return "event: {}\ndata: {}\n\n".format(event["event"], json.dumps(event, default=str))
+
+
+def delta_event(old: TableSnapshot, new: TableSnapshot) -> Optional[Dict[str, Any]]:
+    """
+    The rows added or changed and the ids of the rows removed between two
+    snapshots, None if the table didn't change. A change of the columns
+    sends the whole table again.
+    """
+    if old.digest == new.digest:
+        return None
+
+    if old.columns != new.columns:
+        return snapshot_event(new)
+
+    upsert = [
+        [row_id(key), row]
+        for key, (row_hash, row) in new.rows.items()
+        if key not in old.rows or old.rows[key][0] != row_hash
+    ]
+    remove = [row_id(key) for key in old.rows if key not in new.rows]
+
+    if not (upsert or remove):
+        return None
+
+    return {"event": "delta", "upsert": upsert, "remove": remove}
+
+
+class Subscription:
+    """
+    The events of a watched table for one viewer. A viewer that falls
+    behind by more than `size` events gets the whole table again instead.
+    """
+
+    def __init__(self, size: int = 100, wakeup: Optional[Callable[[], None]] = None):
+        self.events: "queue.Queue[str]" = queue.Queue(size)
+        self._wakeup = wakeup
+
+    def put(self, event: str, snapshot: Callable[[], str]) -> None:
+        try:
+            self.events.put_nowait(event)
+        except queue.Full:
+            while True:
+                try:
+                    self.events.get_nowait()
+                except queue.Empty:
+                    break
+
+            self.events.put_nowait(snapshot())
+
+        if self._wakeup is not None:
+            self._wakeup()
+
+    def get(self, timeout: Optional[float] = None) -> Optional[str]:
+        """
+        The next event, None if there was none within the timeout. A timeout
+        of 0 doesn't block.
+        """
+        try:
+            return self.events.get(block=timeout != 0, timeout=timeout or None)
+        except queue.Empty:
+            return None
+
+
+class TableWatch:
+    """
+    Polls one table for every viewer of it: the rows are fetched once per
+    interval no matter how many viewers there are, and only the rows that
+    changed are sent to them.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        fetch: Callable[[], Tuple[List[str], List[Tuple]]],
+        fingerprint: Callable[[], Optional[str]],
+        key: Tuple[str, ...],
+        interval: float = 2,
+    ):
+        self.name = name
+        self.interval = interval
+        self._fetch = fetch
+        self._fingerprint = fingerprint
+        self._key = key
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._subscribers: List[Subscription] = []
+        self._snapshot: Optional[TableSnapshot] = None
+        self._last_fingerprint: Optional[str] = None
+        self._error: Optional[str] = None
+        self._thread = threading.Thread(target=self._run, name="proxyweb-watch", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def add(self, subscription: Subscription) -> None:
+        with self._lock:
+            self._subscribers.append(subscription)
+
+            # late viewers start from the last poll, the first ones get the
+            # first poll as a snapshot
+            if self._snapshot is not None or self._error is not None:
+                subscription.put(self._current(), self._current)
+
+    def remove(self, subscription: Subscription) -> int:
+        with self._lock:
+            if subscription in self._subscribers:
+                self._subscribers.remove(subscription)
+
+            return len(self._subscribers)
+
+    def subscribers(self) -> int:
+        with self._lock:
+            return len(self._subscribers)
+
+    def _current(self) -> str:
+        if self._snapshot is not None:
+            return sse(snapshot_event(self._snapshot))
+
+        return sse({"event": "poll_error", "message": self._error})
+
+    def _broadcast(self, event: Dict[str, Any]) -> None:
+        message = sse(event)
+
+        for subscription in self._subscribers:
+            subscription.put(message, self._current)
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            started = time.monotonic()
+
+            try:
+                self.poll()
+            except Exception as e:
+                logging.warning(f"Cannot poll {self.name}: {e}")
+
+                with self._lock:
+                    if self._error != str(e):
+                        self._error = str(e)
+                        self._broadcast({"event": "poll_error", "message": self._error})
+
+            self._stop.wait(max(self.interval - (time.monotonic() - started), 0))
+
+    def poll(self) -> None:
+        # a runtime table whose checksum didn't change isn't fetched at all
+        fingerprint = self._fingerprint()
+
+        if fingerprint is not None and fingerprint == self._last_fingerprint and self._snapshot is not None:
+            metrics.watch_polls.inc(result="skipped")
+
+            return
+
+        columns, rows = self._fetch()
+        snapshot = TableSnapshot(self.name, columns, rows, self._key)
+        metrics.watch_polls.inc(result="fetched")
+
+        with self._lock:
+            previous, self._snapshot = self._snapshot, snapshot
+            self._last_fingerprint = fingerprint
+            self._error = None
+
+            event = snapshot_event(snapshot) if previous is None else delta_event(previous, snapshot)
+
+            if event is not None:
+                self._broadcast(event)
+
+
+class TooManyViewers(Exception):
+    pass
+
+
+class WatchHub:
+    """
+    The watched tables of the process. A table is polled while it has at
+    least one viewer.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._watches: Dict[Hashable, TableWatch] = {}
+
+    def subscribe(
+        self,
+        key: Hashable,
+        factory: Callable[[], TableWatch],
+        subscription: Subscription,
+        limit: Optional[int] = None
+    ) -> TableWatch:
+        """
+        Adds a viewer to the watch of a table, fails with TooManyViewers when
+        the process already has limit viewers.
+        """
+        with self._lock:
+            if limit is not None and sum(watch.subscribers() for watch in self._watches.values()) >= limit:
+                raise TooManyViewers(f"Already {limit} live tables open in this worker")
+
+            watch = self._watches.get(key)
+
+            if watch is None:
+                watch = self._watches[key] = factory()
+                watch.start()
+
+            watch.add(subscription)
+
+            return watch
+
+    def unsubscribe(self, key: Hashable, subscription: Subscription) -> None:
+        with self._lock:
+            watch = self._watches.get(key)
+
+            if watch is not None and watch.remove(subscription) == 0:
+                del self._watches[key]
+                watch.stop()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            watches = list(self._watches.values())
+
+        return {
+            "tables": len(watches),
+            "subscribers": sum(watch.subscribers() for watch in watches),
+        }
@@ -18,17 +18,223 @@ __contact__ = "miklos.szel@edmodo.com"
 __license__ = "GPLv3"
 
 
-from typing import Any, Dict, List, Tuple
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
 import mysql.connector
 from mysql.connector.connection import MySQLConnection, MySQLCursor
+import hashlib
 import logging
+import os
+import re
 import subprocess
-from lib import config
-from models import Config, Server
+import threading
+import time
+from lib import backend, bulk, catalog, columnar, config, metrics, profiling, watch
+from lib import diff as config_diff
+from lib.digest import DIGEST_COLUMNS, DigestIndex, report_query
+from lib import sql as sql_script
+from lib.cache import ResultCache, SingleFlight, TTLCache, WriteGenerations
+from lib.pool import pools
+from models import Config, MiscQuery, Server
+
+
+# server -> databases and tables, shared by every session
+catalog_cache = TTLCache(namespace="catalog")
+
+# (server, database, table) -> column names
+columns_cache = TTLCache(namespace="columns")
+
+# (server, normalized query) -> result of a read, dropped on writes to the
+# tables the query may have read
+result_cache = ResultCache()
+
+# concurrent identical reads share one execution
+inflight = SingleFlight()
+
+
+# functions whose result changes without any write
+VOLATILE_WORDS = frozenset((
+    "random", "randomblob", "now", "current_timestamp", "current_time",
+    "current_date", "datetime", "julianday", "strftime", "changes",
+))
+
+# server -> local index of stats_mysql_query_digest
+digest_indexes: Dict[str, DigestIndex] = {}
+_digest_indexes_lock = threading.Lock()
+
+# (server, database, table) -> the poller shared by the viewers of a table
+watch_hub = watch.WatchHub()
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_workers = 0
+_executor_lock = threading.Lock()
+
+
+# runtime table -> the runtime_checksums_values entries covering it
+RUNTIME_CHECKSUMS: Dict[str, Tuple[str, ...]] = {
+    "runtime_mysql_servers": ("mysql_servers",),
+    "runtime_mysql_query_rules": ("mysql_query_rules",),
+    "runtime_mysql_users": ("mysql_users",),
+    "runtime_global_variables": ("admin_variables", "mysql_variables"),
+    "runtime_proxysql_servers": ("proxysql_servers",),
+}
+
+
+def use_cache_backend(cache_config) -> None:
+    """moves the catalogs, column lists and results to the configured
+    backend, a shared one serves every worker of the host. The local results
+    of a worker follow the writes of the others through the generations
+    directory"""
+    if cache_config.backend == "local":
+        result_cache.use_generations(WriteGenerations(cache_config.generations))
+
+        return
+
+    shared = backend.create_backend(cache_config)
+
+    for cache in (catalog_cache, columns_cache, result_cache):
+        cache.use_backend(shared)
+
+    logging.info(f"Caching in the {cache_config.backend} backend")
+
+
+def check_identifier(*names: str) -> None:
+    for name in names:
+        if not re.match(r"^\w+$", name):
+            raise ValueError(f"Invalid database or table name: {name}")
+
+
+def quote_identifier(name: str) -> str:
+    return "`{}`".format(name.replace("`", "``"))
+
+
+def like_contains(column: str, value: str) -> str:
+    """a LIKE condition matching value literally anywhere in the column, the
+    pattern is an SQLite literal: the connector's parameters would escape
+    it with backslashes, which the admin interface doesn't understand"""
+    value = value.replace("!", "!!").replace("%", "!%").replace("_", "!_")
+
+    return "{} LIKE {} ESCAPE '!'".format(quote_identifier(column), sql_script.literal("%{}%".format(value)))
+
+
+@contextmanager
+def db_phase(phase: str, server: str):
+    """times a connect, execute or fetch for the /metrics endpoint and the
+    profile of the current request"""
+    start = time.perf_counter()
+
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        metrics.db_duration.observe(elapsed, phase=phase, server=server)
+        profiling.record("db_" + phase, elapsed)
+
+
+class InstrumentedCursor:
+    """Times execute and fetch calls of a cursor and counts the fetched rows
+    for the /metrics endpoint"""
+
+    def __init__(self, cursor: MySQLCursor, server: str):
+        self._cursor = cursor
+        self._server = server
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def execute(self, *args, **kwargs):
+        try:
+            with db_phase("execute", self._server):
+                return self._cursor.execute(*args, **kwargs)
+        except mysql.connector.Error:
+            metrics.db_errors.inc(server=self._server)
+
+            raise
+
+    def _fetch(self, method: str, *args):
+        with db_phase("fetch", self._server):
+            rows = getattr(self._cursor, method)(*args)
+
+        if rows:
+            metrics.rows_returned.inc(len(rows) if method != "fetchone" else 1, server=self._server)
+
+        return rows
+
+    def fetchall(self):
+        return self._fetch("fetchall")
+
+    def fetchmany(self, size: int = 1):
+        return self._fetch("fetchmany", size)
+
+    def fetchone(self):
+        return self._fetch("fetchone")
+
+
+class RowStream:
+    """Iterates an unbuffered cursor chunk by chunk, the connection goes back
+    to the pool once the rows are exhausted, capped or the stream is closed"""
+
+    def __init__(self, conn, cur, chunk_size: int = 500, max_rows: int = 0):
+        self._conn = conn
+        self._cur = cur
+        self._chunk_size = chunk_size
+        self._done = False
+        self.max_rows = max_rows
+        self.count = 0
+        self.truncated = False
+
+    def __iter__(self):
+        try:
+            while True:
+                chunk = self._cur.fetchmany(self._chunk_size)
+
+                if not chunk:
+                    self._done = True
+
+                    return
+
+                for row in chunk:
+                    if self.max_rows and self.count >= self.max_rows:
+                        self.truncated = True
+
+                        return
+
+                    self.count += 1
+
+                    yield row
+        finally:
+            self.close()
+
+    def chunks(self, column_names: List[str]) -> Iterator[columnar.ColumnarResult]:
+        """the rows as columnar chunks of chunk_size rows"""
+        batch = []
+
+        for row in self:
+            batch.append(row)
+
+            if len(batch) == self._chunk_size:
+                yield columnar.from_rows(column_names, batch)
+                batch = []
+
+        if batch:
+            yield columnar.from_rows(column_names, batch)
+
+    def close(self) -> None:
+        if self._conn is None:
+            return
+
+        conn, self._conn = self._conn, None
+
+        # dropping the socket is cheaper than reading the rest of the rows
+        if self._done:
+            conn.close()
+        else:
+            conn.discard()
 
 
 def get_config(file: str = "config/config.yml") -> Config:
-    cfg = config.parse_config_file(file)
+    cfg = config.config_store.get(file)
 
     return cfg
 
@@ -39,30 +245,37 @@ def db_connect(
     autocommit: bool = False,
     buffered: bool = False,
     dictionary: bool = True
-) -> Tuple[MySQLConnection, MySQLCursor]:
+) -> Tuple[MySQLConnection, InstrumentedCursor]:
     config = get_config()
     db["cnf"] = config
 
     server_config = config.servers[server].dsn
     logging.debug(server_config)
 
-    conn = mysql.connector.connect(
-        **server_config,
-        raise_on_warnings=True,
-        get_warnings=True,
-        connection_timeout=3
-    )
+    def connect() -> MySQLConnection:
+        return mysql.connector.connect(
+            **server_config,
+            raise_on_warnings=True,
+            get_warnings=True,
+            connection_timeout=3,
+            # read_timeout needs the socket of the pure Python protocol, the
+            # C extension would be picked up whenever it's installed
+            use_pure=True
+        )
+
+    # close() on the returned connection hands it back to the pool
+    with db_phase("connect", server):
+        conn = pools.get(server, server_config, connect, config.glob.pool).acquire()
 
-    if conn.is_connected():
-        logging.debug(f"Connected to {server_config.db} as {server_config.user} on {server_config.host}")
+    logging.debug(f"Connected to {server_config.db} as {server_config.user} on {server_config.host}")
 
     conn.autocommit = autocommit
     conn.get_warnings = True
 
-    cursor = conn.cursor(
+    cursor = InstrumentedCursor(conn.cursor(
         buffered=buffered,
         dictionary=dictionary
-    )
+    ), server)
 
     logging.debug(f"Buffered: {buffered}, dictionary: {dictionary}, autocommit: {autocommit}")
 
@@ -70,113 +283,1269 @@ def db_connect(
 
 
 def get_all_dbs_and_tables(db, server: str) -> Dict[str, Dict[str, List[str]]]:
-    all_dbs = {server: {}}
-
     conn, cur = db_connect(db, server=server)
 
     try:
-        cur.execute("SHOW DATABASES")
-
-        table_exception_list = db["cnf"]["glob"]["hide_tables"] if "hide_tables" in db["cnf"]["glob"] else []
-
-        if db["cnf"]["servers"][server]["hide_tables"]:
-            table_exception_list += db["cnf"]["servers"][server]["hide_tables"]
+        # hide tables as per global or per server config
+        hidden = catalog.hidden_tables(db["cnf"], server)
 
-        for database in cur.fetchall():
-            all_dbs[server][database["name"]] = []
-
-            cur.execute(f"SHOW TABLES FROM {database['name']}")
-            for table in cur.fetchall():
-                # hide tables as per global or per server config
-                if table["tables"] not in table_exception_list:
-                    all_dbs[server][database["name"]].append(table["tables"])
+        all_dbs = {server: catalog.discover(conn, cur, hidden)}
     finally:
         conn.close()
 
     return all_dbs
 
 
+def get_catalog(db, server: str, refresh: bool = False) -> Dict[str, List[str]]:
+    """returns with the databases and tables of a server, cached for
+    catalog_ttl seconds"""
+    if refresh:
+        catalog_cache.invalidate(server)
+
+    return catalog_cache.get_or_set(
+        server,
+        lambda: get_all_dbs_and_tables(db, server)[server],
+        ttl=get_config().glob.catalog_ttl
+    )
+
+
 def get_table_content(db, server: str, database: str, table: str) -> Dict[str, Any]:
     """returns with a dict with two keys
-    "column_names" = list and rows = tuples"""
-    content = {}
-
+    "column_names" = list and rows = tuples (a ColumnarResult)"""
     logging.debug("server: {} - db: {} - table:{}".format(
         server,
         database,
         table
     ))
 
+    string = "SELECT * FROM {}.{} ORDER BY 1".format(database, table)
+
+    def fetch() -> Dict[str, Any]:
+        content = {}
+        conn, cur = db_connect(db, server=server, dictionary=False)
+
+        try:
+            logging.debug("query: {}".format(string))
+
+            cur.execute(string)
+
+            content["rows"] = fetch_rows(cur)
+            content["column_names"] = [
+                i[0] for i in cur.description
+            ]
+        finally:
+            conn.close()
+
+        return content
+
+    return cached_read(server, string, None, fetch)
+
+
+def fingerprint_rows(column_names: List[str], rows) -> str:
+    """row count and a hash of the rows, computed while iterating them"""
+    digest = hashlib.sha1("\x1e".join(column_names).encode())
+    count = 0
+
+    for row in rows:
+        digest.update(repr(tuple(row)).encode())
+        count += 1
+
+    return "{}-{}".format(count, digest.hexdigest())
+
+
+def get_checksum_fingerprint(db, server: str, database: str, table: str) -> Optional[str]:
+    """the fingerprint of a runtime table from the checksums ProxySQL keeps
+    for its cluster sync, None for other tables or if checksums are off"""
+    names = checksum_names(database, table)
+
+    if names is None:
+        return None
+
+    return inflight.do(
+        ("checksum", server, names, result_cache.generation),
+        lambda: fetch_checksum_fingerprint(db, server, names)
+    )
+
+
+def checksum_names(database: str, table: str) -> Optional[Tuple[str, ...]]:
+    """the runtime_checksums_values names of a table, None if it has none"""
+    return RUNTIME_CHECKSUMS.get(table) if database == "main" else None
+
+
+def checksum_query(names: Tuple[str, ...]) -> str:
+    return (
+        "SELECT name, version, epoch, checksum FROM runtime_checksums_values "
+        "WHERE name IN ({}) ORDER BY name".format(", ".join("'{}'".format(name) for name in names))
+    )
+
+
+def checksum_set(checksum: Optional[str]) -> bool:
+    """admin-checksum_* disabled leaves the checksum empty or zero"""
+    try:
+        return int(checksum, 16) != 0
+    except (TypeError, ValueError):
+        return False
+
+
+def checksum_fingerprint(names: Tuple[str, ...], rows: List[Tuple]) -> Optional[str]:
+    if len(rows) != len(names) or not all(checksum_set(checksum) for _, _, _, checksum in rows):
+        return None
+
+    return "checksum-" + "-".join("{}.{}.{}".format(version, epoch, checksum) for _, version, epoch, checksum in rows)
+
+
+def fetch_checksum_fingerprint(db, server: str, names: Tuple[str, ...]) -> Optional[str]:
     conn, cur = db_connect(db, server=server, dictionary=False)
 
     try:
+        cur.execute(checksum_query(names))
+        rows = cur.fetchall()
+    except mysql.connector.Error as e:
+        logging.debug(f"No runtime checksums on {server}: {e}")
 
-        string = "SELECT * FROM {}.{} ORDER BY 1".format(database, table)
-        logging.debug("query: {}".format(string))
+        return None
+    finally:
+        conn.close()
 
-        cur.execute(string)
+    return checksum_fingerprint(names, rows)
 
-        content["rows"] = cur.fetchall()
-        content["column_names"] = [
-            i[0] for i in cur.description
-        ]
+
+def fingerprinted(database: str) -> bool:
+    """whether the tables of a database get a fingerprint: stats and monitor
+    tables change all the time, hashing them on every poll would only cost a
+    full read to tell that"""
+    return not (database.startswith("stats") or database == "monitor")
+
+
+def get_table_fingerprint(db, server: str, database: str, table: str) -> Optional[str]:
+    """a cheap value that changes when the content of the table does: the
+    runtime checksum where ProxySQL has one, a hash of the rows streamed
+    from the server otherwise, None for the tables that aren't fingerprinted.
+    Every open page of a table polls it, so concurrent calls share one
+    computation."""
+    check_identifier(database, table)
+
+    if not fingerprinted(database):
+        return None
+
+    return inflight.do(
+        ("fingerprint", server, database, table, result_cache.generation),
+        lambda: compute_table_fingerprint(db, server, database, table)
+    )
+
+
+def compute_table_fingerprint(db, server: str, database: str, table: str) -> str:
+    fingerprint = get_checksum_fingerprint(db, server, database, table)
+
+    if fingerprint is not None:
+        return fingerprint
+
+    conn, cur = db_connect(db, server=server, dictionary=False)
+
+    try:
+        cur.execute("SELECT * FROM {}.{} ORDER BY 1".format(database, table))
+
+        def rows():
+            while True:
+                chunk = cur.fetchmany(500)
+
+                if not chunk:
+                    return
+
+                yield from chunk
+
+        return fingerprint_rows([i[0] for i in cur.description], rows())
     finally:
         conn.close()
 
-    return content
+
+def get_watch_rows(db, server: str, database: str, table: str, max_rows: int) -> Tuple[List[str], List[Tuple]]:
+    """returns with the column names and the rows of a watched table, fails
+    on tables with more than max_rows rows"""
+    conn, cur = db_connect(db, server=server, dictionary=False)
+
+    try:
+        cur.execute("SELECT * FROM {}.{} ORDER BY 1 LIMIT {}".format(database, table, max_rows + 1))
+        rows = cur.fetchall()
+        column_names = [i[0] for i in cur.description]
+    finally:
+        conn.close()
+
+    if len(rows) > max_rows:
+        raise ValueError(f"{database}.{table} has more than {max_rows} rows, too many to watch")
+
+    return column_names, rows
+
+
+def watch_table(
+    db,
+    server: str,
+    database: str,
+    table: str,
+    subscription: watch.Subscription,
+    limit: Optional[int] = None
+) -> Tuple[str, str, str]:
+    """subscribes to the changed rows of a table, the table is polled once
+    per interval for all of its viewers; returns with the key to
+    unsubscribe with. Fails with watch.TooManyViewers when the process has
+    limit viewers already"""
+    check_identifier(database, table)
+
+    config = get_config()
+
+    if server not in config.servers:
+        raise ValueError(f"Unknown server: {server}")
+
+    key = (server, database, table)
+    watch_config = config.glob.watch
+
+    watch_hub.subscribe(
+        key,
+        lambda: watch.TableWatch(
+            "{}:{}.{}".format(server, database, table),
+            lambda: get_watch_rows(db, server, database, table, watch_config.max_rows),
+            lambda: get_checksum_fingerprint(db, server, database, table),
+            watch.table_key(table),
+            watch_config.interval
+        ),
+        subscription,
+        limit
+    )
+
+    return key
+
+
+def unwatch_table(key: Tuple[str, str, str], subscription: watch.Subscription) -> None:
+    watch_hub.unsubscribe(key, subscription)
+
+
+def get_table_columns(db, server: str, database: str, table: str) -> List[str]:
+    """returns with the column names of a table, cached for catalog_ttl
+    seconds"""
+    check_identifier(database, table)
+
+    def fetch() -> List[str]:
+        conn, cur = db_connect(db, server=server, dictionary=False)
+
+        try:
+            cur.execute("SELECT * FROM {}.{} LIMIT 0".format(database, table))
+            cur.fetchall()
+
+            return [i[0] for i in cur.description]
+        finally:
+            conn.close()
+
+    return columns_cache.get_or_set(
+        (server, database, table),
+        fetch,
+        ttl=get_config().glob.catalog_ttl
+    )
+
+
+def get_table_page(
+    db,
+    server: str,
+    database: str,
+    table: str,
+    start: int = 0,
+    length: int = -1,
+    order: Optional[List[Tuple[int, str]]] = None,
+    search: str = "",
+    column_search: Optional[Dict[int, str]] = None
+) -> Dict[str, Any]:
+    """returns with one page of a table, filtered and sorted by ProxySQL:
+    "column_names" = list, "rows" = tuples (a ColumnarResult),
+    "records_total" and "records_filtered" = int"""
+    column_names = get_table_columns(db, server, database, table)
+    count, string = table_page_queries(column_names, database, table, start, length, order, search, column_search)
+
+    def fetch() -> Dict[str, Any]:
+        conn, cur = db_connect(db, server=server, dictionary=False)
+
+        try:
+            cur.execute(count)
+            counts = cur.fetchone()
+
+            logging.debug("query: {}".format(string))
+
+            cur.execute(string)
+
+            return table_page_result(column_names, counts, fetch_rows(cur))
+        finally:
+            conn.close()
+
+    # the counts come from the same filter, the page query identifies both
+    return cached_read(server, string, None, fetch)
+
+
+def table_page_queries(
+    column_names: List[str],
+    database: str,
+    table: str,
+    start: int = 0,
+    length: int = -1,
+    order: Optional[List[Tuple[int, str]]] = None,
+    search: str = "",
+    column_search: Optional[Dict[int, str]] = None
+) -> Tuple[str, str]:
+    """the count and the page statement of get_table_page, without
+    parameters: a literal with a % in it would be taken for one"""
+    source = "{}.{}".format(database, table)
+
+    conditions = []
+
+    if search:
+        conditions.append("({})".format(" OR ".join(like_contains(name, search) for name in column_names)))
+
+    for index, value in sorted((column_search or {}).items()):
+        if 0 <= index < len(column_names) and value:
+            conditions.append(like_contains(column_names[index], value))
+
+    where = " AND ".join(conditions)
+
+    order_by = ", ".join(
+        "{} {}".format(index + 1, "DESC" if direction.lower() == "desc" else "ASC")
+        for index, direction in order or []
+        if 0 <= index < len(column_names)
+    ) or "1"
+
+    string = "SELECT * FROM {}{} ORDER BY {}".format(
+        source,
+        " WHERE {}".format(where) if where else "",
+        order_by
+    )
+
+    if length >= 0:
+        string += " LIMIT {:d} OFFSET {:d}".format(length, max(start, 0))
+
+    # ProxySQL regenerates stats tables for every statement reading them,
+    # so both counts come from a single one
+    if where:
+        count = "SELECT COUNT(*), SUM(CASE WHEN {} THEN 1 ELSE 0 END) FROM {}".format(where, source)
+    else:
+        count = "SELECT COUNT(*), COUNT(*) FROM {}".format(source)
+
+    return count, string
+
+
+def table_page_result(column_names: List[str], counts: Tuple, rows: Sequence[Tuple]) -> Dict[str, Any]:
+    total, filtered = counts
+
+    return {
+        "column_names": column_names,
+        "rows": rows,
+        "records_total": int(total or 0),
+        "records_filtered": int(filtered or 0),
+    }
 
 
 def execute_adhoc_query(db, server: str, sql: str) -> Dict[str, Any]:
     """returns with a dict with two keys
-    "column_names" = list and rows = tuples"""
-    content = {}
+    "column_names" = list and rows = tuples (a ColumnarResult)"""
+    logging.debug("server: {} - sql: {}".format(server, sql))
+
+    def fetch() -> Dict[str, Any]:
+        content = {}
+        conn, cur = db_connect(db, server=server, dictionary=False)
+
+        try:
+            cur.execute(sql)
+
+            content["rows"] = fetch_rows(cur)
+            content["column_names"] = [
+                i[0] for i in cur.description
+            ]
+        finally:
+            conn.close()
+
+        return content
+
+    return cached_read(server, sql, None, fetch)
+
+
+def fetch_rows(cur) -> Sequence[Tuple]:
+    """returns with the rows of an executed query, kept column by column
+    unless columnar is disabled"""
+    columnar_config = get_config().glob.columnar
+
+    if not columnar_config.enabled:
+        return cur.fetchall()
+
+    return columnar.from_cursor(cur, columnar_config.batch_size)
+
+
+def keep_rows(column_names: List[str], rows: List[Tuple]) -> Sequence[Tuple]:
+    """fetch_rows for rows that were already read, e.g. by aiomysql"""
+    if not get_config().glob.columnar.enabled:
+        return rows
+
+    return columnar.from_rows(column_names, rows)
+
+
+def result_size(column_names: List[str], rows) -> int:
+    """a rough estimate of the memory a result takes"""
+    if isinstance(rows, columnar.ColumnarResult):
+        return sum(len(name) for name in column_names) + rows.nbytes()
+
+    size = 64 + sum(len(name) for name in column_names)
+
+    for row in rows:
+        size += 56 + 8 * len(row) + sum(
+            len(value) if isinstance(value, (str, bytes, bytearray)) else 24 for value in row
+        )
+
+    return size
+
+
+def result_ttl(words: frozenset) -> float:
+    """how long the result of a query can be served from the cache, by the
+    kind of the tables it reads: stats change all the time, runtime tables
+    also without writes from ProxyWeb (monitor, cluster sync)"""
+    ttl = get_config().glob.result_cache.ttl
+
+    if words & VOLATILE_WORDS:
+        return 0
+
+    if any(word.startswith("stats") or word == "monitor" for word in words):
+        return ttl.stats
+
+    if any(word.startswith("runtime_") for word in words):
+        return ttl.runtime
+
+    return ttl.config
+
+
+def cached_read(server: str, sql: str, params: Optional[List[Any]], fetch) -> Dict[str, Any]:
+    """returns with the cached result of a read query, or runs fetch and
+    caches the "column_names" and "rows" it returns with. Concurrent
+    identical reads wait for the first one instead of running again, also
+    when the result isn't cached (e.g. stats tables)."""
+    cached = cached_result(server, sql, params)
+
+    # callers add keys to the content dict
+    if cached is not None:
+        return dict(cached)
+
+    # a read started before a write isn't shared with the ones after it
+    generation = result_cache.generation
 
+    def run() -> Dict[str, Any]:
+        result = fetch()
+        store_result(server, sql, params, result, generation)
+
+        return result
+
+    return dict(inflight.do(read_key(server, sql, params, generation), run))
+
+
+def read_key(server: str, sql: str, params: Optional[List[Any]], generation: int) -> Tuple:
+    """the key concurrent identical reads share their result under"""
+    return "read", server, (sql_script.normalize(sql), tuple(params or ())), generation
+
+
+def cached_result(server: str, sql: str, params: Optional[List[Any]]) -> Optional[Dict[str, Any]]:
+    """the cached result of a read query, None on a miss or when the result
+    cache is off"""
+    cache_config = get_config().glob.result_cache
+
+    if not cache_config.enabled:
+        return None
+
+    result_cache.resize(cache_config.max_entries, cache_config.max_bytes)
+
+    return result_cache.get(server, (sql_script.normalize(sql), tuple(params or ())))
+
+
+def store_result(
+    server: str,
+    sql: str,
+    params: Optional[List[Any]],
+    result: Dict[str, Any],
+    generation: int
+) -> None:
+    """caches the result of a read query started at the given generation"""
+    if not get_config().glob.result_cache.enabled:
+        return
+
+    words = frozenset(sql_script.words(sql))
+
+    result_cache.set(
+        server,
+        (sql_script.normalize(sql), tuple(params or ())),
+        dict(result),
+        result_ttl(words),
+        result_size(result["column_names"], result["rows"]),
+        words,
+        generation
+    )
+
+
+def invalidate_results(server: str, sql: str) -> None:
+    """drops the cached results a script may have changed"""
+    result_cache.invalidate(server, sql_script.written_tables(sql))
+
+
+def stream_query(db, server: str, sql: str, chunk_size: int = 500, max_rows: int = 0) -> Dict[str, Any]:
+    """returns with a dict with three keys
+    "column_names" = list, rows = RowStream and "columnar" = bool"""
     logging.debug("server: {} - sql: {}".format(server, sql))
 
     conn, cur = db_connect(db, server=server, dictionary=False)
 
     try:
         cur.execute(sql)
+    except Exception:
+        conn.close()
 
-        content["rows"] = cur.fetchall()
-        content["column_names"] = [
-            i[0] for i in cur.description
-        ]
+        raise
+
+    return {
+        "column_names": [i[0] for i in cur.description],
+        "rows": RowStream(conn, cur, chunk_size, max_rows),
+        # the page sends the chunks columnar
+        "columnar": get_config().glob.columnar.enabled,
+    }
+
+
+def stream_table_content(
+    db,
+    server: str,
+    database: str,
+    table: str,
+    chunk_size: int = 500,
+    max_rows: int = 0
+) -> Dict[str, Any]:
+    check_identifier(database, table)
+
+    return stream_query(
+        db,
+        server,
+        "SELECT * FROM {}.{} ORDER BY 1".format(database, table),
+        chunk_size,
+        max_rows
+    )
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """returns with the shared worker pool for running queries concurrently,
+    recreated when the configured number of workers changes"""
+    global _executor, _executor_workers
+
+    workers = get_config().glob.concurrency.workers
+
+    with _executor_lock:
+        if _executor is None or _executor_workers != workers:
+            if _executor is not None:
+                _executor.shutdown(wait=False)
+
+            _executor = ThreadPoolExecutor(
+                max_workers=workers,
+                thread_name_prefix="proxyweb-query"
+            )
+            _executor_workers = workers
+
+        return _executor
+
+
+@contextmanager
+def read_timeout(conn, timeout: Optional[float]):
+    """makes every blocking read on the connection give up after timeout
+    seconds, then puts the previous timeout back. Needs the pure Python
+    protocol db_connect asks for"""
+    sock = getattr(conn, "_socket", None)
+
+    if not timeout or sock is None or sock.sock is None:
+        yield
+
+        return
+
+    previous = sock.sock.gettimeout()
+    sock.set_connection_timeout(timeout)
+
+    try:
+        yield
+    finally:
+        # a connection that timed out is discarded, its socket may be closed
+        if sock.sock is not None:
+            sock.set_connection_timeout(previous)
+
+
+def timed_query(
+    db,
+    server: str,
+    sql: str,
+    timeout: Optional[float] = None
+) -> Tuple[List[str], List[Tuple], float]:
+    """runs a query on its own pooled connection, returns with the column
+    names, the rows and the execution time in ms"""
+    conn, cur = db_connect(db, server=server, dictionary=False)
+
+    try:
+        start = time.perf_counter()
+
+        with read_timeout(conn, timeout):
+            cur.execute(sql)
+            rows = cur.fetchall()
+
+        return [i[0] for i in cur.description], rows, (time.perf_counter() - start) * 1000
+    except (mysql.connector.errors.InterfaceError, mysql.connector.errors.OperationalError):
+        # a timed out or broken connection is in an unknown state
+        conn.discard()
+
+        raise
     finally:
         conn.close()
 
-    return content
+
+class TimedTask:
+    """a query submitted to the worker pool with its own timeout, counted
+    from when a worker picks it up rather than from when the page asked"""
+
+    def __init__(self, timeout: float, fn, *args):
+        self.timeout = timeout
+        self.start: Optional[float] = None
+        self._started = threading.Event()
+        self.future = get_executor().submit(self._run, fn, args)
+
+    def _run(self, fn, args):
+        self.start = time.monotonic()
+        self._started.set()
+
+        return fn(*args, timeout=self.timeout)
+
+    def result(self):
+        """raises FutureTimeoutError when the query ran longer than its timeout"""
+        while not self._started.wait(0.1):
+            if self.future.done():
+                break
+
+        if self.start is None:
+            return self.future.result(0)
+
+        try:
+            # a second of slack for the worker to notice its read timed out
+            return self.future.result(timeout=max(self.start + self.timeout + 1 - time.monotonic(), 0))
+        except FutureTimeoutError:
+            raise
+        except Exception as e:
+            if time.monotonic() - self.start >= self.timeout:
+                raise FutureTimeoutError() from e
+
+            raise
+
+
+def report_result(item: MiscQuery, task: TimedTask, server: str) -> Dict[str, Any]:
+    """the result of a report query in the execute_adhoc_report format"""
+    result = {
+        "title": item.title,
+        "sql": item.sql,
+        "info": item.info,
+        "column_names": [],
+        "rows": [],
+        "elapsed": None,
+        "error": None,
+    }
+
+    try:
+        result["column_names"], result["rows"], result["elapsed"] = task.result()
+    except FutureTimeoutError:
+        result["error"] = "Timed out after {} seconds".format(task.timeout)
+    except Exception as e:
+        logging.error(f"Report query {item.title!r} failed on {server}: {e}")
+        result["error"] = str(e)
+
+    return result
 
 
 def execute_adhoc_report(db, server: str) -> List[Dict[str, Any]]:
-    """returns with a dict with two keys
-    "column_names" = list and rows = tuples"""
+    """returns with a list of dicts, one per report query in config order:
+    "column_names" = list, "rows" = tuples, "elapsed" = ms and "error"."""
+    config = get_config()
+
+    if "adhoc_report" not in config.misc.categories:
+        return []
+
+    queries = config.misc.categories["adhoc_report"].queries
+    timeout = config.glob.concurrency.timeout
+
+    tasks = [TimedTask(timeout, timed_query, db, server, item.sql) for item in queries]
+
+    return [report_result(item, task, server) for item, task in zip(queries, tasks)]
+
+
+def submit_query(db, servers: List[str], sql: str) -> Dict[str, TimedTask]:
+    """starts the query on every server, see collect_results"""
+    timeout = get_config().glob.concurrency.timeout
+
+    return {server: TimedTask(timeout, timed_query, db, server, sql) for server in servers}
+
+
+def collect_results(tasks: Dict[str, TimedTask]) -> Dict[str, Any]:
+    """merges the per server results into one table with a leading "server"
+    column, columns are matched by name. Returns with "column_names", "rows"
+    and "errors" = dict of the servers that failed or timed out."""
+    results = []
+    errors = {}
+
+    for server, task in tasks.items():
+        try:
+            names, rows, _ = task.result()
+        except FutureTimeoutError:
+            errors[server] = "Timed out after {} seconds".format(task.timeout)
+
+            continue
+        except Exception as e:
+            logging.error(f"Query failed on {server}: {e}")
+            errors[server] = str(e)
+
+            continue
+
+        results.append((server, names, rows))
+
+    return merge_results(results, errors)
+
+
+def merge_results(
+    results: List[Tuple[str, List[str], List[Tuple]]],
+    errors: Dict[str, str]
+) -> Dict[str, Any]:
+    """merges (server, column names, rows) results, see collect_results"""
+    column_names = ["server"]
+    positioned = []
+
+    for server, names, rows in results:
+        for name in names:
+            if name not in column_names:
+                column_names.append(name)
+
+        positioned.append((server, [column_names.index(name) for name in names], rows))
+
+    merged = []
+
+    for server, positions, rows in positioned:
+        for row in rows:
+            line = [None] * len(column_names)
+            line[0] = server
+
+            for position, value in zip(positions, row):
+                line[position] = value
+
+            merged.append(tuple(line))
+
+    return {
+        "column_names": column_names,
+        "rows": merged,
+        "errors": errors,
+    }
+
+
+def fan_out_query(db, servers: List[str], sql: str) -> Dict[str, Any]:
+    """runs a query on every given server concurrently, see collect_results"""
+    return collect_results(submit_query(db, servers, sql))
+
+
+def execute_adhoc_report_all(db, servers: List[str]) -> List[Dict[str, Any]]:
+    """the adhoc report of every given server, the results of a query are
+    merged into one table per query"""
     adhoc_results = []
+    config = get_config()
+
+    if "adhoc_report" not in config.misc.categories:
+        return adhoc_results
+
+    queries = config.misc.categories["adhoc_report"].queries
+
+    # start everything up front, the page takes as long as the slowest node
+    submitted = [(item, submit_query(db, servers, item.sql)) for item in queries]
+
+    for item, tasks in submitted:
+        merged = collect_results(tasks)
+
+        adhoc_results.append(dict(
+            merged,
+            title=item.title,
+            sql=item.sql,
+            info=item.info,
+            elapsed=None,
+            error=None,
+        ))
+
+    return adhoc_results
+
+
+def snapshot_config(
+    db,
+    server: str,
+    tables: Optional[List[str]] = None,
+    layers: Optional[List[str]] = None,
+    timeout: Optional[float] = None
+) -> Dict[Tuple[str, str], config_diff.TableSnapshot]:
+    """reads the memory, runtime and disk version of the config tables one
+    after another on a single connection, returns with (layer, table) ->
+    snapshot. Tables missing on older ProxySQL versions are skipped."""
+    tables = tables or list(config_diff.CONFIG_TABLES)
+    layers = layers or list(config_diff.LAYERS)
+    snapshots = {}
+    deadline = time.monotonic() + timeout if timeout else None
 
     conn, cur = db_connect(db, server=server, dictionary=False)
 
     try:
-        config = get_config()
+        for layer, table, sql in config_diff.snapshot_queries(tables, layers):
+            try:
+                with read_timeout(conn, deadline and max(deadline - time.monotonic(), 0.001)):
+                    cur.execute(sql)
+                    rows = cur.fetchall()
+            except (mysql.connector.errors.InterfaceError, mysql.connector.errors.OperationalError):
+                conn.discard()
 
-        if "adhoc_report" in config.misc.categories:
-            for item in config.misc.categories["adhoc_report"].queries:
-                cur.execute(item.sql)
-
-                adhoc_results.append({
-                    "title": item.title,
-                    "sql": item.sql,
-                    "info": item.info,
-                    "column_names": [
-                        i[0] for i in cur.description
-                    ],
-                    "rows": cur.fetchall()
-                })
-        else:
-            pass
+                raise
+            except mysql.connector.Error as e:
+                logging.warning(f"Cannot snapshot {layer} {table} on {server}: {e}")
+
+                continue
+
+            snapshots[(layer, table)] = config_diff.TableSnapshot(
+                table,
+                [i[0] for i in cur.description],
+                rows,
+                config_diff.CONFIG_TABLES[table]
+            )
     finally:
         conn.close()
 
-    return adhoc_results
+    return snapshots
+
+
+def get_config_diff(db, servers: List[str], tables: Optional[List[str]] = None) -> Dict[str, Any]:
+    """compares memory with runtime and disk on every server and, when there
+    are more servers, the runtime config of each with the first one.
+    Returns with "comparisons" = the differing tables only, "identical" = the
+    number of identical ones and "errors" = the servers that failed."""
+    tables = tables or list(config_diff.CONFIG_TABLES)
+    timeout = get_config().glob.concurrency.timeout
+
+    tasks = {server: TimedTask(timeout, snapshot_config, db, server, tables) for server in servers}
+
+    snapshots = {}
+    errors = {}
+
+    for server, task in tasks.items():
+        try:
+            snapshots[server] = task.result()
+        except FutureTimeoutError:
+            errors[server] = "Timed out after {} seconds".format(timeout)
+        except Exception as e:
+            logging.error(f"Cannot snapshot the config of {server}: {e}")
+            errors[server] = str(e)
+
+    pairs = []
+
+    for server, snapshot in snapshots.items():
+        for table in tables:
+            for layer in ("runtime", "disk"):
+                pairs.append((
+                    (server, "memory"),
+                    (server, layer),
+                    table,
+                ))
+
+    names = list(snapshots)
+
+    for server in names[1:]:
+        for table in tables:
+            pairs.append(((names[0], "runtime"), (server, "runtime"), table))
+
+    comparisons = []
+    identical = 0
+
+    for (left_server, left_layer), (right_server, right_layer), table in pairs:
+        left = snapshots[left_server].get((left_layer, table))
+        right = snapshots[right_server].get((right_layer, table))
+
+        if left is None or right is None:
+            continue
+
+        result = config_diff.diff(left, right)
+
+        if result is None:
+            identical += 1
+
+            continue
+
+        comparisons.append(dict(
+            result,
+            table=table,
+            left="{} {}".format(left_server, left_layer),
+            right="{} {}".format(right_server, right_layer),
+        ))
+
+    return {
+        "comparisons": comparisons,
+        "identical": identical,
+        "errors": errors,
+    }
+
+
+# stats_mysql_global counters and gauges kept by the stats collector
+GLOBAL_COUNTERS = (
+    "Questions",
+    "Slow_queries",
+    "Client_Connections_created",
+    "Client_Connections_aborted",
+    "Server_Connections_created",
+    "Server_Connections_aborted",
+    "Queries_backends_bytes_recv",
+    "Queries_backends_bytes_sent",
+)
+GLOBAL_GAUGES = (
+    "Active_Transactions",
+    "Client_Connections_connected",
+    "Server_Connections_connected",
+)
+POOL_COUNTERS = ("Queries", "ConnERR", "Bytes_data_sent", "Bytes_data_recv")
+POOL_GAUGES = ("ConnUsed", "ConnFree", "Latency_us")
+
+
+def sample_stats(db, server: str) -> Dict[str, Tuple[str, float]]:
+    """returns with metric -> ("counter" or "gauge", value) of a server for
+    the stats collector. Only small stats tables are read, the latency comes
+    from stats_mysql_commands_counters instead of the query digests."""
+    sample = {}
+
+    conn, cur = db_connect(db, server=server, dictionary=False)
+
+    try:
+        cur.execute("SELECT Variable_Name, Variable_Value FROM stats_mysql_global")
+
+        for name, value in cur.fetchall():
+            if name in GLOBAL_COUNTERS:
+                sample["global." + name] = ("counter", float(value))
+            elif name in GLOBAL_GAUGES:
+                sample["global." + name] = ("gauge", float(value))
+
+        cur.execute(
+            "SELECT hostgroup, srv_host, srv_port, {} FROM stats_mysql_connection_pool".format(
+                ", ".join(POOL_COUNTERS + POOL_GAUGES)
+            )
+        )
+
+        for row in cur.fetchall():
+            mysql_server = "{}/{}:{}".format(*row[:3])
+
+            for kind, names, values in (
+                ("counter", POOL_COUNTERS, row[3:3 + len(POOL_COUNTERS)]),
+                ("gauge", POOL_GAUGES, row[3 + len(POOL_COUNTERS):]),
+            ):
+                for name, value in zip(names, values):
+                    sample["pool.{}.{}".format(mysql_server, name)] = (kind, float(value))
+
+                    # totals across the backends
+                    total = sample.get("pool." + name, (kind, 0.0))[1]
+                    sample["pool." + name] = (kind, total + float(value))
+
+        cur.execute(
+            "SELECT COALESCE(SUM(Total_cnt), 0), COALESCE(SUM(Total_Time_us), 0) "
+            "FROM stats_mysql_commands_counters"
+        )
+        count, total_time = cur.fetchone()
+
+        sample["commands.count"] = ("counter", float(count))
+        sample["commands.time_us"] = ("counter", float(total_time))
+    finally:
+        conn.close()
+
+    return sample
+
+
+def refresh_digest_index(db, server: str) -> DigestIndex:
+    """returns with the digest index of a server after pulling the digests
+    seen since the last refresh, at most every digest_index.refresh seconds"""
+    index = get_digest_index(server)
+
+    # concurrent viewers wait for the running refresh instead of starting one
+    with index.lock:
+        now = time.time()
+        refresh = digest_refresh_query(index, now)
+
+        if refresh is None:
+            return index
+
+        string, params, full = refresh
+        conn, cur = db_connect(db, server=server, dictionary=False)
+
+        try:
+            cur.execute(string, params)
+            index.apply(cur.fetchall(), now, full)
+        finally:
+            conn.close()
+
+    return index
+
+
+def get_digest_index(server: str) -> DigestIndex:
+    with _digest_indexes_lock:
+        return digest_indexes.setdefault(server, DigestIndex())
+
+
+def digest_refresh_query(index: DigestIndex, now: float) -> Optional[Tuple[str, Optional[Tuple], bool]]:
+    """the statement and parameters pulling what changed since the last
+    refresh and whether it is a full one, None if the index is fresh"""
+    settings = get_config().glob.digest_index
+
+    if now - index.refreshed < settings.refresh:
+        return None
+
+    full = now - index.full_refreshed >= settings.full_refresh
+    string = "SELECT {} FROM stats_mysql_query_digest".format(", ".join(DIGEST_COLUMNS))
+    params = None
+
+    if not full:
+        string += " WHERE last_seen >= %s"
+        params = (index.watermark,)
+
+    return string, params, full
+
+
+def get_digest_report(db, server: str, window: Optional[int] = None) -> List[Dict[str, Any]]:
+    """the configured adhoc report in the execute_adhoc_report format, the
+    queries of the shipped report answered from the local digest index and
+    any other query run on the server. window = only the last N minutes of
+    the indexed sections"""
+    config = get_config()
+
+    if "adhoc_report" not in config.misc.categories:
+        return []
+
+    queries = config.misc.categories["adhoc_report"].queries
+    sections = [report_query(item.sql) for item in queries]
+    timeout = config.glob.concurrency.timeout
+
+    tasks = {
+        position: TimedTask(timeout, timed_query, db, server, item.sql)
+        for position, (item, section) in enumerate(zip(queries, sections))
+        if section is None
+    }
+
+    if len(tasks) == len(queries):
+        return [report_result(item, tasks[position], server) for position, item in enumerate(queries)]
+
+    start = time.perf_counter()
+
+    try:
+        indexed = index_sections(refresh_digest_index(db, server), sections, window)
+    except Exception as e:
+        # the other queries may still answer, like in execute_adhoc_report
+        logging.error(f"Refreshing the digest index of {server} failed: {e}")
+        indexed = index_failed(sections, str(e))
+
+    elapsed = (time.perf_counter() - start) * 1000
+
+    return [
+        report_result(item, tasks[position], server) if position in tasks
+        else indexed_result(item, *indexed[position], window, elapsed)
+        for position, item in enumerate(queries)
+    ]
+
+
+def index_sections(
+    index: DigestIndex,
+    sections: List[Optional[Tuple[str, Tuple[str, ...], Optional[int]]]],
+    window: Optional[int]
+) -> Dict[int, Tuple[List[str], List[Tuple], Optional[str]]]:
+    """position -> column names, rows and error of the sections the index
+    answers"""
+    with index.lock:
+        since = index.refreshed - window * 60 if window else None
+
+        return {
+            position: digest_section(index, *section, since) + (None,)
+            for position, section in enumerate(sections)
+            if section is not None
+        }
+
+
+def index_failed(
+    sections: List[Optional[Tuple[str, Tuple[str, ...], Optional[int]]]],
+    error: str
+) -> Dict[int, Tuple[List[str], List[Tuple], Optional[str]]]:
+    """the index_sections of a digest index that couldn't be refreshed"""
+    return {position: ([], [], error) for position, section in enumerate(sections) if section is not None}
+
+
+def indexed_result(
+    item: MiscQuery,
+    column_names: List[str],
+    rows: List[Tuple],
+    error: Optional[str],
+    window: Optional[int],
+    elapsed: float
+) -> Dict[str, Any]:
+    return {
+        "title": item.title,
+        "sql": "answered from the local digest index{}".format(
+            ", last {} minutes".format(window) if window else ""
+        ),
+        "info": item.info,
+        "column_names": column_names,
+        "rows": rows,
+        "elapsed": None if error else elapsed,
+        "error": error,
+    }
+
+
+def digest_section(
+    index: DigestIndex,
+    section: str,
+    kinds: Tuple[str, ...],
+    limit: Optional[int],
+    since: Optional[float]
+) -> Tuple[List[str], List[Tuple]]:
+    """the column names and rows of a report section, see lib.digest.report_query"""
+    if section == "schema_time":
+        return ["time_spent", "schemaname"], [
+            (sum_time, schemaname) for schemaname, _, sum_time in index.top_schemas(kinds, limit, since)
+        ]
+
+    if section == "schema_count":
+        return ["sum_count_star", "schemaname", "time_spent"], [
+            (count, schemaname, sum_time) for schemaname, count, sum_time in index.top_schemas(kinds, limit, since)
+        ]
+
+    other = "count_star" if section == "sum_time" else "sum_time"
+
+    return (
+        [section, "digest", "username", "schemaname", "digest_text", other],
+        ranked_digests(index, kinds, section, other, limit, since),
+    )
+
+
+def ranked_digests(
+    index: DigestIndex,
+    kinds: Tuple[str, ...],
+    metric: str,
+    other: str,
+    n: Optional[int],
+    since: Optional[float]
+) -> List[Tuple]:
+    """rows of (metric, digest, username, schemaname, digest_text, other)"""
+    return [
+        (
+            value,
+            entry.digest,
+            entry.username,
+            entry.schemaname,
+            entry.digest_text[:80],
+            index.value(entry, other, since),
+        )
+        for value, entry in index.top(kinds, metric, n, since)
+    ]
+
+
+def metric_families(db) -> List[metrics.Family]:
+    """the connection pool, cache and config store statistics and the
+    configured stats_mysql_global values of every server, computed at scrape
+    time for the /metrics endpoint"""
+    families = []
+
+    pool_stats = pools.stats()
+    for stat in ("in_use", "idle", "size", "checkouts", "creations", "waits", "timeouts", "evictions"):
+        families.append((
+            "proxyweb_pool_" + stat,
+            "gauge" if stat in ("in_use", "idle", "size") else "counter",
+            "Connection pool {} per server".format(stat.replace("_", " ")),
+            [({"server": server}, stats[stat]) for server, stats in pool_stats.items()],
+        ))
+
+    for name, cache in (("catalog", catalog_cache), ("columns", columns_cache)):
+        for stat, value in cache.stats().items():
+            families.append((
+                "proxyweb_{}_cache_{}".format(name, stat),
+                "gauge" if stat in ("entries", "bytes") else "counter",
+                "{} cache {}".format(name.capitalize(), stat),
+                [({}, value)],
+            ))
+
+    for stat, value in result_cache.stats().items():
+        families.append((
+            "proxyweb_result_cache_" + stat,
+            "gauge" if stat in ("entries", "bytes") else "counter",
+            "Result cache {}".format(stat),
+            [({}, value)],
+        ))
+
+    inflight_documentation = {
+        "executions": "Reads run against ProxySQL by the coalescing layer",
+        "shared": "Reads that got the result of a concurrent identical one",
+        "inflight": "Reads running right now",
+    }
+
+    for stat, value in inflight.stats().items():
+        families.append((
+            "proxyweb_inflight_" + stat,
+            "gauge" if stat == "inflight" else "counter",
+            inflight_documentation[stat],
+            [({}, value)],
+        ))
+
+    for stat, value in watch_hub.stats().items():
+        families.append((
+            "proxyweb_watch_" + stat,
+            "gauge",
+            "Watched {} in this process".format("tables" if stat == "tables" else "table viewers"),
+            [({}, value)],
+        ))
+
+    for stat, value in config.config_store.stats().items():
+        families.append((
+            "proxyweb_config_" + stat,
+            "gauge" if stat == "files" else "counter",
+            "Config store {}".format(stat),
+            [({}, value)],
+        ))
+
+    variables = get_config().glob.metrics.proxysql_global
+
+    if variables:
+        check_identifier(*variables)
+
+        result = fan_out_query(
+            db,
+            get_servers_by_tag(),
+            "SELECT Variable_Name, Variable_Value FROM stats_mysql_global WHERE Variable_Name IN ({})".format(
+                ", ".join("'{}'".format(variable) for variable in variables)
+            )
+        )
+        samples = []
+
+        for server, variable, value in result["rows"]:
+            try:
+                samples.append(({"server": server, "variable": variable}, float(value)))
+            except (TypeError, ValueError):
+                continue
+
+        families.append((
+            "proxysql_global",
+            "gauge",
+            "Selected stats_mysql_global values of every ProxySQL",
+            samples,
+        ))
+        families.append((
+            "proxysql_up",
+            "gauge",
+            "Whether the ProxySQL admin interface answered the scrape",
+            [({"server": server}, 0 if server in result["errors"] else 1) for server in get_servers_by_tag()],
+        ))
+
+    return families
+
+
+def get_servers_by_tag(tag: Optional[str] = None) -> List[str]:
+    """returns with every server, or the ones with the given tag"""
+    return [
+        name for name, server in get_config().servers.items()
+        if not tag or tag in server.tags
+    ]
 
 
 def get_servers() -> List[Server]:
@@ -210,30 +1579,182 @@ def get_read_only(server) -> bool:
 
 
 def execute_change(db, server: str, sql: str) -> Tuple[str, str]:
-    # this is a temporary solution as using the mysql.connector for
-    # certain writes ended up with weird results, ProxySQL is not a MySQL
-    # server after all. We're investigating the issue.
+    """runs every statement of the script with the configured write executor,
+    returns with the stdout and stderr like the mysql command line client"""
+    try:
+        if get_config().glob.write_executor == "cli":
+            return execute_change_cli(db, server, sql)
+
+        return execute_change_native(db, server, sql)
+    finally:
+        # also after a failed script, the statements before the error ran
+        invalidate_results(server, sql)
+
+
+def execute_change_native(db, server: str, sql: str) -> Tuple[str, str]:
+    """runs the statements one by one on a pooled connection, ProxySQL admin
+    doesn't handle multi statement packets reliably. Stops at the first error
+    just like the mysql command line client."""
+    output = []
+    error = ""
+
+    conn, cur = db_connect(
+        db,
+        server=server,
+        autocommit=True,
+        buffered=True,
+        dictionary=False
+    )
+
+    # report warnings (e.g. from LOAD ... TO RUNTIME) instead of failing on them
+    raise_on_warnings = conn.raise_on_warnings
+    conn.raise_on_warnings = False
+    conn.get_warnings = True
+
+    try:
+        for line, statement in sql_script.split_statements(sql):
+            start = time.perf_counter()
+
+            try:
+                cur.execute(statement)
+
+                rows = cur.fetchall() if cur.with_rows else []
+            except mysql.connector.Error as e:
+                error = "ERROR {} ({}) at line {}: {}\n".format(
+                    e.errno,
+                    e.sqlstate,
+                    line,
+                    e.msg
+                )
+
+                break
+
+            elapsed = (time.perf_counter() - start) * 1000
+
+            if cur.with_rows:
+                status = "{} rows in set".format(len(rows))
+            else:
+                status = "Query OK, {} rows affected".format(max(cur.rowcount, 0))
+
+            output.append("{} ({:.2f} ms): {}".format(status, elapsed, statement))
+
+            for warning in cur.fetchwarnings() or []:
+                output.append("Warning ({}): {}".format(warning[1], warning[2]))
+    finally:
+        conn.raise_on_warnings = raise_on_warnings
+        conn.close()
+
+    return "\n".join(output), error
+
+
+def import_table(
+    db,
+    server: str,
+    table: str,
+    rows: List[Dict[str, Any]],
+    mode: str = "insert",
+    load_to_runtime: bool = False,
+    batch_size: int = 500
+) -> Dict[str, Any]:
+    """writes the rows to a config table with multi-row INSERT or REPLACE
+    statements in a single transaction on one connection, "sync" replaces
+    every row of the table. Nothing is written if any statement fails. The
+    table is loaded to runtime afterwards if asked to."""
+    if table not in bulk.LOAD_COMMANDS:
+        raise ValueError(f"{table} is not an importable config table")
+
+    if mode not in bulk.MODES:
+        raise ValueError(f"Unknown import mode: {mode}")
+
+    if get_read_only(server):
+        raise ValueError(f"{server} is read only")
+
+    output = []
+    statements = 0
+    start = time.perf_counter()
+
+    conn, cur = db_connect(
+        db,
+        server=server,
+        autocommit=True,
+        buffered=True,
+        dictionary=False
+    )
+
+    raise_on_warnings = conn.raise_on_warnings
+    conn.raise_on_warnings = False
+
+    try:
+        # plain BEGIN/COMMIT, the admin interface hands them to SQLite
+        cur.execute("BEGIN")
+
+        try:
+            if mode == "sync":
+                cur.execute("DELETE FROM main.{}".format(table))
+                output.append("{} rows deleted".format(max(cur.rowcount, 0)))
+
+            for sql, first, count in bulk.insert_statements(table, rows, mode, batch_size):
+                try:
+                    cur.execute(sql)
+                except mysql.connector.Error as e:
+                    raise bulk.InvalidImport(
+                        f"Rows {first}-{first + count - 1} failed, nothing was imported: {e.msg}"
+                    )
+
+                statements += 1
+
+            cur.execute("COMMIT")
+        except BaseException:
+            try:
+                cur.execute("ROLLBACK")
+            except mysql.connector.Error as e:
+                logging.error(f"Cannot roll back the import on {server}: {e}")
+
+            raise
+
+        output.append("{} rows written with {} statements".format(len(rows), statements))
+
+        if load_to_runtime:
+            for command in bulk.LOAD_COMMANDS[table]:
+                try:
+                    cur.execute(command)
+                except mysql.connector.Error as e:
+                    raise bulk.InvalidImport(f"The rows were imported but {command} failed: {e.msg}")
+
+                output.append(command)
+    finally:
+        conn.raise_on_warnings = raise_on_warnings
+        conn.close()
+        result_cache.invalidate(server, [table, "runtime_" + table] if not load_to_runtime else None)
+
+    return {
+        "rows": len(rows),
+        "statements": statements,
+        "elapsed": (time.perf_counter() - start) * 1000,
+        "output": output,
+    }
+
+
+def execute_change_cli(db, server: str, sql: str) -> Tuple[str, str]:
+    # the original write path, shells out to the mysql command line client.
+    # Kept as a fallback for statements the connector doesn't handle well,
+    # ProxySQL is not a MySQL server after all.
 
     dsn = get_config().servers[server].dsn
-    cmd = ("mysql -h %s -P %s -u %s -p%s main -e '%s'" % (
-        dsn["host"],
-        dsn["port"],
-        dsn["user"],
-        dsn["passwd"],
-        sql
-    ))
+    cmd = [
+        "mysql",
+        "-h", dsn["host"],
+        "-P", str(dsn["port"]),
+        "-u", dsn["user"],
+        "main",
+        "-e", sql,
+    ]
     p = subprocess.Popen(
         cmd,
-        shell=True,
         stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE
+        stderr=subprocess.PIPE,
+        env=dict(os.environ, MYSQL_PWD=dsn["passwd"])
     )
     stdout, stderr = p.communicate()
 
-    return stdout.decode(), stderr.decode().replace(
-        "".join([
-            "mysql: [Warning] Using a password on the",
-            " command line interface can be insecure.\n"
-        ]),
-        ""
-    )
+    return stdout.decode(), stderr.decode()
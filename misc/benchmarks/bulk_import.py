@@ -0,0 +1,133 @@
+#!/usr/bin/python3
+
+"""Writes `rules` inactive query rules to mysql_query_rules of a configured
+server, once as one INSERT statement per rule through the write executor
+(pasting the statements into the SQL editor) and once per batch size with
+the bulk import, then deletes them again. The rules get ids from 900000 on,
+and they are never loaded to runtime.
+
+The rules have quotes, backslashes and newlines in them: every run checks
+that they are stored as they were given, and the last one that a CSV, JSON
+and YAML export of them imports back to the same export.
+
+usage: python3 misc/benchmarks/bulk_import.py [server] [rules]
+"""
+
+from collections import defaultdict
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", ".."))
+
+import mdb  # noqa: E402
+from lib import bulk  # noqa: E402
+from lib.sql import literal  # noqa: E402
+
+FIRST_ID = 900000
+COLUMNS = ["rule_id", "active", "match_digest", "destination_hostgroup", "apply", "comment"]
+
+
+def rules(count: int):
+    return [
+        {
+            "rule_id": FIRST_ID + i,
+            "active": 0,
+            "match_digest": f"^SELECT .* FROM bench_{i}\\b WHERE name = 'O\\'Brien'",
+            "destination_hostgroup": i % 4,
+            "apply": 1,
+            "comment": f"bench rule {i}\nC:\\proxysql\\rules, \"quoted\"",
+        }
+        for i in range(count)
+    ]
+
+
+def cleanup(db, server: str) -> None:
+    mdb.execute_change_native(db, server, f"DELETE FROM mysql_query_rules WHERE rule_id >= {FIRST_ID}")
+
+
+def stored(db, server: str):
+    conn, cur = mdb.db_connect(db, server=server, dictionary=False)
+
+    try:
+        cur.execute(
+            "SELECT {} FROM main.mysql_query_rules WHERE rule_id >= {} ORDER BY rule_id".format(
+                ", ".join(COLUMNS),
+                FIRST_ID
+            )
+        )
+
+        return cur.fetchall()
+    finally:
+        conn.close()
+
+
+def check(db, server: str, rows) -> None:
+    # the admin interface sends every value as text
+    expected = [tuple(str(row[column]) for column in COLUMNS) for row in rows]
+    actual = [tuple(str(value) for value in row) for row in stored(db, server)]
+
+    if actual != expected:
+        raise SystemExit(f"The stored rules differ from the imported ones, e.g. {actual[:1]} != {expected[:1]}")
+
+
+def round_trip(db, server: str) -> None:
+    for fmt in bulk.FORMATS:
+        exported = "".join(bulk.export_rows(fmt, COLUMNS, stored(db, server)))
+        mdb.import_table(db, server, "mysql_query_rules", bulk.parse_rows(exported, fmt, COLUMNS), "replace")
+        again = "".join(bulk.export_rows(fmt, COLUMNS, stored(db, server)))
+
+        if again != exported:
+            raise SystemExit(f"The {fmt.upper()} export changed after importing it")
+
+
+def statements(db, server: str, rows) -> None:
+    script = "\n".join(
+        "INSERT INTO mysql_query_rules ({}) VALUES ({});".format(
+            ", ".join(COLUMNS),
+            ", ".join(literal(row[column]) for column in COLUMNS)
+        )
+        for row in rows
+    )
+    _, stderr = mdb.execute_change_native(db, server, script)
+
+    if stderr:
+        raise SystemExit(stderr)
+
+
+def main():
+    server = sys.argv[1] if len(sys.argv) > 1 else mdb.get_config().glob.default_server
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 10000
+
+    db = defaultdict(dict)
+    rows = rules(count)
+
+    def batches(size: int) -> None:
+        mdb.import_table(db, server, "mysql_query_rules", rows, "insert", False, size)
+
+    runs = [("statements", lambda: statements(db, server, rows))] + [
+        (f"batch {size}", lambda size=size: batches(size))
+        for size in (1, 100, 500, 1000)
+    ]
+
+    for number, (label, run) in enumerate(runs, start=1):
+        cleanup(db, server)
+        start = time.perf_counter()
+
+        try:
+            run()
+            elapsed = time.perf_counter() - start
+            check(db, server, rows)
+
+            if number == len(runs):
+                round_trip(db, server)
+        finally:
+            cleanup(db, server)
+
+        print(f"{label:>12}: {elapsed:8.2f} s, {count / elapsed:10.1f} rules/s")
+
+    print("stored values and the CSV, JSON and YAML round trips match")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+#!/usr/bin/python3
+
+"""Runs the cache backends through the same tagged writes and invalidations:
+a few threads keep setting entries tagged like the results of a table while
+another one invalidates the tag, then the tag is invalidated one last time
+and no entry may be left. Prints the throughput of gets and sets too.
+
+The redis backend runs against the server at the given URL, or in process
+against fakeredis (pip install fakeredis) without one. The sqlite backend
+uses a temporary file.
+
+usage: python3 misc/benchmarks/cache_backends.py [redis url]
+       python3 misc/benchmarks/cache_backends.py redis://localhost:6379/15
+"""
+
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", ".."))
+
+from lib.backend import LocalBackend, RedisBackend, SQLiteBackend  # noqa: E402
+
+WRITERS = 4
+DURATION = 3
+ROWS = [[i, "hostname-{}".format(i), 3306, "ONLINE"] for i in range(50)]
+
+
+def redis_backend(url):
+    if url is not None:
+        return RedisBackend(url, prefix="proxyweb-bench:")
+
+    try:
+        import fakeredis
+    except ImportError:
+        raise SystemExit("Give a Redis URL or pip install fakeredis")
+
+    return RedisBackend("", client=fakeredis.FakeRedis())
+
+
+def race(backend):
+    """entries left behind by the last invalidation, and the sets done"""
+    stop = threading.Event()
+    written = set()
+    lock = threading.Lock()
+
+    def writer(number):
+        count = 0
+
+        while not stop.is_set():
+            key = "result:bench:{}:{}".format(number, count % 200)
+            backend.set(key, ROWS, 60, ["result:bench:mysql_servers"])
+            count += 1
+
+            with lock:
+                written.add(key)
+
+    def invalidator():
+        while not stop.is_set():
+            backend.invalidate(["result:bench:mysql_servers"])
+
+    threads = [threading.Thread(target=writer, args=(i,)) for i in range(WRITERS)]
+    threads.append(threading.Thread(target=invalidator))
+
+    for thread in threads:
+        thread.start()
+
+    time.sleep(DURATION)
+    stop.set()
+
+    for thread in threads:
+        thread.join()
+
+    backend.invalidate(["result:bench:mysql_servers"])
+
+    return [key for key in written if backend.get(key) is not None], len(written)
+
+
+def throughput(backend, operation, count=2000):
+    start = time.perf_counter()
+
+    for i in range(count):
+        key = "result:bench:throughput:{}".format(i % 100)
+
+        if operation == "set":
+            backend.set(key, ROWS, 60, ["result:bench:throughput"])
+        else:
+            backend.get(key)
+
+    return count / (time.perf_counter() - start)
+
+
+def main():
+    url = sys.argv[1] if len(sys.argv) > 1 else None
+    directory = tempfile.mkdtemp()
+    backends = [
+        ("local", LocalBackend(10000)),
+        ("sqlite", SQLiteBackend(os.path.join(directory, "cache.db"))),
+        ("redis" if url else "fakeredis", redis_backend(url)),
+    ]
+    failed = False
+
+    for label, backend in backends:
+        sets = throughput(backend, "set")
+        gets = throughput(backend, "get")
+        left, keys = race(backend)
+        backend.clear("result:bench:")
+        failed = failed or bool(left)
+
+        print(
+            f"{label:>10}: {sets:9.0f} sets/s, {gets:9.0f} gets/s, "
+            f"{len(left)} of {keys} keys left after invalidation"
+        )
+
+    if failed:
+        raise SystemExit("Invalidated entries survived")
+
+
+if __name__ == "__main__":
+    main()
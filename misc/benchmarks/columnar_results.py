@@ -0,0 +1,130 @@
+#!/usr/bin/python3
+
+"""Compares the memory and transfer size of a result kept as a list of tuples
+with the columnar container, on stats_mysql_query_digest like rows. The rows
+are generated like ProxySQL's admin interface sends them (every value a
+string) unless a server is given, then its digest table is read.
+
+usage: python3 misc/benchmarks/columnar_results.py [rows] [server]
+"""
+
+from collections import defaultdict
+import gc
+import gzip
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", ".."))
+
+import mdb  # noqa: E402
+from lib import columnar  # noqa: E402
+
+COLUMNS = [
+    "hostgroup", "schemaname", "username", "client_address", "digest", "digest_text", "count_star",
+    "first_seen", "last_seen", "sum_time", "min_time", "max_time", "sum_rows_affected", "sum_rows_sent",
+]
+
+
+class GeneratedCursor:
+    """Hands out fresh row tuples batch by batch like an unbuffered cursor"""
+
+    def __init__(self, rows: int):
+        self.description = [(name,) for name in COLUMNS]
+        self._rows = self._generate(rows)
+
+    @staticmethod
+    def _generate(rows: int):
+        rnd = random.Random(42)
+        now = 1700000000
+
+        for i in range(rows):
+            count = rnd.randint(1, 10 ** 6)
+            seen = now - rnd.randint(0, 86400 * 30)
+
+            yield (
+                str(rnd.choice((0, 1, 2, 10))),
+                "app_{}".format(rnd.randint(1, 20)),
+                "user_{}".format(rnd.randint(1, 10)),
+                "",
+                "0x{:016X}".format(rnd.getrandbits(64)),
+                "SELECT c{} FROM t{} WHERE id = ? AND k IN (...)".format(i % 50, i),
+                str(count),
+                str(seen),
+                str(seen + rnd.randint(0, 86400)),
+                str(count * rnd.randint(100, 5000)),
+                str(rnd.randint(50, 500)),
+                str(rnd.randint(500, 50000)),
+                "0",
+                str(count * rnd.randint(0, 10)),
+            )
+
+    def fetchmany(self, size: int):
+        return [row for _, row in zip(range(size), self._rows)]
+
+    def fetchall(self):
+        return list(self._rows)
+
+
+def server_cursor(server: str):
+    conn, cur = mdb.db_connect(defaultdict(dict), server=server, dictionary=False)
+    cur.execute("SELECT * FROM stats.stats_mysql_query_digest")
+
+    return conn, cur
+
+
+def retained(build):
+    """the result of build and the memory it keeps allocated"""
+    gc.collect()
+    tracemalloc.start()
+    result = build()
+    gc.collect()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return result, current, peak
+
+
+def html(rows) -> str:
+    return "".join(
+        "<tr>{}</tr>".format("".join('<td style="max-width:850px;">{}</td>'.format(value) for value in row))
+        for row in rows
+    )
+
+
+def sizes(label: str, data: str) -> None:
+    raw = data.encode()
+    print(f"{label:>22}: {len(raw) / 1048576:8.2f} MB, gzip {len(gzip.compress(raw, 6)) / 1048576:6.2f} MB")
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    server = sys.argv[2] if len(sys.argv) > 2 else None
+
+    def cursor():
+        return server_cursor(server)[1] if server else GeneratedCursor(count)
+
+    rows, rows_bytes, rows_peak = retained(lambda: cursor().fetchall())
+    table, table_bytes, table_peak = retained(lambda: columnar.from_cursor(cursor(), 1000))
+
+    assert list(table) == rows, "the columnar rows differ"
+
+    print(f"{len(rows)} rows")
+    print(f"{'list of tuples':>22}: {rows_bytes / 1048576:8.2f} MB retained, peak {rows_peak / 1048576:8.2f} MB")
+    print(f"{'columnar':>22}: {table_bytes / 1048576:8.2f} MB retained, peak {table_peak / 1048576:8.2f} MB")
+    print("{:>22}: {:8.1f}x less memory".format("", rows_bytes / table_bytes))
+
+    start = time.perf_counter()
+    list(table)
+    print(f"{'iterating columnar':>22}: {(time.perf_counter() - start) * 1000:8.1f} ms")
+
+    sizes("html <td> rows", html(rows))
+    sizes("json rows", json.dumps(rows))
+    sizes("json columnar", json.dumps(table.to_wire()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+#!/usr/bin/python3
+
+"""Measures a table page of a configured server without and with compression
+and the time it takes over throttled links: the time to render it plus the
+round trip plus its size at the bandwidth of the link. Also counts the
+static bytes of a repeated visit, which the long-cache URLs save.
+
+usage: python3 misc/benchmarks/compression.py [server] [database] [table]
+       python3 misc/benchmarks/compression.py proxysql stats stats_mysql_query_digest
+"""
+
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", ".."))
+
+import app  # noqa: E402
+
+# name, bandwidth in bits per second, round trip in seconds
+LINKS = (
+    ("3G", 1.6e6, 0.3),
+    ("DSL", 8e6, 0.05),
+    ("LAN", 100e6, 0.001),
+)
+
+ENCODINGS = ("identity", "gzip", "br")
+
+
+def fetch(client, path: str, encoding: str, headers=None):
+    start = time.perf_counter()
+
+    with client.get(path, headers=dict(headers or {}, **{"Accept-Encoding": encoding})) as response:
+        body = response.get_data()
+
+    return response, body, time.perf_counter() - start
+
+
+def main():
+    glob = app.mdb.get_config(app.config_file).glob
+    server = sys.argv[1] if len(sys.argv) > 1 else glob.default_server
+    database = sys.argv[2] if len(sys.argv) > 2 else "stats"
+    table = sys.argv[3] if len(sys.argv) > 3 else "stats_mysql_query_digest"
+    path = f"/{server}/{database}/{table}/"
+
+    # the full html table, not the server side paged one
+    glob.server_side_tables = False
+
+    client = app.app.test_client()
+    client.get("/")
+
+    print(f"{path}")
+
+    for encoding in ENCODINGS:
+        response, body, elapsed = fetch(client, path, encoding)
+
+        if encoding != "identity" and response.headers.get("Content-Encoding") != encoding:
+            print(f"{encoding:>9}: not available")
+
+            continue
+
+        links = ", ".join(
+            f"{name} {(elapsed + rtt + len(body) * 8 / bandwidth):6.2f} s"
+            for name, bandwidth, rtt in LINKS
+        )
+        print(f"{encoding:>9}: {len(body) / 1024:9.1f} KB in {elapsed * 1000:7.1f} ms, {links}")
+
+    # a second visit only asks for the assets it doesn't have for good yet
+    assets = re.findall(rb'(?:src|href)="(/static/[^"]+)"', fetch(client, path, "identity")[1])
+    first = repeat = 0
+
+    for asset in assets:
+        response, body, _ = fetch(client, asset.decode(), "gzip")
+        first += len(body)
+
+        if "immutable" not in response.headers.get("Cache-Control", ""):
+            etag = response.headers.get("ETag")
+            response, body, _ = fetch(client, asset.decode(), "gzip", {"If-None-Match": etag})
+            repeat += len(body)
+
+    print(f"   static: {len(assets)} assets, {first / 1024:.1f} KB on the first visit, {repeat / 1024:.1f} KB again")
+
+
+if __name__ == "__main__":
+    main()
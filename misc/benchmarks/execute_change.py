@@ -0,0 +1,54 @@
+#!/usr/bin/python3
+
+"""Compares the in-process write executor with the mysql command line client
+path on a configured server. Runs a no-op UPDATE on global_variables, so it's
+safe against any ProxySQL, e.g. the docker-compose proxysql_standalone.
+
+usage: python3 misc/benchmarks/execute_change.py [server] [iterations]
+"""
+
+from collections import defaultdict
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", ".."))
+
+import mdb  # noqa: E402
+
+SQL = (
+    "UPDATE global_variables SET variable_value=variable_value "
+    "WHERE variable_name='mysql-max_connections';"
+)
+
+
+def measure(executor, server: str, iterations: int):
+    db = defaultdict(dict)
+    timings = []
+
+    for _ in range(iterations):
+        start = time.perf_counter()
+        _, stderr = executor(db, server, SQL)
+        timings.append((time.perf_counter() - start) * 1000)
+
+        if "ERROR" in stderr:
+            raise SystemExit(stderr)
+
+    return statistics.median(timings), max(timings)
+
+
+def main():
+    server = sys.argv[1] if len(sys.argv) > 1 else mdb.get_config().glob.default_server
+    iterations = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+
+    for label, executor in (
+        ("cli", mdb.execute_change_cli),
+        ("native", mdb.execute_change_native),
+    ):
+        median, worst = measure(executor, server, iterations)
+        print(f"{label:>6}: median {median:8.2f} ms, max {worst:8.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+#!/usr/bin/python3
+
+"""Load test of the WSGI (gunicorn) and the ASGI (uvicorn) deployment: starts
+both with the same number of workers on the config in config/config.yml,
+keeps `concurrency` clients requesting the page for `duration` seconds and
+prints the throughput and latency percentiles of each.
+
+The multi-node pages show the difference best, e.g. with a few slow or
+unreachable servers in the config:
+
+usage: python3 misc/benchmarks/load_test.py [path] [concurrency] [duration]
+       python3 misc/benchmarks/load_test.py /fanout/adhoc/ 200 30
+"""
+
+import asyncio
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..")
+
+DEPLOYMENTS = (
+    ("wsgi", ["gunicorn", "-w", "2", "--threads", "2", "-b", "127.0.0.1:{port}", "wsgi:app"]),
+    ("asgi", ["uvicorn", "--workers", "2", "--host", "127.0.0.1", "--port", "{port}", "--no-access-log", "asgi:app"]),
+)
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port: int, timeout: float = 30) -> None:
+    deadline = time.monotonic() + timeout
+
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+
+            return
+        except OSError:
+            time.sleep(0.2)
+
+    raise SystemExit(f"Nothing listens on {port} after {timeout} seconds")
+
+
+async def request(port: int, path: str) -> int:
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+
+    try:
+        writer.write(f"GET {path} HTTP/1.1\r\nHost: 127.0.0.1\r\nConnection: close\r\n\r\n".encode())
+        await writer.drain()
+
+        status = int((await reader.readline()).split()[1])
+        # read the whole body, the page isn't done before that
+        while await reader.read(65536):
+            pass
+
+        return status
+    finally:
+        writer.close()
+
+
+async def client(port: int, path: str, until: float, latencies: list, errors: list) -> None:
+    while time.monotonic() < until:
+        start = time.perf_counter()
+
+        try:
+            status = await asyncio.wait_for(request(port, path), 60)
+        except Exception as e:
+            errors.append(repr(e))
+
+            continue
+
+        if status == 200:
+            latencies.append((time.perf_counter() - start) * 1000)
+        else:
+            errors.append(status)
+
+
+async def load(port: int, path: str, concurrency: int, duration: int):
+    latencies = []
+    errors = []
+    until = time.monotonic() + duration
+
+    await asyncio.gather(*(client(port, path, until, latencies, errors) for _ in range(concurrency)))
+
+    return latencies, errors
+
+
+def report(label: str, latencies: list, errors: list, duration: int) -> None:
+    if len(latencies) < 2:
+        print(f"{label}: {len(latencies)} ok, {len(errors)} errors {errors[:3]}")
+
+        return
+
+    percentiles = statistics.quantiles(latencies, n=100)
+
+    print(
+        f"{label}: {len(latencies) / duration:8.1f} req/s, "
+        f"p50 {percentiles[49]:8.1f} ms, p95 {percentiles[94]:8.1f} ms, "
+        f"p99 {percentiles[98]:8.1f} ms, errors {len(errors)}"
+    )
+
+
+def main():
+    path = sys.argv[1] if len(sys.argv) > 1 else "/fanout/adhoc/"
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    duration = int(sys.argv[3]) if len(sys.argv) > 3 else 20
+
+    for label, command in DEPLOYMENTS:
+        port = free_port()
+        server = subprocess.Popen(
+            [part.format(port=port) for part in command],
+            cwd=ROOT,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL
+        )
+
+        try:
+            wait_for_port(port)
+            # warm up the pools and caches
+            asyncio.run(load(port, path, 4, 2))
+            report(label, *asyncio.run(load(port, path, concurrency, duration)), duration)
+        finally:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+#!/usr/bin/python3
+
+"""Compares the signed session cookie of the old layout, where the catalog of
+every visited server was kept in session["dblist"], with the current one that
+only references the server.
+
+usage: python3 misc/benchmarks/session_catalog.py [servers] [iterations]
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", ".."))
+
+from flask import Flask  # noqa: E402
+from flask.sessions import SecureCookieSessionInterface  # noqa: E402
+
+# table counts of a stock ProxySQL 2.x admin interface
+SCHEMAS = {"main": 62, "disk": 45, "stats": 38, "monitor": 16, "stats_history": 14}
+
+
+def fake_catalog(server: str):
+    return {
+        database: [f"{database}_table_{i:02d}_of_{server}" for i in range(count)]
+        for database, count in SCHEMAS.items()
+    }
+
+
+def measure(serializer, session: dict, iterations: int):
+    start = time.perf_counter()
+
+    for _ in range(iterations):
+        cookie = serializer.dumps(session)
+        serializer.loads(cookie)
+
+    elapsed = time.perf_counter() - start
+
+    return len(cookie), elapsed / iterations * 1e6
+
+
+def main():
+    servers = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    iterations = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+
+    app = Flask(__name__)
+    app.secret_key = "benchmark"
+    serializer = SecureCookieSessionInterface().get_signing_serializer(app)
+
+    names = [f"proxysql{i:02d}" for i in range(servers)]
+    common = {
+        "history": ["SELECT * FROM runtime_mysql_servers"],
+        "server": names[0],
+        "database": "main",
+        "table": "global_variables",
+        "read_only": False,
+    }
+
+    before = dict(common, servers=names, dblist={name: fake_catalog(name) for name in names})
+    after = dict(common)
+
+    for label, session in (("before", before), ("after", after)):
+        size, latency = measure(serializer, session, iterations)
+        print(f"{label:>6}: cookie {size:>8} bytes, sign+verify {latency:>9.1f} us/request")
+
+
+if __name__ == "__main__":
+    main()
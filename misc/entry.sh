@@ -4,6 +4,7 @@ CONFIG="/app/config/config.yml"
 GUNICORN_PORT=5000
 GUNICORN_WORKERS=2
 GUNICORN_THREADS=2
+WEBSERVER_MODE=${WEBSERVER_MODE:-wsgi}
 
 #Generate a unique secret key for flask
 SECRET_KEY=$(cat /dev/urandom | tr -dc 'a-zA-Z0-9' | fold -w 16 | head -n 1)
@@ -21,4 +22,8 @@ if [ -n "${WEBSERVER_THREADS}" ]; then
     GUNICORN_THREADS=${WEBSERVER_THREADS}
 fi
 
-gunicorn --chdir /app wsgi:app -w ${GUNICORN_WORKERS} --threads ${GUNICORN_THREADS} -b 0.0.0.0:${GUNICORN_PORT}
+if [ "${WEBSERVER_MODE}" = "asgi" ]; then
+    uvicorn --app-dir /app asgi:app --workers ${GUNICORN_WORKERS} --host 0.0.0.0 --port ${GUNICORN_PORT}
+else
+    gunicorn --chdir /app wsgi:app -w ${GUNICORN_WORKERS} --threads ${GUNICORN_THREADS} -b 0.0.0.0:${GUNICORN_PORT}
+fi
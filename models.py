@@ -38,16 +38,242 @@ class AttrDict(Mapping):
         return self.__dict__.items()
 
 
+class PoolConfig(AttrDict):
+    size: int
+    max_idle: int
+    max_lifetime: int
+    timeout: int
+
+    def __init__(self, config):
+        super().__init__({
+            "size": config["size"] if "size" in config else 4,
+            "max_idle": config["max_idle"] if "max_idle" in config else 300,
+            "max_lifetime": config["max_lifetime"] if "max_lifetime" in config else 3600,
+            "timeout": config["timeout"] if "timeout" in config else 10,
+        })
+
+
+class ConcurrencyConfig(AttrDict):
+    workers: int
+    timeout: int
+
+    def __init__(self, config):
+        super().__init__({
+            "workers": config["workers"] if "workers" in config else 8,
+            "timeout": config["timeout"] if "timeout" in config else 30,
+        })
+
+
+class StreamingConfig(AttrDict):
+    routes: List[str]
+    chunk_size: int
+    max_rows: int
+
+    def __init__(self, config):
+        super().__init__({
+            "routes": config["routes"] if "routes" in config else ["table", "adhoc_query"],
+            "chunk_size": config["chunk_size"] if "chunk_size" in config else 500,
+            "max_rows": config["max_rows"] if "max_rows" in config else 100000,
+        })
+
+
+class CollectorConfig(AttrDict):
+    enabled: bool
+    interval: int
+    path: str
+
+    def __init__(self, config):
+        super().__init__({
+            "enabled": config["enabled"] if "enabled" in config else False,
+            "interval": config["interval"] if "interval" in config else 10,
+            "path": config["path"] if "path" in config else "config/stats.db",
+        })
+
+
+class DigestIndexConfig(AttrDict):
+    enabled: bool
+    refresh: int
+    full_refresh: int
+
+    def __init__(self, config):
+        super().__init__({
+            "enabled": config["enabled"] if "enabled" in config else False,
+            "refresh": config["refresh"] if "refresh" in config else 30,
+            "full_refresh": config["full_refresh"] if "full_refresh" in config else 600,
+        })
+
+
+class MetricsConfig(AttrDict):
+    proxysql_global: List[str]
+
+    def __init__(self, config):
+        super().__init__({
+            "proxysql_global": config["proxysql_global"] if "proxysql_global" in config else [],
+        })
+
+
+class ProfilingConfig(AttrDict):
+    enabled: bool
+    threshold: float
+    sample_interval: float
+    cprofile: bool
+    header_token: str
+    log_size: int
+    path: str
+
+    def __init__(self, config):
+        super().__init__({
+            "enabled": config["enabled"] if "enabled" in config else False,
+            "threshold": config["threshold"] if "threshold" in config else 1.0,
+            "sample_interval": config["sample_interval"] if "sample_interval" in config else 0.01,
+            "cprofile": config["cprofile"] if "cprofile" in config else False,
+            "header_token": config["header_token"] if "header_token" in config else "",
+            "log_size": config["log_size"] if "log_size" in config else 500,
+            "path": config["path"] if "path" in config else "config/slow.db",
+        })
+
+
+class WatchConfig(AttrDict):
+    interval: float
+    heartbeat: float
+    max_rows: int
+    wsgi_viewers: int
+
+    def __init__(self, config):
+        super().__init__({
+            "interval": config["interval"] if "interval" in config else 2.0,
+            "heartbeat": config["heartbeat"] if "heartbeat" in config else 15.0,
+            "max_rows": config["max_rows"] if "max_rows" in config else 5000,
+            "wsgi_viewers": config["wsgi_viewers"] if "wsgi_viewers" in config else 1,
+        })
+
+
+class BulkConfig(AttrDict):
+    batch_size: int
+
+    def __init__(self, config):
+        super().__init__({
+            "batch_size": config["batch_size"] if "batch_size" in config else 500,
+        })
+
+
+class ResultCacheTtlConfig(AttrDict):
+    config: float
+    runtime: float
+    stats: float
+
+    def __init__(self, config):
+        super().__init__({
+            "config": config["config"] if "config" in config else 30.0,
+            "runtime": config["runtime"] if "runtime" in config else 2.0,
+            "stats": config["stats"] if "stats" in config else 0.0,
+        })
+
+
+class ResultCacheConfig(AttrDict):
+    enabled: bool
+    max_entries: int
+    max_bytes: int
+    ttl: ResultCacheTtlConfig
+
+    def __init__(self, config):
+        super().__init__({
+            "enabled": config["enabled"] if "enabled" in config else True,
+            "max_entries": config["max_entries"] if "max_entries" in config else 256,
+            "max_bytes": config["max_bytes"] if "max_bytes" in config else 32 * 1024 * 1024,
+            "ttl": ResultCacheTtlConfig(config["ttl"] if "ttl" in config else {}),
+        })
+
+
+class CacheConfig(AttrDict):
+    backend: Literal["local", "sqlite", "redis"]
+    path: str
+    url: str
+    generations: str
+    max_entries: int
+    max_bytes: int
+
+    def __init__(self, config):
+        super().__init__({
+            "backend": config["backend"] if "backend" in config else "local",
+            "path": config["path"] if "path" in config else "config/cache.db",
+            "generations": config["generations"] if "generations" in config else "config/cache-generations",
+            "url": config["url"] if "url" in config else "redis://localhost:6379/0",
+            "max_entries": config["max_entries"] if "max_entries" in config else 10000,
+            "max_bytes": config["max_bytes"] if "max_bytes" in config else 64 * 1024 * 1024,
+        })
+
+
+class ColumnarConfig(AttrDict):
+    enabled: bool
+    batch_size: int
+
+    def __init__(self, config):
+        super().__init__({
+            "enabled": config["enabled"] if "enabled" in config else True,
+            "batch_size": config["batch_size"] if "batch_size" in config else 1000,
+        })
+
+
+class CompressionConfig(AttrDict):
+    enabled: bool
+    min_size: int
+    level: int
+    static_max_age: int
+
+    def __init__(self, config):
+        super().__init__({
+            "enabled": config["enabled"] if "enabled" in config else True,
+            "min_size": config["min_size"] if "min_size" in config else 1024,
+            "level": config["level"] if "level" in config else 6,
+            "static_max_age": config["static_max_age"] if "static_max_age" in config else 31536000,
+        })
+
+
 class GlobalConfig(AttrDict):
     hide_tables: bool
     default_server: str
     read_only: bool
+    catalog_ttl: int
+    server_side_tables: bool
+    write_executor: Literal["native", "cli"]
+    render_mode: Literal["development", "production"]
+    pool: PoolConfig
+    streaming: StreamingConfig
+    concurrency: ConcurrencyConfig
+    collector: CollectorConfig
+    digest_index: DigestIndexConfig
+    metrics: MetricsConfig
+    profiling: ProfilingConfig
+    watch: WatchConfig
+    bulk: BulkConfig
+    result_cache: ResultCacheConfig
+    cache: CacheConfig
+    columnar: ColumnarConfig
+    compression: CompressionConfig
 
     def __init__(self, config):
         super().__init__({
             "hide_tables": config["hide_tables"],
             "default_server": config["default_server"],
             "read_only": config["read_only"],
+            "catalog_ttl": config["catalog_ttl"] if "catalog_ttl" in config else 300,
+            "server_side_tables": config["server_side_tables"] if "server_side_tables" in config else True,
+            "write_executor": config["write_executor"] if "write_executor" in config else "native",
+            "render_mode": config["render_mode"] if "render_mode" in config else "development",
+            "pool": PoolConfig(config["pool"] if "pool" in config else {}),
+            "streaming": StreamingConfig(config["streaming"] if "streaming" in config else {}),
+            "concurrency": ConcurrencyConfig(config["concurrency"] if "concurrency" in config else {}),
+            "collector": CollectorConfig(config["collector"] if "collector" in config else {}),
+            "digest_index": DigestIndexConfig(config["digest_index"] if "digest_index" in config else {}),
+            "metrics": MetricsConfig(config["metrics"] if "metrics" in config else {}),
+            "profiling": ProfilingConfig(config["profiling"] if "profiling" in config else {}),
+            "watch": WatchConfig(config["watch"] if "watch" in config else {}),
+            "bulk": BulkConfig(config["bulk"] if "bulk" in config else {}),
+            "result_cache": ResultCacheConfig(config["result_cache"] if "result_cache" in config else {}),
+            "cache": CacheConfig(config["cache"] if "cache" in config else {}),
+            "columnar": ColumnarConfig(config["columnar"] if "columnar" in config else {}),
+            "compression": CompressionConfig(config["compression"] if "compression" in config else {}),
         })
 
 
@@ -73,6 +299,7 @@ class Server(AttrDict):
     dsn: ServerDsn
     read_only: Optional[bool]
     hide_tables: Optional[List[str]]
+    tags: List[str]
 
     def __init__(self, name, server):
         super().__init__({
@@ -80,6 +307,7 @@ class Server(AttrDict):
             "dsn": ServerDsn(server["dsn"]),
             "read_only": server["read_only"] if "read_only" in server else None,
             "hide_tables": server["hide_tables"] if "hide_tables" in server else None,
+            "tags": server["tags"] if "tags" in server else [],
         })
 
 
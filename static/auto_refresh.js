@@ -0,0 +1,66 @@
+// Polls the fingerprint of the table and refreshes it once it changed
+const autoRefresh = document.getElementById('auto-refresh-enabled');
+const autoRefreshInterval = document.getElementById('auto-refresh-interval');
+const autoRefreshKey = 'proxyweb-auto-refresh';
+
+let fingerprint = window.tableFingerprint;
+let timer = null;
+
+const refreshTable = () => {
+    const table = $('#proxywebtable').DataTable();
+
+    // server side tables reload their rows, the others the whole page
+    if (table.ajax.url()) {
+        table.ajax.reload(null, false);
+    } else {
+        window.location.reload();
+    }
+};
+
+const poll = () => {
+    // background tabs don't poll
+    if (document.hidden) {
+        return;
+    }
+
+    // stats and monitor tables change all the time, they aren't compared
+    if (!window.tableFingerprinted) {
+        refreshTable();
+
+        return;
+    }
+
+    fetch(window.tableFingerprintUrl)
+        .then((response) => response.json())
+        .then((data) => {
+            if (fingerprint !== null && data.fingerprint !== fingerprint) {
+                refreshTable();
+            }
+
+            fingerprint = data.fingerprint;
+        });
+};
+
+const schedule = () => {
+    clearInterval(timer);
+    timer = null;
+
+    localStorage.setItem(autoRefreshKey, JSON.stringify({
+        enabled: autoRefresh.checked,
+        interval: autoRefreshInterval.value,
+    }));
+
+    if (autoRefresh.checked) {
+        timer = setInterval(poll, autoRefreshInterval.value * 1000);
+    }
+};
+
+const saved = JSON.parse(localStorage.getItem(autoRefreshKey) || '{}');
+
+autoRefresh.checked = Boolean(saved.enabled);
+autoRefreshInterval.value = saved.interval || autoRefreshInterval.value;
+
+autoRefresh.addEventListener('change', schedule);
+autoRefreshInterval.addEventListener('change', schedule);
+
+schedule();
@@ -0,0 +1,56 @@
+// Decodes the columnar tables the server sends into DataTables rows
+const ProxyWebColumnar = (() => {
+    const entities = {'&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;', "'": '&#39;'};
+
+    // DataTables puts the cells in as html
+    const escapeHtml = (value) => String(value).replace(/[&<>"']/g, (char) => entities[char]);
+
+    const cell = (value, nullText) => (value === null ? nullText : escapeHtml(value));
+
+    // the display text of every row of a column
+    const decodeColumn = (column, length, nullText) => {
+        const cells = new Array(length);
+
+        if (column.type === 'dict') {
+            // every distinct value is escaped once
+            const dictionary = column.dictionary.map((value) => cell(value, nullText));
+
+            for (let i = 0; i < length; i++) {
+                cells[i] = dictionary[column.codes[i]];
+            }
+
+            return cells;
+        }
+
+        for (let i = 0; i < length; i++) {
+            cells[i] = String(column.values[i]);
+        }
+
+        (column.nulls || []).forEach((index) => {
+            cells[index] = nullText;
+        });
+
+        return cells;
+    };
+
+    const rows = (table, nullText) => {
+        const columns = table.columns.map((column) => decodeColumn(column, table.length, nullText));
+        const result = new Array(table.length);
+
+        for (let i = 0; i < table.length; i++) {
+            result[i] = columns.map((cells) => cells[i]);
+        }
+
+        return result;
+    };
+
+    // the rows of the tables embedded in the page, a streamed page has one
+    // per chunk of rows
+    const pageRows = (selector, nullText) => [].concat(
+        ...Array.from(document.querySelectorAll(selector), (node) => rows(JSON.parse(node.textContent), nullText))
+    );
+
+    const cells = (row, nullText) => row.map((value) => cell(value, nullText));
+
+    return {rows, pageRows, cells};
+})();
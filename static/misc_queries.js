@@ -126,6 +126,37 @@ const renderSqlEditor = (query) => {
 
     sqlEditorWrapper.appendChild(formRow);
 
+    // Run SELECTs on every server, or the ones with the given tag
+    const fanoutRow = document.createElement('div');
+    fanoutRow.classList.add('form-row', 'align-items-center', 'mt-2');
+
+    const fanoutCheck = document.createElement('div');
+    fanoutCheck.classList.add('form-check', 'col-auto');
+
+    const fanoutInput = document.createElement('input');
+    fanoutInput.classList.add('form-check-input');
+    fanoutInput.type = 'checkbox';
+    fanoutInput.name = 'fanout';
+    fanoutInput.id = 'fanout';
+    fanoutInput.value = '1';
+
+    const fanoutLabel = document.createElement('label');
+    fanoutLabel.classList.add('form-check-label');
+    fanoutLabel.setAttribute('for', fanoutInput.id);
+    fanoutLabel.innerText = 'Run SELECT on all servers';
+
+    fanoutCheck.appendChild(fanoutInput);
+    fanoutCheck.appendChild(fanoutLabel);
+
+    const tagInput = document.createElement('input');
+    tagInput.classList.add('form-control', 'form-control-sm', 'col-2');
+    tagInput.name = 'tag';
+    tagInput.placeholder = 'tag (optional)';
+
+    fanoutRow.appendChild(fanoutCheck);
+    fanoutRow.appendChild(tagInput);
+    sqlEditorWrapper.appendChild(fanoutRow);
+
     const submitButton = document.createElement('button');
     submitButton.type = 'submit';
     submitButton.classList.add('btn', 'btn-primary', 'mx-0', 'mt-3');
@@ -146,7 +177,6 @@ const updateInfoArea = (info) => {
     infoArea.querySelector('p').innerText = info;
 }
 
-const categories = window.miscQueries;
 const history = window.historyQueries;
 
 const createSubmenuWithItems = (label, items) => {
@@ -185,7 +215,7 @@ const createSubmenuWithItems = (label, items) => {
     return submenu;
 }
 
-const getDropdownItems = () => {
+const getDropdownItems = (categories) => {
     const dropdownItems = [];
 
     // Item with Custom SQL
@@ -229,10 +259,15 @@ const getDropdownItems = () => {
 const divider = document.createElement('li');
 divider.classList.add('dropdown-divider');
 
-getDropdownItems().forEach((item, index) => {
-    if (index !== 0) {
-        dropdown.appendChild(divider.cloneNode());
-    }
+// the queries only change with the config, the browser caches them
+fetch(window.miscQueriesUrl)
+    .then((response) => response.json())
+    .then((categories) => {
+        getDropdownItems(categories).forEach((item, index) => {
+            if (index !== 0) {
+                dropdown.appendChild(divider.cloneNode());
+            }
 
-    dropdown.appendChild(item);
-});
+            dropdown.appendChild(item);
+        });
+    });
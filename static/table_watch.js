@@ -0,0 +1,148 @@
+// Keeps the table up to date with the rows the server sends as they change
+const tableWatch = document.getElementById('table-watch-enabled');
+const tableWatchStatus = document.getElementById('table-watch-status');
+const tableWatchKey = 'proxyweb-table-watch';
+
+let source = null;
+// row id -> <tr> of the row, DataTables finds a row by its node directly
+let watchedRows = new Map();
+
+const highlight = (node) => {
+    node.classList.add('table-warning');
+    setTimeout(() => node.classList.remove('table-warning'), 2000);
+};
+
+const applySnapshot = (table, data) => {
+    // the table was altered, the page has the wrong columns
+    if (data.column_names.length !== table.columns().count()) {
+        window.location.reload();
+
+        return;
+    }
+
+    table.clear();
+    watchedRows = new Map();
+
+    data.rows.forEach(([id, row]) => {
+        watchedRows.set(id, table.row.add(ProxyWebColumnar.cells(row, 'None')).node());
+    });
+
+    table.draw(false);
+};
+
+const applyDelta = (table, data) => {
+    data.remove.forEach((id) => {
+        const node = watchedRows.get(id);
+
+        if (node) {
+            table.row(node).remove();
+            watchedRows.delete(id);
+        }
+    });
+
+    data.upsert.forEach(([id, values]) => {
+        const row = ProxyWebColumnar.cells(values, 'None');
+        const node = watchedRows.get(id);
+
+        if (node) {
+            table.row(node).data(row);
+            highlight(node);
+        } else {
+            const added = table.row.add(row).node();
+
+            watchedRows.set(id, added);
+            highlight(added);
+        }
+    });
+
+    // keep the current page, ordering and search
+    table.draw(false);
+};
+
+const onEvent = (apply) => (event) => {
+    const table = $('#proxywebtable').DataTable();
+
+    tableWatchStatus.textContent = 'updated ' + new Date().toLocaleTimeString();
+
+    // server side tables only hold one page, that page is fetched again
+    if (table.ajax.url()) {
+        if (event.type === 'delta') {
+            table.ajax.reload(null, false);
+        }
+
+        return;
+    }
+
+    apply(table, JSON.parse(event.data));
+};
+
+const stopWatch = () => {
+    if (source !== null) {
+        source.close();
+        source = null;
+    }
+
+    tableWatchStatus.textContent = '';
+};
+
+const startWatch = () => {
+    stopWatch();
+
+    source = new EventSource(window.tableWatchUrl);
+    source.addEventListener('snapshot', onEvent(applySnapshot));
+    source.addEventListener('delta', onEvent(applyDelta));
+    source.addEventListener('poll_error', (event) => {
+        tableWatchStatus.textContent = JSON.parse(event.data).message;
+    });
+    // EventSource reconnects by itself and gets a snapshot again, but not
+    // after an error response, e.g. the 503 of a worker with enough viewers
+    source.addEventListener('error', () => {
+        if (source.readyState === EventSource.CLOSED) {
+            fallBack();
+        } else {
+            tableWatchStatus.textContent = 'reconnecting...';
+        }
+    });
+};
+
+const fallBack = () => {
+    stopWatch();
+
+    // not saved, the next page load tries Live again
+    tableWatch.checked = false;
+
+    const autoRefreshToggle = document.getElementById('auto-refresh-enabled');
+
+    if (autoRefreshToggle && !autoRefreshToggle.checked) {
+        autoRefreshToggle.checked = true;
+        autoRefreshToggle.dispatchEvent(new Event('change'));
+    }
+
+    tableWatchStatus.textContent = 'Live is not available now, checking for changes instead';
+};
+
+const toggleWatch = () => {
+    localStorage.setItem(tableWatchKey, JSON.stringify({enabled: tableWatch.checked}));
+
+    if (!tableWatch.checked) {
+        stopWatch();
+
+        return;
+    }
+
+    // the live rows make polling the fingerprint pointless
+    const autoRefreshToggle = document.getElementById('auto-refresh-enabled');
+
+    if (autoRefreshToggle && autoRefreshToggle.checked) {
+        autoRefreshToggle.checked = false;
+        autoRefreshToggle.dispatchEvent(new Event('change'));
+    }
+
+    startWatch();
+};
+
+tableWatch.checked = Boolean(JSON.parse(localStorage.getItem(tableWatchKey) || '{}').enabled);
+tableWatch.addEventListener('change', toggleWatch);
+
+// the DataTable is set up on document ready
+$(document).ready(toggleWatch);